@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'subtitle_generator_app.request_profiling.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -153,11 +154,26 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    # Докачиваемая загрузка (tus)
+    'tus-resumable',
+    'upload-length',
+    'upload-metadata',
+    'upload-offset',
+    'upload-checksum',
+]
+CORS_EXPOSE_HEADERS = [
+    'location',
+    'tus-resumable',
+    'upload-offset',
+    'upload-length',
+    'upload-project-id',
+    'upload-project-status-url',
 ]
 
 from dotenv import load_dotenv
 load_dotenv()
 OPENAI_API_KEY=os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL=os.getenv('OPENAI_BASE_URL') or None
 DEMUCS_API_KEY=os.getenv('DEMUCS_API_KEY')
 
 # CELERY SETTINGS
@@ -168,3 +184,130 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 минут
+
+# CACHE SETTINGS
+# Если задан REDIS_CACHE_URL, кэш общий для всех процессов, иначе — в памяти процесса
+REDIS_CACHE_URL = os.getenv('REDIS_CACHE_URL')
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 1000},
+        }
+    }
+
+# Постраничный список проектов (/api/projects/)
+API_PROJECTS_PAGE_SIZE = 50
+API_PROJECTS_MAX_PAGE_SIZE = 200
+
+# Кэш отрендеренных субтитров
+SUBTITLE_CACHE_ALIAS = 'default'
+SUBTITLE_CACHE_TIMEOUT = 24 * 60 * 60  # 1 день
+SUBTITLE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # LRU в памяти процесса
+SUBTITLE_CACHE_MAX_ENTRY_BYTES = 8 * 1024 * 1024  # больше не кладем в общий кэш
+
+# Отдача медиафайлов фронтовым сервером после проверки доступа в Django:
+# '' — отдает Django, 'x-accel-redirect' — nginx, 'x-sendfile' — Apache/lighttpd
+MEDIA_OFFLOAD_MODE = os.getenv('MEDIA_OFFLOAD_MODE', '')
+# internal location nginx, указывающая на MEDIA_ROOT (для x-accel-redirect)
+MEDIA_OFFLOAD_PREFIX = os.getenv('MEDIA_OFFLOAD_PREFIX', '/protected-media/')
+
+# MVSEP (разделение на вокал и инструментал)
+MVSEP_BASE_URL = os.getenv('MVSEP_BASE_URL', 'https://mvsep.com/api/separation')
+MVSEP_CONNECT_TIMEOUT = 10  # секунды
+MVSEP_READ_TIMEOUT = 60  # секунды
+MVSEP_MAX_RETRIES = 5
+MVSEP_RETRY_BACKOFF = 1  # 1, 2, 4, 8... секунд между повторами
+MVSEP_POOL_SIZE = 10
+MVSEP_DOWNLOAD_WORKERS = 4  # параллельные скачивания стемов
+MVSEP_DOWNLOAD_ATTEMPTS = 3  # попытки докачки файла за одну проверку
+
+# Неблокирующий опрос MVSEP: задача проверки перепланирует себя с растущей задержкой
+SEPARATION_POLL_INITIAL_DELAY = 5  # секунды
+SEPARATION_POLL_BACKOFF = 1.5
+SEPARATION_POLL_MAX_DELAY = 60  # секунды
+SEPARATION_POLL_MAX_ATTEMPTS = 200  # ~3 часа ожидания
+SEPARATION_POLL_MAX_ERRORS = 5  # сбоев опроса подряд до пометки проекта failed
+
+# Этапы пайплайна обработки в отдельных очередях: воркеры можно запускать
+# и масштабировать по очередям (celery worker -Q separation --concurrency=...)
+CELERY_TASK_ROUTES = {
+    'subtitle_generator_app.tasks.import_audio_task': {'queue': 'import'},
+    'subtitle_generator_app.tasks.separate_audio_task': {'queue': 'separation'},
+    'subtitle_generator_app.tasks.transcribe_audio_task': {'queue': 'transcription'},
+    'subtitle_generator_app.tasks.finalize_project_task': {'queue': 'render'},
+}
+SEPARATION_TASK_TIME_LIMIT = 10 * 60  # создание задачи MVSEP или одна проверка со скачиванием
+TRANSCRIPTION_TASK_TIME_LIMIT = 30 * 60
+FINALIZE_TASK_TIME_LIMIT = 5 * 60
+AUDIO_IMPORT_TASK_TIME_LIMIT = 30 * 60
+
+# Периодические задачи (celery beat)
+CELERY_BEAT_SCHEDULE = {
+    'expire-upload-sessions': {
+        'task': 'subtitle_generator_app.tasks.expire_upload_sessions_task',
+        'schedule': 60 * 60,
+    },
+    'prune-stage-timings': {
+        'task': 'subtitle_generator_app.tasks.prune_stage_timings_task',
+        'schedule': 24 * 60 * 60,
+    },
+}
+
+# Импорт аудио по URL (project_detail с audio_url): потоковое скачивание в воркере
+AUDIO_IMPORT_MAX_BYTES = int(os.getenv('AUDIO_IMPORT_MAX_BYTES', 500 * 1024 * 1024))
+AUDIO_IMPORT_CONNECT_TIMEOUT = 10  # секунды
+AUDIO_IMPORT_READ_TIMEOUT = 60  # секунды без данных от сервера
+
+# Докачиваемая загрузка частями (tus): недокачанные файлы лежат в MEDIA_ROOT/CHUNKED_UPLOAD_DIR,
+# на той же файловой системе, что и audio/, поэтому готовый файл переносится без копирования
+CHUNKED_UPLOAD_DIR = 'uploads'
+CHUNKED_UPLOAD_MAX_BYTES = int(os.getenv('CHUNKED_UPLOAD_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+# Незавершенная загрузка без новых частей дольше этого срока удаляется (expire_uploads)
+CHUNKED_UPLOAD_EXPIRE_SECONDS = int(os.getenv('CHUNKED_UPLOAD_EXPIRE_SECONDS', 24 * 60 * 60))
+
+# Кэш результатов Whisper (по хэшу вокала и параметрам запроса)
+WHISPER_CACHE_ENABLED = os.getenv('WHISPER_CACHE_ENABLED', '1') != '0'
+WHISPER_CACHE_MAX_BYTES = 512 * 1024 * 1024  # суммарный размер JSON ответов в БД
+
+# Транскрипция длинных треков фрагментами: auto — если файл больше лимита
+# загрузки Whisper или длиннее WHISPER_CHUNK_MIN_DURATION, always, never
+WHISPER_CHUNKING = os.getenv('WHISPER_CHUNKING', 'auto')
+WHISPER_MAX_UPLOAD_BYTES = 24 * 1024 * 1024  # лимит API — 25 МБ
+WHISPER_CHUNK_MIN_DURATION = 10 * 60  # секунды
+WHISPER_CHUNK_SECONDS = 5 * 60  # целевая длина фрагмента
+WHISPER_CHUNK_SEARCH_SECONDS = 30  # где искать тихое место для разреза (конец фрагмента)
+WHISPER_CHUNK_OVERLAP_SECONDS = 1.5  # перекрытие соседних фрагментов
+WHISPER_CHUNK_WORKERS = 4  # одновременные запросы к Whisper
+
+# Вырезание тишины из вокала перед отправкой в Whisper
+WHISPER_TRIM_SILENCE = os.getenv('WHISPER_TRIM_SILENCE', '1') != '0'
+WHISPER_TRIM_THRESHOLD = 0.05  # доля между уровнем шума и громкими кадрами
+WHISPER_TRIM_MIN_SILENCE_SECONDS = 2.0  # более короткие паузы не вырезаются
+WHISPER_TRIM_PADDING_SECONDS = 0.3  # запас вокруг участков с голосом
+WHISPER_TRIM_MIN_SAVING_SECONDS = 5.0  # если экономия меньше, файл отправляется как есть
+
+# Перекодирование вокала в моно Opus 16 кГц перед отправкой в Whisper (меньше размер загрузки)
+WHISPER_TRANSCODE = os.getenv('WHISPER_TRANSCODE', '1') != '0'
+
+# Замеры этапов пайплайна (StageTiming) старше этого срока удаляются раз в сутки;
+# счетчики /metrics хранятся отдельно и от удаления не уменьшаются
+STAGE_TIMING_RETENTION_DAYS = int(os.getenv('STAGE_TIMING_RETENTION_DAYS', 30))
+
+# Заголовок Server-Timing (db, render, total) и выборочный профилинг запросов cProfile.
+# Значения можно переопределить без перезапуска в JSON файле REQUEST_PROFILE_CONTROL_FILE
+# (ключи server_timing, sample_rate, path_prefixes), он перечитывается при изменении.
+# Server-Timing раскрывает внутренние тайминги, поэтому по умолчанию выключен
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', '0') == '1'
+REQUEST_PROFILE_SAMPLE_RATE = float(os.getenv('REQUEST_PROFILE_SAMPLE_RATE', '0'))
+REQUEST_PROFILE_PATH_PREFIXES = ['/api/']
+REQUEST_PROFILE_CONTROL_FILE = os.getenv('REQUEST_PROFILE_CONTROL_FILE', os.path.join(BASE_DIR, 'profiling.json'))
+REQUEST_PROFILE_DIR = os.getenv('REQUEST_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+REQUEST_PROFILE_MAX_FILES = 200  # более старые дампы удаляются
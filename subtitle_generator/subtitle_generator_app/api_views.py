@@ -1,15 +1,29 @@
+import base64
 import os
 import uuid
 import re
 import json
-from django.http import JsonResponse, FileResponse
+from datetime import datetime, time
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db import transaction
-from .models import Project
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import content_disposition_header
+from . import chunked_upload, instrumentation
+from .models import Project, UploadSession
+from .services.hashing import file_sha256
 from .services.whisper_client import transcribe_audio_vocal
+from .tasks import process_audio_task
+from .subtitle_renderer import iter_encoded
+
+ALLOWED_AUDIO_EXTENSIONS = ['mp3', 'wav', 'm4a', 'flac', 'ogg', 'wma']
 
 def generate_clean_filename(project_name, extension):
     """Генерирует чистое имя файла на основе названия проекта без uuid"""
@@ -18,6 +32,89 @@ def generate_clean_filename(project_name, extension):
     clean_name = clean_name.replace(' ', '_')
     return f"{clean_name}.{extension}"
 
+def use_cache_param(request):
+    """Параметр use_cache=0/false отключает кэш результатов Whisper для запроса"""
+    value = request.POST.get('use_cache', request.GET.get('use_cache'))
+    if value is None:
+        return None
+    return value.lower() not in ('0', 'false', 'no')
+
+def encode_cursor(created_at, project_id):
+    """Непрозрачный курсор страницы: позиция последнего проекта (created_at, id)"""
+    payload = json.dumps([created_at.isoformat(), project_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Разбирает курсор; None, если он поврежден"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, project_id = json.loads(payload)
+        created_at = datetime.fromisoformat(created_at)
+        if timezone.is_naive(created_at) or not isinstance(project_id, int):
+            return None
+        return created_at, project_id
+    except (ValueError, TypeError):
+        return None
+
+def parse_filter_datetime(value):
+    """ISO дата-время или дата (начало дня в текущем часовом поясе) для фильтра; None при ошибке"""
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+def unsupported_file_type_response(file_extension):
+    return JsonResponse({
+        'success': False,
+        'error': f'Unsupported file type: {file_extension}. Allowed types: {", ".join(ALLOWED_AUDIO_EXTENSIONS)}'
+    }, status=400)
+
+def create_processing_project(project_name, audio_name, use_cache, upload_started):
+    """
+    Создает проект для уже сохраненного в storage аудио и ставит его обработку в очередь.
+    Файл хэшируется до транзакции: она покрывает только вставку проекта.
+    При ошибке файл остается в storage, его судьбу решает вызывающий код
+    """
+    audio_sha256 = file_sha256(default_storage.path(audio_name))
+    audio_size = default_storage.size(audio_name)
+    with transaction.atomic():
+        project = Project.objects.create(
+            name=project_name,
+            status='processing',
+            audio=audio_name,
+            audio_sha256=audio_sha256,
+            use_transcription_cache=use_cache,
+        )
+        # Задача уходит в очередь только после коммита, когда воркер уже увидит проект
+        transaction.on_commit(lambda: process_audio_task.delay(project.id))
+        # Замер пишется тоже после коммита (в том числе внешней транзакции chunked_upload.finish):
+        # ошибка записи метрик не должна откатывать создание проекта
+        transaction.on_commit(
+            lambda: instrumentation.record_stage(project.id, 'upload', upload_started, bytes_in=audio_size),
+            robust=True,
+        )
+    return project
+
+def streaming_subtitle_response(project, fmt, filename, content_type):
+    """
+    Отдает субтитры потоком: файл рендерится и кодируется частями,
+    целиком в памяти не собирается
+    """
+    response = StreamingHttpResponse(
+        iter_encoded(project.iter_subtitles(fmt)),
+        content_type=f'{content_type}; charset=utf-8'
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
 def validate_srt_format(content):
     """
     Базовая валидация формата SRT
@@ -83,7 +180,9 @@ def generate_subtitles(request):
     """
     API endpoint для генерации субтитров из аудио файла
     Принимает: multipart/form-data с полем 'audio_file' и 'project_name'
-    Возвращает: JSON с информацией о созданном проекте
+    (необязательно 'use_cache=0', чтобы не использовать кэш транскрипций)
+    Возвращает: 202 и JSON с информацией о созданном проекте и ссылкой
+    на его статус; субтитры генерируются Celery пайплайном
     """
     try:
         # Получаем данные из запроса
@@ -97,69 +196,170 @@ def generate_subtitles(request):
             }, status=400)
         
         # Валидация типа файла
-        allowed_extensions = ['mp3', 'wav', 'm4a', 'flac', 'ogg', 'wma']
         file_extension = audio_file.name.split('.')[-1].lower()
         
-        if file_extension not in allowed_extensions:
-            return JsonResponse({
-                'success': False,
-                'error': f'Unsupported file type: {file_extension}. Allowed types: {", ".join(allowed_extensions)}'
-            }, status=400)
+        if file_extension not in ALLOWED_AUDIO_EXTENSIONS:
+            return unsupported_file_type_response(file_extension)
         
-        # Создаем проект в транзакции
-        with transaction.atomic():
-            # Создаем новый проект
-            project = Project.objects.create(
-                name=project_name,
-                status='processing'
-            )
-            
-            # Генерируем уникальные имена файлов
-            audio_filename = generate_unique_filename(audio_file.name, file_extension)
-            
-            # Сохраняем аудио файл
-            project.audio.save(audio_filename, audio_file, save=False)
-            
-            # Генерируем субтитры
-            audio_path = project.get_audio_path()
-            
-            try:
-                # Используем функцию транскрибации
-                whisper_response = transcribe_audio_vocal(audio_path)
-
-                # Сохраняем whisper_response
-                project.whisper_response = whisper_response
-                project.status = 'completed'
-                project.save()
-
-                # Возвращаем успешный ответ
-                return JsonResponse({
-                    'success': True,
-                    'project_id': project.id,
-                    'project_name': project.name,
-                    'status': project.status,
-                    'audio_url': project.get_audio_url(),
-                    'created_at': project.created_at.isoformat(),
-                    'message': 'Субтитры успешно сгенерированы!'
-                }, status=201)
-                
-            except Exception as e:
-                # В случае ошибки при генерации субтитров
-                project.status = 'failed'
-                project.save()
-                
-                return JsonResponse({
-                    'success': False,
-                    'error': f'Error generating subtitles: {str(e)}',
-                    'project_id': project.id
-                }, status=500)
-                
+        upload_started = timezone.now()
+        audio_name = default_storage.save(
+            os.path.join('audio', generate_clean_filename(project_name, file_extension)), audio_file
+        )
+        try:
+            project = create_processing_project(project_name, audio_name, use_cache_param(request), upload_started)
+        except Exception:
+            default_storage.delete(audio_name)
+            raise
+
+        status_url = reverse('project_status', args=[project.id])
+        response = JsonResponse({
+            'success': True,
+            'project_id': project.id,
+            'project_name': project.name,
+            'status': project.status,
+            'status_url': status_url,
+            'audio_url': project.get_audio_url(),
+            'created_at': project.created_at.isoformat(),
+            'message': 'Проект создан, субтитры генерируются в фоне'
+        }, status=202)
+        response['Location'] = status_url
+        return response
+
     except Exception as e:
         return JsonResponse({
             'success': False,
             'error': f'Unexpected error: {str(e)}'
         }, status=500)
 
+def tus_response(status=204, **headers):
+    """Пустой ответ протокола tus с заголовками (Upload_Offset -> Upload-Offset)"""
+    response = HttpResponse(status=status)
+    response['Tus-Resumable'] = chunked_upload.TUS_VERSION
+    for name, value in headers.items():
+        response[name.replace('_', '-')] = str(value)
+    return response
+
+def tus_error(message, status):
+    response = JsonResponse({'success': False, 'error': message}, status=status)
+    response['Tus-Resumable'] = chunked_upload.TUS_VERSION
+    return response
+
+def upload_project_headers(session):
+    """Заголовки со ссылкой на проект, созданный из завершенной загрузки"""
+    if session.project_id is None:
+        return {}
+    return {
+        'Upload_Project_Id': session.project_id,
+        'Upload_Project_Status_Url': reverse('project_status', args=[session.project_id]),
+    }
+
+@csrf_exempt
+@require_http_methods(["POST", "OPTIONS"])
+def create_upload(request):
+    """
+    API endpoint для создания докачиваемой загрузки аудио (протокол tus).
+    Заголовки: Upload-Length (размер файла), Upload-Metadata (filename,
+    необязательно project_name и use_cache, значения в base64).
+    Возвращает: 201 и Location сессии, куда отправляются части PATCH запросами
+    """
+    if request.method == 'OPTIONS':
+        return tus_response(
+            Tus_Version=chunked_upload.TUS_VERSION,
+            Tus_Extension=chunked_upload.TUS_EXTENSIONS,
+            Tus_Checksum_Algorithm=','.join(chunked_upload.CHECKSUM_ALGORITHMS),
+            Tus_Max_Size=settings.CHUNKED_UPLOAD_MAX_BYTES,
+        )
+
+    try:
+        upload_length = request.headers.get('Upload-Length', '')
+        if not upload_length.isdigit():
+            return tus_error('Upload-Length header is required', 400)
+
+        metadata = chunked_upload.parse_metadata(request.headers.get('Upload-Metadata'))
+        filename = metadata.get('filename')
+        if not filename:
+            return tus_error('filename is required in Upload-Metadata', 400)
+        file_extension = filename.split('.')[-1].lower()
+        if file_extension not in ALLOWED_AUDIO_EXTENSIONS:
+            return unsupported_file_type_response(file_extension)
+
+        use_cache = metadata.get('use_cache')
+        session = chunked_upload.create_session(
+            int(upload_length),
+            filename,
+            metadata.get('project_name') or 'Untitled Project',
+            use_cache=None if use_cache is None else use_cache.lower() not in ('0', 'false', 'no'),
+        )
+        return tus_response(
+            status=201,
+            Location=reverse('upload_session', args=[session.id]),
+            Upload_Offset=0,
+        )
+
+    except chunked_upload.UploadError as e:
+        return tus_error(str(e), e.status)
+
+@csrf_exempt
+@require_http_methods(["HEAD", "PATCH", "DELETE"])
+def upload_session(request, upload_id):
+    """
+    API endpoint докачиваемой загрузки:
+    HEAD — текущее смещение (Upload-Offset), PATCH — следующая часть файла
+    (Content-Type: application/offset+octet-stream, Upload-Offset, необязательно
+    Upload-Checksum: sha256 <base64>), DELETE — отмена загрузки.
+    Когда файл загружен целиком, создается проект и запускается обработка:
+    его id и ссылка на статус приходят в заголовках Upload-Project-Id
+    и Upload-Project-Status-Url
+    """
+    try:
+        session = UploadSession.objects.get(id=upload_id)
+    except UploadSession.DoesNotExist:
+        return tus_error('Upload not found', 404)
+
+    if request.method == 'HEAD':
+        return tus_response(
+            status=200,
+            Upload_Offset=session.upload_offset,
+            Upload_Length=session.upload_length,
+            Cache_Control='no-store',
+            **upload_project_headers(session),
+        )
+
+    if request.method == 'DELETE':
+        if session.project_id is not None:
+            return tus_error('Upload is already complete', 403)
+        try:
+            chunked_upload.cancel_session(session)
+        except chunked_upload.UploadError as e:
+            return tus_error(str(e), e.status)
+        return tus_response()
+
+    try:
+        if request.content_type != 'application/offset+octet-stream':
+            return tus_error('Content-Type must be application/offset+octet-stream', 415)
+        offset = request.headers.get('Upload-Offset', '')
+        content_length = request.headers.get('Content-Length', '')
+        if not offset.isdigit() or not content_length.isdigit():
+            return tus_error('Upload-Offset and Content-Length headers are required', 400)
+
+        chunked_upload.append_chunk(
+            session, int(offset), request, int(content_length), request.headers.get('Upload-Checksum')
+        )
+
+        if session.is_complete:
+            chunked_upload.finish(
+                session,
+                generate_clean_filename(session.project_name, session.extension),
+                lambda audio_name: create_processing_project(
+                    session.project_name, audio_name, session.use_transcription_cache, session.created_at
+                ),
+            )
+
+        return tus_response(Upload_Offset=session.upload_offset, **upload_project_headers(session))
+
+    except chunked_upload.UploadError as e:
+        return tus_error(str(e), e.status)
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def get_project_status(request, project_id):
@@ -173,6 +373,7 @@ def get_project_status(request, project_id):
             'project_id': project.id,
             'project_name': project.name,
             'status': project.status,
+            'processing_stage': project.processing_stage,
             'created_at': project.created_at.isoformat(),
             'updated_at': project.updated_at.isoformat(),
         }
@@ -200,30 +401,69 @@ def get_project_status(request, project_id):
 @require_http_methods(["GET"])
 def list_projects(request):
     """
-    API endpoint для получения списка всех проектов
+    API endpoint для получения списка проектов (новые первыми), постранично.
+    Параметры: limit (по умолчанию API_PROJECTS_PAGE_SIZE), cursor (next_cursor
+    из предыдущего ответа), status (через запятую), created_after/created_before
+    (ISO дата или дата-время). Пагинация по ключу (created_at, id): страница
+    не зависит от числа пропущенных строк, и из БД читаются только нужные поля
     """
     try:
-        projects = Project.objects.all().order_by('-created_at')
-        
+        try:
+            limit = int(request.GET.get('limit', settings.API_PROJECTS_PAGE_SIZE))
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'limit must be a positive integer'}, status=400)
+        limit = min(limit, settings.API_PROJECTS_MAX_PAGE_SIZE)
+
+        projects = Project.objects.order_by('-created_at', '-id')
+
+        statuses = [status for status in request.GET.get('status', '').split(',') if status]
+        if statuses:
+            unknown = set(statuses) - {choice for choice, _ in Project.STATUS_CHOICES}
+            if unknown:
+                return JsonResponse({'success': False, 'error': f'Unknown status: {", ".join(sorted(unknown))}'}, status=400)
+            projects = projects.filter(status__in=statuses)
+
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            if request.GET.get(param):
+                moment = parse_filter_datetime(request.GET[param])
+                if moment is None:
+                    return JsonResponse({'success': False, 'error': f'{param} must be an ISO date or datetime'}, status=400)
+                projects = projects.filter(**{lookup: moment})
+
+        if request.GET.get('cursor'):
+            cursor = decode_cursor(request.GET['cursor'])
+            if cursor is None:
+                return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+            created_at, project_id = cursor
+            projects = projects.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=project_id))
+
+        # Строку сверх лимита читаем только чтобы узнать, есть ли следующая страница
+        rows = list(projects.values('id', 'name', 'status', 'audio', 'created_at', 'updated_at')[:limit + 1])
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
         projects_data = []
-        for project in projects:
+        for row in rows:
             project_data = {
-                'project_id': project.id,
-                'project_name': project.name,
-                'status': project.status,
-                'created_at': project.created_at.isoformat(),
-                'updated_at': project.updated_at.isoformat(),
+                'project_id': row['id'],
+                'project_name': row['name'],
+                'status': row['status'],
+                'created_at': row['created_at'].isoformat(),
+                'updated_at': row['updated_at'].isoformat(),
             }
             
-            if project.audio:
-                project_data['audio_url'] = project.get_audio_url()
+            if row['audio']:
+                project_data['audio_url'] = default_storage.url(row['audio'])
                 
             projects_data.append(project_data)
         
         return JsonResponse({
             'success': True,
             'projects': projects_data,
-            'total': len(projects_data)
+            'count': len(projects_data),
+            'next_cursor': encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_next else None,
         })
         
     except Exception as e:
@@ -237,6 +477,7 @@ def list_projects(request):
 def generate_subtitles_for_project(request, project_id):
     """
     API endpoint для генерации субтитров для существующего проекта
+    Параметр use_cache=0 отключает кэш транскрипций
     """
     try:
         project = Project.objects.get(id=project_id)
@@ -262,7 +503,7 @@ def generate_subtitles_for_project(request, project_id):
 
         try:
             # Используем функцию транскрибации
-            whisper_response = transcribe_audio_vocal(audio_path)
+            whisper_response = transcribe_audio_vocal(audio_path, use_cache=use_cache_param(request))
 
             # Сохраняем whisper_response
             project.whisper_response = whisper_response
@@ -308,7 +549,8 @@ def get_subtitle_content(request, project_id):
     try:
         project = Project.objects.get(id=project_id)
 
-        if not project.whisper_response:
+        # Без загрузки JSON: при попадании в кэш транскрипт не читается вовсе
+        if not project.has_transcript():
             return JsonResponse({
                 'success': False,
                 'error': 'Whisper response not found for this project'
@@ -408,14 +650,8 @@ def download_subtitle(request, project_id):
                 'error': 'Subtitles not found for this project'
             }, status=404)
 
-        # Генерируем SRT контент на лету
-        srt_content = project.get_subtitle_content()
-
-        # Создаем временный файл для скачивания
-        from io import BytesIO
-        srt_bytes = BytesIO(srt_content.encode('utf-8'))
-        response = FileResponse(srt_bytes, as_attachment=True, filename=project.get_subtitle_filename())
-        return response
+        # Отдаем субтитры потоком, рендеря их на лету
+        return streaming_subtitle_response(project, 'srt', project.get_subtitle_filename(), 'text/plain')
 
     except Project.DoesNotExist:
         return JsonResponse({
@@ -443,14 +679,8 @@ def download_srt(request, project_id):
                 'error': 'Subtitles not found for this project'
             }, status=404)
 
-        # Генерируем стандартный SRT контент на лету
-        srt_content = project.get_standard_srt_content()
-
-        # Создаем временный файл для скачивания
-        from io import BytesIO
-        srt_bytes = BytesIO(srt_content.encode('utf-8'))
-        response = FileResponse(srt_bytes, as_attachment=True, filename=project.get_subtitle_filename())
-        return response
+        # Отдаем субтитры потоком, рендеря их на лету
+        return streaming_subtitle_response(project, 'standard_srt', project.get_subtitle_filename(), 'text/plain')
 
     except Project.DoesNotExist:
         return JsonResponse({
@@ -478,14 +708,8 @@ def download_ass(request, project_id):
                 'error': 'Subtitles not found for this project'
             }, status=404)
 
-        # Генерируем ASS контент на лету
-        ass_content = project.get_ass_content()
-
-        # Создаем временный файл для скачивания
-        from io import BytesIO
-        ass_bytes = BytesIO(ass_content.encode('utf-8'))
-        response = FileResponse(ass_bytes, as_attachment=True, filename=project.get_ass_filename())
-        return response
+        # Отдаем субтитры потоком, рендеря их на лету
+        return streaming_subtitle_response(project, 'ass', project.get_ass_filename(), 'text/x-ssa')
 
     except Project.DoesNotExist:
         return JsonResponse({
@@ -496,4 +720,11 @@ def download_ass(request, project_id):
         return JsonResponse({
             'success': False,
             'error': f'Error downloading ASS subtitle: {str(e)}'
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """
+    Метрики пайплайна (длительности этапов, повторы, объем данных) в текстовом формате Prometheus
+    """
+    return HttpResponse(instrumentation.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
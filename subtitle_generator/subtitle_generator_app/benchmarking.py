@@ -0,0 +1,146 @@
+"""
+Вспомогательные функции для бенчмарков: перцентили, замер времени этапов
+Celery пайплайна и синтетические ответы Whisper для бенчмарка рендера.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from celery.signals import task_postrun, task_prerun
+
+# Задача Celery -> этап пайплайна
+TASK_STAGES = {
+    'subtitle_generator_app.tasks.process_audio_task': 'dispatch',
+    'subtitle_generator_app.tasks.separate_audio_task': 'separation',
+    'subtitle_generator_app.tasks.transcribe_audio_task': 'transcription',
+    'subtitle_generator_app.tasks.finalize_project_task': 'finalization',
+}
+
+
+def percentile(values, q):
+    """Перцентиль q (0-100) с линейной интерполяцией между соседними значениями"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """Сводка по выборке: количество, среднее, p50/p90/p99 и максимум"""
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+
+class StageTimer:
+    """
+    Считает собственное время выполнения задач пайплайна по проектам через
+    сигналы task_prerun/task_postrun. Работает в процессе, где выполняются
+    задачи (например, в eager режиме). Время вложенных задач (eager режим
+    выполняет .delay() следующего этапа внутри текущего) из родительской
+    вычитается, а повторные запуски задачи одного этапа суммируются.
+    """
+
+    def __init__(self):
+        # project_id -> этап -> секунды
+        self.durations = defaultdict(lambda: defaultdict(float))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def connect(self):
+        task_prerun.connect(self._on_prerun, weak=False)
+        task_postrun.connect(self._on_postrun, weak=False)
+        return self
+
+    def disconnect(self):
+        task_prerun.disconnect(self._on_prerun)
+        task_postrun.disconnect(self._on_postrun)
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _on_prerun(self, task=None, args=None, **kwargs):
+        # [этап, project_id, начало, время вложенных задач]
+        self._stack().append([TASK_STAGES.get(task.name), (args or [None])[0], time.perf_counter(), 0.0])
+
+    def _on_postrun(self, task=None, **kwargs):
+        stack = self._stack()
+        if not stack:
+            return
+        stage, project_id, started, nested = stack.pop()
+        elapsed = time.perf_counter() - started
+        if stack:
+            stack[-1][3] += elapsed
+        if stage is not None:
+            with self._lock:
+                self.durations[project_id][stage] += elapsed - nested
+
+    def stage_samples(self):
+        """Этап -> список длительностей по проектам"""
+        samples = defaultdict(list)
+        with self._lock:
+            for stages in self.durations.values():
+                for stage, seconds in stages.items():
+                    samples[stage].append(seconds)
+        return samples
+
+
+def make_synthetic_transcript(word_count, with_segments=True, with_pauses=True, seed=0):
+    """
+    Генерирует синтетический verbose JSON ответ Whisper из word_count слов.
+    with_segments=False оставляет только слова (рендер группирует их по 5 секунд),
+    with_pauses добавляет паузы длиннее 5 секунд (в ASS для них рисуются ноты).
+    """
+    rng = random.Random(seed)
+    words = []
+    segments = []
+    segment_start_index = 0
+    t = 0.0
+
+    def close_segment(end_index):
+        segment_words = words[segment_start_index:end_index]
+        if segment_words:
+            segments.append({
+                'id': len(segments),
+                'start': segment_words[0]['start'],
+                'end': segment_words[-1]['end'],
+                'text': ' ' + ' '.join(w['word'] for w in segment_words),
+            })
+
+    for index in range(word_count):
+        gap = rng.choice((0.05, 0.1, 0.2, 0.3))
+        long_pause = with_pauses and rng.random() < 0.01
+        if long_pause:
+            gap += rng.uniform(6, 15)
+        if with_segments and (long_pause or index - segment_start_index >= rng.randint(5, 12)):
+            close_segment(index)
+            segment_start_index = index
+
+        start = round(t + gap, 2)
+        end = round(start + rng.uniform(0.15, 0.6), 2)
+        words.append({'word': f"word{index % 1000}", 'start': start, 'end': end})
+        t = end
+
+    response = {'text': '', 'words': words}
+    if with_segments:
+        close_segment(len(words))
+        response['segments'] = segments
+    return response
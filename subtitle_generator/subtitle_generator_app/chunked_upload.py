@@ -0,0 +1,228 @@
+"""
+Докачиваемая загрузка аудио частями в стиле tus (https://tus.io/protocols/resumable-upload).
+
+Клиент создает сессию (POST с Upload-Length), узнает текущее смещение (HEAD)
+и дописывает части (PATCH с Upload-Offset и необязательным Upload-Checksum).
+Части пишутся прямо в файл MEDIA_ROOT/uploads/<id>.part, минуя обработчики
+загрузки Django. Часть с неверной контрольной суммой отрезается. Готовый файл
+переносится в audio/ через os.replace (та же файловая система, без копирования).
+
+Запись в сессию сериализуется блокировкой flock на .part файле: смещение
+перечитывается из БД уже под блокировкой, а параллельный PATCH к той же
+сессии получает 423 Locked и не трогает файл. Брошенные сессии старше
+CHUNKED_UPLOAD_EXPIRE_SECONDS удаляет expire_sessions (команда expire_uploads
+и периодическая задача expire_upload_sessions_task).
+"""
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from .models import UploadSession
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,checksum,termination'
+CHECKSUM_ALGORITHMS = {'sha256': hashlib.sha256}
+
+# Размер блока при чтении тела PATCH запроса
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Ошибка протокола загрузки с HTTP статусом ответа"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_metadata(header):
+    """Разбирает Upload-Metadata: 'ключ base64,ключ2 base64' -> dict"""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in (header or '').split(','))):
+        key, _, encoded = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(encoded, validate=True).decode('utf-8') if encoded else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f"Invalid Upload-Metadata value for {key}", 400)
+    return metadata
+
+
+def parse_checksum(header):
+    """Разбирает Upload-Checksum: 'sha256 base64' -> (hashlib объект, ожидаемый digest) или None"""
+    if not header:
+        return None
+    algorithm, _, encoded = header.strip().partition(' ')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f"Unsupported checksum algorithm: {algorithm}", 400)
+    try:
+        expected = base64.b64decode(encoded, validate=True)
+    except binascii.Error:
+        raise UploadError('Invalid Upload-Checksum value', 400)
+    return CHECKSUM_ALGORITHMS[algorithm](), expected
+
+
+def partial_path(session):
+    return os.path.join(settings.MEDIA_ROOT, settings.CHUNKED_UPLOAD_DIR, f"{session.id}.part")
+
+
+def create_session(upload_length, filename, project_name, use_cache=None):
+    """Создает сессию загрузки и пустой файл для нее"""
+    if upload_length > settings.CHUNKED_UPLOAD_MAX_BYTES:
+        raise UploadError(f"Upload is larger than {settings.CHUNKED_UPLOAD_MAX_BYTES} bytes", 413)
+    session = UploadSession.objects.create(
+        filename=filename,
+        project_name=project_name,
+        upload_length=upload_length,
+        use_transcription_cache=use_cache,
+    )
+    os.makedirs(os.path.dirname(partial_path(session)), exist_ok=True)
+    open(partial_path(session), 'wb').close()
+    return session
+
+
+@contextmanager
+def locked_file(session):
+    """Открывает .part файл сессии под эксклюзивной блокировкой flock"""
+    try:
+        f = open(partial_path(session), 'r+b')
+    except OSError:
+        raise UploadError('Upload session file is missing', 410)
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Upload is locked by another request', 423)
+        # Под блокировкой состояние сессии актуально: параллельный запрос мог его изменить
+        try:
+            session.refresh_from_db(fields=['upload_offset', 'project'])
+        except UploadSession.DoesNotExist:
+            raise UploadError('Upload not found', 404)
+        if session.project_id is not None:
+            raise UploadError('Upload is already complete', 403)
+        yield f
+
+
+def append_chunk(session, offset, stream, content_length, checksum_header=None):
+    """
+    Дописывает тело запроса в файл сессии с позиции offset и возвращает
+    новое смещение. Часть, не совпавшая с Upload-Checksum, отрезается.
+    """
+    if session.project_id is not None:
+        raise UploadError('Upload is already complete', 403)
+    checksum = parse_checksum(checksum_header)
+    with locked_file(session) as f:
+        if offset != session.upload_offset:
+            raise UploadError(f"Upload-Offset {offset} does not match current offset {session.upload_offset}", 409)
+        if offset + content_length > session.upload_length:
+            raise UploadError('Chunk exceeds Upload-Length', 413)
+
+        try:
+            written = write_chunk(f, offset, stream, content_length, checksum)
+        except OSError:
+            raise UploadError('Upload session file is missing', 410)
+        # updated_at сдвигается явно: по нему expire_sessions находит брошенные загрузки
+        UploadSession.objects.filter(id=session.id).update(upload_offset=offset + written, updated_at=timezone.now())
+        session.upload_offset = offset + written
+        return session.upload_offset
+
+
+def write_chunk(f, offset, stream, content_length, checksum):
+    """Пишет тело запроса в f с позиции offset, возвращает число записанных байт"""
+    written = 0
+    f.seek(offset)
+    # Хвост от прерванной ранее записи отрезаем
+    f.truncate()
+    while written < content_length:
+        try:
+            data = stream.read(min(READ_CHUNK_SIZE, content_length - written))
+        except OSError:
+            # Клиент оборвал соединение
+            data = b''
+        if not data:
+            break
+        if checksum is not None:
+            checksum[0].update(data)
+        f.write(data)
+        written += len(data)
+
+    # Без контрольной суммы оборванная часть сохраняется (клиент докачает остаток),
+    # с ней часть принимается только целиком
+    if checksum is not None and (written < content_length or checksum[0].digest() != checksum[1]):
+        f.truncate(offset)
+        # 460 Checksum Mismatch из спецификации tus
+        raise UploadError('Upload-Checksum does not match chunk', 460)
+    return written
+
+
+def finish(session, filename, create_project):
+    """
+    Переносит собранный файл в audio/<filename> (os.replace, без копирования)
+    и создает для него проект через create_project(audio_name). Проект и привязка
+    к сессии создаются в одной транзакции; если она не удалась, файл возвращается
+    на место и загрузку можно завершить повторным PATCH с последним смещением.
+    """
+    with locked_file(session):
+        audio_name = default_storage.get_available_name(os.path.join('audio', filename))
+        audio_path = default_storage.path(audio_name)
+        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+        os.replace(partial_path(session), audio_path)
+        try:
+            with transaction.atomic():
+                session.project = create_project(audio_name)
+                session.save(update_fields=['project', 'updated_at'])
+        except BaseException:
+            session.project = None
+            os.replace(audio_path, partial_path(session))
+            raise
+    return session.project
+
+
+def delete_session(session):
+    """Удаляет незавершенную сессию вместе с файлом"""
+    path = partial_path(session)
+    session.delete()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def cancel_session(session):
+    """
+    Удаляет незавершенную сессию под блокировкой ее файла, чтобы не удалить
+    файл посреди записи части или завершения загрузки. UploadError со статусом
+    423, если сессия сейчас занята, и 403, если загрузка уже завершена
+    """
+    try:
+        with locked_file(session):
+            delete_session(session)
+    except UploadError as e:
+        if e.status != 410:
+            raise
+        # Файла уже нет - удаляем только запись
+        session.delete()
+
+
+def expire_sessions(max_age_seconds=None):
+    """
+    Удаляет незавершенные сессии, в которые не писали дольше max_age_seconds
+    (по умолчанию CHUNKED_UPLOAD_EXPIRE_SECONDS), вместе с их файлами.
+    Возвращает число удаленных сессий.
+    """
+    if max_age_seconds is None:
+        max_age_seconds = settings.CHUNKED_UPLOAD_EXPIRE_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=max_age_seconds)
+    expired = 0
+    for session in UploadSession.objects.filter(project__isnull=True, updated_at__lt=cutoff):
+        try:
+            cancel_session(session)
+        except UploadError:
+            # Сессию прямо сейчас дописывают или завершают — не трогаем
+            continue
+        expired += 1
+    return expired
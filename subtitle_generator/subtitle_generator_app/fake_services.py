@@ -0,0 +1,320 @@
+"""
+Локальные заглушки внешних сервисов для тестов и бенчмарков без сети
+"""
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_wav(seconds=3.0, sample_rate=8000, seed=0):
+    """
+    Генерирует моно WAV: тон с паузами и немного шума (seed делает файлы
+    разными). Такой файл декодирует ffmpeg, поэтому он годится и для стемов,
+    и для исходного аудио.
+    """
+    rng = random.Random(seed)
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        # Полсекунды звука, полсекунды тишины
+        amplitude = 8000 if int(t * 2) % 2 == 0 else 0
+        sample = amplitude * math.sin(2 * math.pi * 220 * t) + rng.uniform(-50, 50)
+        frames += struct.pack('<h', int(sample))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def make_verbose_transcription(word_count=200, seed=0):
+    """Генерирует verbose JSON ответ Whisper со словами и сегментами"""
+    rng = random.Random(seed)
+    words = []
+    t = 0.0
+    for i in range(word_count):
+        t += rng.choice([0.05, 0.1, 0.3, 2.0 if rng.random() < 0.05 else 0.2])
+        duration = rng.choice([0.2, 0.3, 0.5])
+        words.append({'word': f"word{i}", 'start': round(t, 2), 'end': round(t + duration, 2)})
+        t += duration
+
+    segments = []
+    for index in range(0, len(words), 8):
+        chunk = words[index:index + 8]
+        segments.append({
+            'id': len(segments),
+            'seek': 0,
+            'start': chunk[0]['start'],
+            'end': chunk[-1]['end'],
+            'text': ' ' + ' '.join(w['word'] for w in chunk),
+            'tokens': [],
+            'temperature': 0.2,
+            'avg_logprob': -0.2,
+            'compression_ratio': 1.2,
+            'no_speech_prob': 0.01,
+        })
+
+    return {
+        'task': 'transcribe',
+        'language': 'english',
+        'duration': round(t, 2),
+        'text': ''.join(segment['text'] for segment in segments),
+        'words': words,
+        'segments': segments,
+    }
+
+
+class FakeService:
+    """
+    Базовый HTTP сервер заглушки: HTTP/1.1 keep-alive, счетчики соединений
+    и запросов, искусственная задержка ответа и доля ответов с ошибкой.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0, host='127.0.0.1', port=0):
+        # Задержка перед каждым ответом API, секунды
+        self.latency = latency
+        # Доля запросов к API, на которые отвечаем 503
+        self.failure_rate = failure_rate
+        self.failure_count = 0
+        self.connection_count = 0
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, attribute):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def _should_fail(self):
+        with self._lock:
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                self.failure_count += 1
+                return True
+            return False
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server._count('connection_count')
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_body(self, body, status=200, content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, data, status=200):
+                self.send_body(json.dumps(data).encode('utf-8'), status)
+
+            def read_body(self):
+                # Тело читаем целиком, чтобы соединение осталось живым
+                return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            def simulate_api(self):
+                """Задержка и случайный отказ; возвращает False, если ответ уже отправлен"""
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._should_fail():
+                    self.send_json({'success': False, 'error': {'message': 'Service unavailable'}}, status=503)
+                    return False
+                return True
+
+            def do_GET(self):
+                server._count('request_count')
+                server.handle_get(self, urlparse(self.path))
+
+            def do_POST(self):
+                server._count('request_count')
+                body = self.read_body()
+                server.handle_post(self, urlparse(self.path), body)
+
+        return Handler
+
+    def handle_get(self, handler, parsed):
+        handler.send_body(b'', status=404)
+
+    def handle_post(self, handler, parsed, body):
+        handler.send_body(b'', status=404)
+
+
+class FakeMVSEPServer(FakeService):
+    """
+    HTTP сервер, имитирующий API mvsep.com/api/separation (create/get)
+    и отдачу файлов стемов. Считает TCP соединения и запросы.
+    """
+
+    def __init__(self, stems=None, processing_polls=1, truncate_first_download=None, **options):
+        # Имя файла -> содержимое
+        self.stems = stems or {
+            'song_vocals.mp3': b'ID3' + b'\x00' * 4096,
+            'song_other.mp3': b'ID3' + b'\x01' * 4096,
+        }
+        # Сколько раз /get ответит "processing" перед выдачей файлов
+        self.processing_polls = processing_polls
+        # Если задано, первое скачивание каждого файла обрывается после стольких байт
+        self.truncate_first_download = truncate_first_download
+        # Заголовки Range, пришедшие при скачивании файлов
+        self.range_requests = []
+        self._truncated = set()
+        self._polls = {}
+        self._jobs = 0
+        super().__init__(**options)
+
+    @property
+    def base_url(self):
+        return f"{self.url}/api/separation"
+
+    def _create_job(self):
+        with self._lock:
+            self._jobs += 1
+            task_hash = f"fake-{self._jobs}"
+            self._polls[task_hash] = 0
+        return task_hash
+
+    def _poll(self, task_hash):
+        with self._lock:
+            if task_hash not in self._polls:
+                return None
+            self._polls[task_hash] += 1
+            return self._polls[task_hash]
+
+    def _should_truncate(self, name):
+        with self._lock:
+            if self.truncate_first_download is None or name in self._truncated:
+                return False
+            self._truncated.add(name)
+            return True
+
+    def send_file(self, handler, name, content):
+        range_header = handler.headers.get('Range')
+        start = 0
+        if range_header and range_header.startswith('bytes='):
+            with self._lock:
+                self.range_requests.append(range_header)
+            start = int(range_header[6:].split('-', 1)[0])
+            if start >= len(content):
+                handler.send_body(b'', status=416, headers={'Content-Range': f"bytes */{len(content)}"})
+                return
+
+        body = content[start:]
+        handler.send_response(206 if start else 200)
+        handler.send_header('Content-Type', 'audio/mpeg')
+        handler.send_header('Content-Length', str(len(body)))
+        if start:
+            handler.send_header('Content-Range', f"bytes {start}-{len(content) - 1}/{len(content)}")
+        handler.end_headers()
+
+        if self._should_truncate(name):
+            # Имитируем обрыв соединения посреди файла
+            handler.wfile.write(body[:self.truncate_first_download])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        handler.wfile.write(body)
+
+    def handle_post(self, handler, parsed, body):
+        if not parsed.path.endswith('/create'):
+            handler.send_json({'success': False, 'message': 'Not found'}, status=404)
+            return
+        if handler.simulate_api():
+            handler.send_json({'success': True, 'data': {'hash': self._create_job()}})
+
+    def handle_get(self, handler, parsed):
+        if parsed.path.endswith('/get'):
+            if not handler.simulate_api():
+                return
+            task_hash = parse_qs(parsed.query).get('hash', [''])[0]
+            polls = self._poll(task_hash)
+            if polls is None:
+                handler.send_json({'success': False, 'message': 'Unknown hash'})
+            elif polls <= self.processing_polls:
+                handler.send_json({'success': True, 'data': {'status': 'processing'}})
+            else:
+                files = [
+                    {'url': f"{self.url}/files/{name}", 'download': name}
+                    for name in self.stems
+                ]
+                handler.send_json({'success': True, 'data': {'status': 'done', 'files': files}})
+            return
+
+        if parsed.path.startswith('/files/'):
+            name = parsed.path[len('/files/'):]
+            content = self.stems.get(name)
+            if content is None:
+                handler.send_body(b'', status=404)
+            else:
+                self.send_file(handler, name, content)
+            return
+
+        handler.send_body(b'', status=404)
+
+
+class FakeWhisperServer(FakeService):
+    """
+    HTTP сервер, имитирующий OpenAI POST /v1/audio/transcriptions:
+    на любой файл отвечает заранее заданным verbose JSON.
+    Клиент OpenAI подключается к нему через base_url = server.base_url.
+    """
+
+    def __init__(self, transcription=None, **options):
+        self.transcription = transcription or make_verbose_transcription()
+        # Сколько байт тел запросов (multipart с файлом) получено
+        self.received_bytes = 0
+        super().__init__(**options)
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def handle_post(self, handler, parsed, body):
+        if not parsed.path.endswith('/audio/transcriptions'):
+            handler.send_json({'error': {'message': 'Not found'}}, status=404)
+            return
+        with self._lock:
+            self.received_bytes += len(body)
+        if handler.simulate_api():
+            handler.send_json(self.transcription)
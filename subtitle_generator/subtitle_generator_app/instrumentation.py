@@ -0,0 +1,177 @@
+"""
+Замер этапов обработки проекта и метрики в формате Prometheus.
+
+Каждый этап (загрузка, отправка в MVSEP, ожидание и скачивание стемов,
+транскрипция, финализация) сохраняется в StageTiming: время начала и конца,
+объем данных и число повторов. Записи хранятся STAGE_TIMING_RETENTION_DAYS
+дней и удаляются вместе с проектом, поэтому /metrics строится не по ним,
+а по накопленным счетчикам StageCounter, которые только растут.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from . import transcription_cache
+from .models import Project, StageCounter, StageTiming
+
+# Границы корзин гистограммы длительности этапов, секунды
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def record_stage(project_id, stage, started_at, finished_at=None, bytes_in=None, bytes_out=None,
+                 retries=0, success=True, error=''):
+    """Сохраняет замер этапа и добавляет его к счетчикам этапа"""
+    finished_at = finished_at or timezone.now()
+    timing = StageTiming.objects.create(
+        project_id=project_id,
+        stage=stage,
+        started_at=started_at,
+        finished_at=finished_at,
+        duration_seconds=max((finished_at - started_at).total_seconds(), 0.0),
+        bytes_in=bytes_in,
+        bytes_out=bytes_out,
+        retries=retries,
+        success=success,
+        error=error[:1000],
+    )
+    count_stage(timing)
+    return timing
+
+
+def count_stage(timing):
+    """Добавляет замер к StageCounter его этапа и корзины длительности (одним UPDATE)"""
+    bucket = bisect_left(DURATION_BUCKETS, timing.duration_seconds)
+    amounts = {
+        'runs': 1,
+        'failures': 0 if timing.success else 1,
+        'duration_seconds': timing.duration_seconds,
+        'retries': timing.retries,
+        'bytes_in': timing.bytes_in or 0,
+        'bytes_out': timing.bytes_out or 0,
+    }
+    increments = {field: F(field) + value for field, value in amounts.items()}
+    counters = StageCounter.objects.filter(stage=timing.stage, bucket=bucket)
+    if counters.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            StageCounter.objects.create(stage=timing.stage, bucket=bucket, **amounts)
+    except IntegrityError:
+        # Строку успел создать параллельный воркер
+        counters.update(**increments)
+
+
+def prune_stage_timings(retention_days=None):
+    """Удаляет замеры старше STAGE_TIMING_RETENTION_DAYS, возвращает их число"""
+    if retention_days is None:
+        retention_days = settings.STAGE_TIMING_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = StageTiming.objects.filter(started_at__lt=cutoff).delete()
+    return deleted
+
+
+@contextmanager
+def stage_timer(project_id, stage, retries=0):
+    """
+    Замеряет этап в блоке with. В блоке можно заполнить объем данных:
+    timing['bytes_in'] / timing['bytes_out']. Исключение записывается
+    как неуспешный этап и пробрасывается дальше.
+    """
+    timing = {'bytes_in': None, 'bytes_out': None}
+    started_at = timezone.now()
+    try:
+        yield timing
+    except Exception as exc:
+        record_stage(project_id, stage, started_at, retries=retries, success=False, error=str(exc), **timing)
+        raise
+    record_stage(project_id, stage, started_at, retries=retries, **timing)
+
+
+def last_finished_at(project_id, stage):
+    """Время окончания последнего успешного замера этапа проекта"""
+    return (
+        StageTiming.objects
+        .filter(project_id=project_id, stage=stage, success=True)
+        .order_by('-finished_at')
+        .values_list('finished_at', flat=True)
+        .first()
+    )
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def _format_bound(bound):
+    return f"{bound:g}"
+
+
+def render_metrics():
+    """Метрики пайплайна в текстовом формате Prometheus"""
+    lines = []
+
+    stages = {}
+    for counter in StageCounter.objects.order_by('stage', 'bucket'):
+        row = stages.setdefault(counter.stage, {
+            'buckets': [0] * (len(DURATION_BUCKETS) + 1),
+            'total': 0, 'failed': 0, 'seconds': 0.0, 'retries': 0, 'bytes_in': 0, 'bytes_out': 0,
+        })
+        row['buckets'][min(counter.bucket, len(DURATION_BUCKETS))] += counter.runs
+        row['total'] += counter.runs
+        row['failed'] += counter.failures
+        row['seconds'] += counter.duration_seconds
+        row['retries'] += counter.retries
+        row['bytes_in'] += counter.bytes_in
+        row['bytes_out'] += counter.bytes_out
+
+    lines += [
+        '# HELP subtitle_pipeline_stage_duration_seconds Duration of pipeline stages.',
+        '# TYPE subtitle_pipeline_stage_duration_seconds histogram',
+    ]
+    for stage, row in stages.items():
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, row['buckets']):
+            cumulative += count
+            labels = _labels(stage=stage, le=_format_bound(bound))
+            lines.append(f"subtitle_pipeline_stage_duration_seconds_bucket{labels} {cumulative}")
+        lines.append(f"subtitle_pipeline_stage_duration_seconds_bucket{_labels(stage=stage, le='+Inf')} {row['total']}")
+        lines.append(f"subtitle_pipeline_stage_duration_seconds_sum{_labels(stage=stage)} {row['seconds']}")
+        lines.append(f"subtitle_pipeline_stage_duration_seconds_count{_labels(stage=stage)} {row['total']}")
+
+    counters = [
+        ('subtitle_pipeline_stage_runs_total', 'Pipeline stage runs by result.', None),
+        ('subtitle_pipeline_stage_retries_total', 'Retries recorded by pipeline stages.', 'retries'),
+        ('subtitle_pipeline_stage_bytes_in_total', 'Bytes received by pipeline stages.', 'bytes_in'),
+        ('subtitle_pipeline_stage_bytes_out_total', 'Bytes sent or produced by pipeline stages.', 'bytes_out'),
+    ]
+    for name, help_text, field in counters:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for stage, row in stages.items():
+            if field is None:
+                lines.append(f"{name}{_labels(stage=stage, result='success')} {row['total'] - row['failed']}")
+                lines.append(f"{name}{_labels(stage=stage, result='failure')} {row['failed']}")
+            else:
+                lines.append(f"{name}{_labels(stage=stage)} {row[field]}")
+
+    lines += ['# HELP subtitle_projects Projects by status.', '# TYPE subtitle_projects gauge']
+    status_counts = dict(Project.objects.values_list('status').annotate(count=Count('id')).order_by())
+    for status, _ in Project.STATUS_CHOICES:
+        lines.append(f"subtitle_projects{_labels(status=status)} {status_counts.get(status, 0)}")
+
+    cache_stats = transcription_cache.stats()
+    lines += [
+        '# HELP subtitle_transcription_cache_hits_total Transcription cache hits.',
+        '# TYPE subtitle_transcription_cache_hits_total counter',
+        f"subtitle_transcription_cache_hits_total {cache_stats['hits']}",
+        '# HELP subtitle_transcription_cache_misses_total Transcription cache misses.',
+        '# TYPE subtitle_transcription_cache_misses_total counter',
+        f"subtitle_transcription_cache_misses_total {cache_stats['misses']}",
+        '# HELP subtitle_transcription_cache_bytes Size of cached transcriptions.',
+        '# TYPE subtitle_transcription_cache_bytes gauge',
+        f"subtitle_transcription_cache_bytes {cache_stats['size_bytes']}",
+    ]
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,186 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from subtitle_generator.celery import app as celery_app
+from subtitle_generator_app import stem_cache, subtitle_cache, tasks
+from subtitle_generator_app.benchmarking import StageTimer, summarize
+from subtitle_generator_app.fake_services import FakeMVSEPServer, FakeWhisperServer, make_wav
+from subtitle_generator_app.models import Project, StageTiming
+from subtitle_generator_app.services import demucs_client, whisper_client
+from openai import OpenAI
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет N проектов через Celery пайплайн против локальных заглушек '
+        'MVSEP и Whisper и выводит пропускную способность и перцентили задержек по этапам'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=10)
+        parser.add_argument(
+            '--mode', choices=['eager', 'worker'], default='eager',
+            help='eager — задачи выполняются в этом процессе с заглушками; '
+                 'worker — через брокер и запущенные воркеры (заглушки: run_fake_services)'
+        )
+        parser.add_argument('--concurrency', type=int, default=4, help='Параллельные проекты в eager режиме')
+        parser.add_argument('--audio-seconds', type=float, default=10.0)
+        parser.add_argument('--mvsep-latency', type=float, default=0.05)
+        parser.add_argument('--whisper-latency', type=float, default=0.2)
+        parser.add_argument('--failure-rate', type=float, default=0.0)
+        parser.add_argument('--processing-polls', type=int, default=2)
+        parser.add_argument('--use-cache', action='store_true', help='Не отключать кэш транскрипций')
+        parser.add_argument('--timeout', type=float, default=600.0, help='Ожидание воркеров (worker режим), с')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные проекты')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        projects = self.create_projects(options['projects'], options['audio_seconds'])
+        try:
+            if options['mode'] == 'eager':
+                report = self.run_eager(projects, options)
+            else:
+                report = self.run_worker(projects, options)
+        finally:
+            if not options['keep']:
+                self.cleanup(projects)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def create_projects(self, count, audio_seconds):
+        """Создает проекты с разным аудио (чтобы не срабатывал кэш стемов)"""
+        projects = []
+        for index in range(count):
+            project = Project.objects.create(name=f"Benchmark {index + 1}")
+            project.audio.save(f"benchmark_{index + 1}.wav", ContentFile(make_wav(audio_seconds, seed=100 + index)), save=False)
+            project.update_audio_sha256()
+            project.save()
+            projects.append(project)
+        return projects
+
+    def cleanup(self, projects):
+        for project in Project.objects.filter(id__in=[p.id for p in projects]):
+            stem_cache.release(project)
+            if project.audio:
+                project.audio.delete(save=False)
+            project.delete()
+            subtitle_cache.invalidate_project(project.id)
+
+    @contextmanager
+    def eager_pipeline(self, mvsep, whisper):
+        """Eager Celery и клиенты MVSEP/Whisper, направленные на заглушки"""
+        original = (demucs_client.BASE_URL, whisper_client.client, celery_app.conf.task_always_eager)
+        demucs_client.BASE_URL = mvsep.base_url
+        whisper_client.client = OpenAI(api_key='benchmark', base_url=whisper.base_url)
+        celery_app.conf.task_always_eager = True
+        try:
+            yield
+        finally:
+            demucs_client.BASE_URL, whisper_client.client, celery_app.conf.task_always_eager = original
+
+    def run_project(self, project_id):
+        started = time.perf_counter()
+        try:
+            tasks.process_audio_task.delay(project_id)
+        finally:
+            connection.close()
+        return time.perf_counter() - started
+
+    def run_eager(self, projects, options):
+        stems = {
+            'bench_vocals.mp3': make_wav(options['audio_seconds'], seed=1),
+            'bench_other.mp3': make_wav(options['audio_seconds'], seed=2),
+        }
+        mvsep = FakeMVSEPServer(
+            stems=stems,
+            processing_polls=options['processing_polls'],
+            latency=options['mvsep_latency'],
+            failure_rate=options['failure_rate'],
+        )
+        whisper = FakeWhisperServer(latency=options['whisper_latency'], failure_rate=options['failure_rate'])
+
+        with mvsep, whisper, StageTimer() as timer, self.eager_pipeline(mvsep, whisper), \
+                override_settings(WHISPER_CACHE_ENABLED=options['use_cache']):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                latencies = list(executor.map(self.run_project, [project.id for project in projects]))
+            wall_seconds = time.perf_counter() - started
+
+        return self.build_report(projects, wall_seconds, latencies, timer.stage_samples(), {
+            'mvsep': {'requests': mvsep.request_count, 'failures': mvsep.failure_count, 'connections': mvsep.connection_count},
+            'whisper': {'requests': whisper.request_count, 'failures': whisper.failure_count, 'received_bytes': whisper.received_bytes},
+        })
+
+    def run_worker(self, projects, options):
+        """
+        Отправляет проекты в брокер и опрашивает БД до завершения. Время этапов
+        берется из записей StageTiming, которые пишут воркеры.
+        """
+        dispatched = {}
+        latencies = []
+
+        started = time.perf_counter()
+        for project in projects:
+            dispatched[project.id] = time.perf_counter()
+            tasks.process_audio_task.delay(project.id)
+
+        pending = set(dispatched)
+        while pending and time.perf_counter() - started < options['timeout']:
+            now = time.perf_counter()
+            for row in Project.objects.filter(id__in=pending, status__in=('completed', 'failed')).values('id'):
+                latencies.append(now - dispatched[row['id']])
+                pending.discard(row['id'])
+            time.sleep(0.2)
+        wall_seconds = time.perf_counter() - started
+
+        stage_samples = {}
+        timings = StageTiming.objects.filter(project_id__in=dispatched).values_list('stage', 'duration_seconds')
+        for stage, seconds in timings:
+            stage_samples.setdefault(stage, []).append(seconds)
+
+        report = self.build_report(projects, wall_seconds, latencies, stage_samples, {})
+        report['timed_out'] = len(pending)
+        return report
+
+    def build_report(self, projects, wall_seconds, latencies, stage_samples, services):
+        statuses = list(Project.objects.filter(id__in=[p.id for p in projects]).values_list('status', flat=True))
+        completed = statuses.count('completed')
+        return {
+            'projects': len(projects),
+            'completed': completed,
+            'failed': statuses.count('failed'),
+            'wall_seconds': wall_seconds,
+            'throughput_per_minute': completed / wall_seconds * 60 if wall_seconds else 0.0,
+            'latency': {
+                'end_to_end': summarize(latencies),
+                **{stage: summarize(samples) for stage, samples in stage_samples.items()},
+            },
+            'services': services,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"Проекты: {report['projects']} (completed {report['completed']}, failed {report['failed']}"
+            + (f", не дождались {report['timed_out']}" if report.get('timed_out') else '') + ')'
+        )
+        self.stdout.write(
+            f"Время: {report['wall_seconds']:.2f} с, пропускная способность: "
+            f"{report['throughput_per_minute']:.1f} проектов/мин"
+        )
+        self.stdout.write(f"{'этап':<22}{'n':>5}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for stage, stats in report['latency'].items():
+            if not stats['count']:
+                continue
+            self.stdout.write(
+                f"{stage:<22}{stats['count']:>5}"
+                + ''.join(f"{stats[key]:>9.3f}" for key in ('mean', 'p50', 'p90', 'p99', 'max'))
+            )
+        for name, counters in report['services'].items():
+            self.stdout.write(f"{name}: " + ', '.join(f"{key}={value}" for key, value in counters.items()))
@@ -0,0 +1,132 @@
+import gc
+import json
+import os
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from subtitle_generator_app import subtitle_renderer
+from subtitle_generator_app.benchmarking import make_synthetic_transcript
+
+DEFAULT_BASELINE = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks', 'renderer_baseline.json'))
+
+# Варианты транскрипта: (имя, есть ли segments, есть ли длинные паузы)
+VARIANTS = [
+    ('segments', True, False),
+    ('segments+pauses', True, True),
+    ('words', False, False),
+    ('words+pauses', False, True),
+]
+
+# Абсолютные пороги шума: замедление или рост памяти меньше этого не считается регрессией
+MIN_REGRESSION_SECONDS = 0.005
+MIN_REGRESSION_BYTES = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Микробенчмарк рендера субтитров на синтетических транскриптах: время и пиковая '
+        'память разбора и каждого writer\'а, сравнение с сохраненным baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,100000,1000000', help='Число слов через запятую')
+        parser.add_argument('--formats', default=','.join(subtitle_renderer.WRITERS))
+        parser.add_argument('--repeat', type=int, default=5, help='Повторы замера времени (берется лучший)')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--save-baseline', action='store_true', help='Сохранить результат как baseline')
+        parser.add_argument('--time-tolerance', type=float, default=0.5, help='Допустимое замедление (доля)')
+        parser.add_argument('--memory-tolerance', type=float, default=0.10, help='Допустимый рост пиковой памяти (доля)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        formats = options['formats'].split(',')
+        unknown = set(formats) - set(subtitle_renderer.WRITERS)
+        if unknown:
+            raise CommandError(f"Unknown subtitle formats: {', '.join(sorted(unknown))}")
+
+        results = {}
+        for size in sizes:
+            # Большие транскрипты меряем один раз, иначе прогон занимает десятки минут
+            repeat = options['repeat'] if size <= 10000 else 1
+            for variant, with_segments, with_pauses in VARIANTS:
+                response = make_synthetic_transcript(size, with_segments=with_segments, with_pauses=with_pauses)
+                timeline_result, timeline = self.measure(lambda: subtitle_renderer.build_timeline(response), repeat)
+                results[f"{size}:{variant}:timeline"] = timeline_result
+                for fmt in formats:
+                    result, output_bytes = self.measure(lambda: self.consume(timeline, fmt), repeat)
+                    result['output_bytes'] = output_bytes
+                    results[f"{size}:{variant}:{fmt}"] = result
+                    if not options['json']:
+                        self.print_result(f"{size}:{variant}:{fmt}", result)
+                del response, timeline
+                gc.collect()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['baseline'])), exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(f"Baseline сохранен: {options['baseline']}")
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(f"Baseline {options['baseline']} не найден, сравнение пропущено")
+            return
+
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        regressions = self.compare(results, baseline, options['time_tolerance'], options['memory_tolerance'])
+        if regressions:
+            raise CommandError("Регрессии относительно baseline:\n" + "\n".join(regressions))
+        self.stdout.write('Регрессий относительно baseline нет')
+
+    def consume(self, timeline, fmt):
+        """Рендерит формат потоком (как при отдаче файла), не собирая строку целиком"""
+        return sum(len(chunk.encode('utf-8')) for chunk in subtitle_renderer.iter_render(timeline, fmt))
+
+    def measure(self, func, repeat):
+        """Лучшее время из repeat запусков и пиковая память отдельного запуска под tracemalloc"""
+        best = None
+        value = None
+        for _ in range(repeat):
+            gc.collect()
+            started = time.perf_counter()
+            value = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {'seconds': round(best, 6), 'peak_bytes': peak}, value
+
+    def compare(self, results, baseline, time_tolerance, memory_tolerance):
+        regressions = []
+        for key, result in sorted(results.items()):
+            expected = baseline.get(key)
+            if expected is None:
+                continue
+            seconds_limit = expected['seconds'] * (1 + time_tolerance)
+            if result['seconds'] > seconds_limit and result['seconds'] - expected['seconds'] > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{key}: время {result['seconds']:.4f} с > {expected['seconds']:.4f} с")
+            memory_limit = expected['peak_bytes'] * (1 + memory_tolerance)
+            if result['peak_bytes'] > memory_limit and result['peak_bytes'] - expected['peak_bytes'] > MIN_REGRESSION_BYTES:
+                regressions.append(f"{key}: память {result['peak_bytes']} Б > {expected['peak_bytes']} Б")
+            if 'output_bytes' in expected and result.get('output_bytes') != expected['output_bytes']:
+                regressions.append(f"{key}: размер вывода {result.get('output_bytes')} Б != {expected['output_bytes']} Б")
+        return regressions
+
+    def print_result(self, key, result):
+        self.stdout.write(
+            f"{key:<40}{result['seconds'] * 1000:>12.2f} мс"
+            f"{result['peak_bytes'] / 1024:>12.0f} КБ{result['output_bytes'] / 1024:>12.0f} КБ"
+        )
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from subtitle_generator_app import chunked_upload
+
+
+class Command(BaseCommand):
+    help = 'Удаляет незавершенные докачиваемые загрузки, в которые давно не писали, вместе с их файлами'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=settings.CHUNKED_UPLOAD_EXPIRE_SECONDS,
+            help='Возраст последней записи в секундах, после которого загрузка считается брошенной',
+        )
+
+    def handle(self, *args, **options):
+        expired = chunked_upload.expire_sessions(options['max_age'])
+        self.stdout.write(f"Удалено загрузок: {expired}")
@@ -0,0 +1,53 @@
+import time
+from django.core.management.base import BaseCommand
+from subtitle_generator_app.fake_services import FakeMVSEPServer, FakeWhisperServer, make_wav
+
+
+class Command(BaseCommand):
+    help = 'Запускает локальные заглушки MVSEP и Whisper для бенчмарков без сети'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--mvsep-port', type=int, default=8701)
+        parser.add_argument('--whisper-port', type=int, default=8702)
+        parser.add_argument('--mvsep-latency', type=float, default=0.0, help='Задержка ответа MVSEP API, с')
+        parser.add_argument('--whisper-latency', type=float, default=0.0, help='Задержка ответа Whisper, с')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Доля ответов 503 (0..1)')
+        parser.add_argument('--processing-polls', type=int, default=2, help='Сколько проверок MVSEP отвечает "processing"')
+        parser.add_argument('--stem-seconds', type=float, default=30.0, help='Длительность сгенерированных стемов, с')
+
+    def handle(self, *args, **options):
+        stems = {
+            'bench_vocals.mp3': make_wav(options['stem_seconds'], seed=1),
+            'bench_other.mp3': make_wav(options['stem_seconds'], seed=2),
+        }
+        mvsep = FakeMVSEPServer(
+            stems=stems,
+            processing_polls=options['processing_polls'],
+            latency=options['mvsep_latency'],
+            failure_rate=options['failure_rate'],
+            host=options['host'],
+            port=options['mvsep_port'],
+        )
+        whisper = FakeWhisperServer(
+            latency=options['whisper_latency'],
+            failure_rate=options['failure_rate'],
+            host=options['host'],
+            port=options['whisper_port'],
+        )
+
+        with mvsep, whisper:
+            self.stdout.write('Заглушки запущены. Переменные окружения для веб-сервера и воркеров:')
+            self.stdout.write(f"  MVSEP_BASE_URL={mvsep.base_url}")
+            self.stdout.write(f"  OPENAI_BASE_URL={whisper.base_url}")
+            self.stdout.write('Ctrl+C для остановки')
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+
+        self.stdout.write(
+            f"MVSEP: {mvsep.request_count} запросов, {mvsep.failure_count} отказов; "
+            f"Whisper: {whisper.request_count} запросов, {whisper.failure_count} отказов"
+        )
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Project',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Project Name')),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='draft', max_length=20, verbose_name='Status')),
+                ('audio', models.FileField(blank=True, null=True, upload_to='audio/', verbose_name='Audio File')),
+                ('vocal_audio', models.FileField(blank=True, null=True, upload_to='audio/', verbose_name='Vocal Audio File')),
+                ('instrumental_audio', models.FileField(blank=True, null=True, upload_to='audio/', verbose_name='Instrumental Audio File')),
+                ('whisper_response', models.JSONField(blank=True, null=True, verbose_name='Whisper Response JSON')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Project',
+                'verbose_name_plural': 'Projects',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
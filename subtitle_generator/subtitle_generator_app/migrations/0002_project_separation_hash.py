@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='separation_hash',
+            field=models.CharField(blank=True, default='', max_length=512, verbose_name='MVSEP Task Hash'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0002_project_separation_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='processing_stage',
+            field=models.CharField(blank=True, choices=[('', 'Not Started'), ('separation', 'Separation'), ('transcription', 'Transcription'), ('finalization', 'Finalization'), ('done', 'Done')], default='', max_length=20, verbose_name='Processing Stage'),
+        ),
+    ]
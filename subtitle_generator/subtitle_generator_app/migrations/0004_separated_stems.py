@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0003_project_processing_stage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeparatedStems',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('audio_sha256', models.CharField(max_length=64, unique=True, verbose_name='Audio SHA-256')),
+                ('vocal_audio', models.FileField(upload_to='audio/stems/', verbose_name='Vocal Audio File')),
+                ('instrumental_audio', models.FileField(upload_to='audio/stems/', verbose_name='Instrumental Audio File')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Reference Count')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Separated Stems',
+                'verbose_name_plural': 'Separated Stems',
+            },
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='audio_sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='Audio SHA-256'),
+        ),
+    ]
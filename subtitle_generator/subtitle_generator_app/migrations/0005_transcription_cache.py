@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0004_separated_stems'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptionCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='Cache Key')),
+                ('vocal_sha256', models.CharField(db_index=True, max_length=64, verbose_name='Vocal SHA-256')),
+                ('model', models.CharField(max_length=100, verbose_name='Whisper Model')),
+                ('response', models.JSONField(verbose_name='Whisper Response JSON')),
+                ('size_bytes', models.PositiveIntegerField(default=0, verbose_name='Size (bytes)')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Hits')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Transcription Cache Entry',
+                'verbose_name_plural': 'Transcription Cache Entries',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0005_transcription_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='vocal_offset_map',
+            field=models.JSONField(blank=True, null=True, verbose_name='Vocal Silence Offset Map'),
+        ),
+        migrations.AddField(
+            model_name='transcriptioncacheentry',
+            name='offset_map',
+            field=models.JSONField(blank=True, null=True, verbose_name='Silence Offset Map'),
+        ),
+    ]
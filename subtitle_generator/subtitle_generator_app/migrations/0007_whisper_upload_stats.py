@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0006_silence_offset_map'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='whisper_source_bytes',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Vocal Size Before Upload Preparation (bytes)'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='whisper_upload_bytes',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Bytes Uploaded To Whisper'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='whisper_upload_seconds',
+            field=models.FloatField(blank=True, null=True, verbose_name='Whisper Upload Time (seconds)'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0007_whisper_upload_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageTiming',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(choices=[('upload', 'Upload'), ('separation_cache', 'Separation Cache Hit'), ('separation_submit', 'MVSEP Submit'), ('separation_wait', 'MVSEP Queue And Processing'), ('separation_download', 'MVSEP Download'), ('transcription', 'Transcription'), ('finalization', 'Finalization')], max_length=30, verbose_name='Stage')),
+                ('started_at', models.DateTimeField(verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(verbose_name='Finished At')),
+                ('duration_seconds', models.FloatField(verbose_name='Duration (seconds)')),
+                ('bytes_in', models.BigIntegerField(blank=True, null=True, verbose_name='Bytes In')),
+                ('bytes_out', models.BigIntegerField(blank=True, null=True, verbose_name='Bytes Out')),
+                ('retries', models.PositiveIntegerField(default=0, verbose_name='Retries')),
+                ('success', models.BooleanField(default=True, verbose_name='Success')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stage_timings', to='subtitle_generator_app.project')),
+            ],
+            options={
+                'verbose_name': 'Stage Timing',
+                'verbose_name_plural': 'Stage Timings',
+                'ordering': ['started_at'],
+                'indexes': [models.Index(fields=['stage', 'started_at'], name='subtitle_ge_stage_19eb80_idx')],
+            },
+        ),
+    ]
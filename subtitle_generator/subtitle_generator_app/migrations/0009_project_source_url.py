@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0008_stage_timing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='source_url',
+            field=models.URLField(blank=True, default='', max_length=2000, verbose_name='Audio Source URL'),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Draft'), ('importing', 'Importing'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='draft', max_length=20, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0009_project_source_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='use_transcription_cache',
+            field=models.BooleanField(blank=True, null=True, verbose_name='Use Transcription Cache'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:00
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0010_project_use_transcription_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='Original Filename')),
+                ('project_name', models.CharField(max_length=255, verbose_name='Project Name')),
+                ('use_transcription_cache', models.BooleanField(blank=True, null=True, verbose_name='Use Transcription Cache')),
+                ('upload_length', models.BigIntegerField(verbose_name='Upload Length')),
+                ('upload_offset', models.BigIntegerField(default=0, verbose_name='Upload Offset')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('project', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='subtitle_generator_app.project', verbose_name='Project')),
+            ],
+            options={
+                'verbose_name': 'Upload Session',
+                'verbose_name_plural': 'Upload Sessions',
+            },
+        ),
+    ]
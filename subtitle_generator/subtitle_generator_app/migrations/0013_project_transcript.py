@@ -0,0 +1,63 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BATCH_SIZE = 100
+
+
+def copy_transcripts(apps, schema_editor):
+    """Переносит whisper_response из строк Project в ProjectTranscript"""
+    Project = apps.get_model('subtitle_generator_app', 'Project')
+    ProjectTranscript = apps.get_model('subtitle_generator_app', 'ProjectTranscript')
+    rows = (
+        Project.objects
+        .filter(whisper_response__isnull=False)
+        .values_list('id', 'whisper_response')
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    batch = []
+    for project_id, response in rows:
+        batch.append(ProjectTranscript(project_id=project_id, whisper_response=response))
+        if len(batch) >= BATCH_SIZE:
+            ProjectTranscript.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ProjectTranscript.objects.bulk_create(batch)
+
+
+def restore_transcripts(apps, schema_editor):
+    """Обратный перенос: ProjectTranscript -> Project.whisper_response"""
+    Project = apps.get_model('subtitle_generator_app', 'Project')
+    ProjectTranscript = apps.get_model('subtitle_generator_app', 'ProjectTranscript')
+    rows = ProjectTranscript.objects.values_list('project_id', 'whisper_response').iterator(chunk_size=BATCH_SIZE)
+    for project_id, response in rows:
+        Project.objects.filter(id=project_id).update(whisper_response=response)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0012_project_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectTranscript',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='transcript', serialize=False, to='subtitle_generator_app.project')),
+                ('whisper_response', models.JSONField(verbose_name='Whisper Response JSON')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Project Transcript',
+                'verbose_name_plural': 'Project Transcripts',
+            },
+        ),
+        migrations.RunPython(copy_transcripts, restore_transcripts),
+        migrations.RemoveField(
+            model_name='project',
+            name='whisper_response',
+        ),
+    ]
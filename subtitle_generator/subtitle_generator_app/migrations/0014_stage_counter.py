@@ -0,0 +1,64 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:21
+
+from bisect import bisect_left
+from django.db import migrations, models
+
+# instrumentation.DURATION_BUCKETS на момент миграции
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def fill_counters(apps, schema_editor):
+    """Начальные значения счетчиков по уже сохраненным замерам, чтобы /metrics не обнулился"""
+    StageTiming = apps.get_model('subtitle_generator_app', 'StageTiming')
+    StageCounter = apps.get_model('subtitle_generator_app', 'StageCounter')
+    counters = {}
+    rows = StageTiming.objects.values_list(
+        'stage', 'duration_seconds', 'success', 'retries', 'bytes_in', 'bytes_out'
+    ).iterator(chunk_size=1000)
+    for stage, duration, success, retries, bytes_in, bytes_out in rows:
+        key = (stage, bisect_left(DURATION_BUCKETS, duration))
+        counter = counters.setdefault(key, StageCounter(stage=stage, bucket=key[1]))
+        counter.runs += 1
+        counter.failures += 0 if success else 1
+        counter.duration_seconds += duration
+        counter.retries += retries
+        counter.bytes_in += bytes_in or 0
+        counter.bytes_out += bytes_out or 0
+    StageCounter.objects.bulk_create(counters.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0013_project_transcript'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(choices=[('upload', 'Upload'), ('separation_cache', 'Separation Cache Hit'), ('separation_submit', 'MVSEP Submit'), ('separation_wait', 'MVSEP Queue And Processing'), ('separation_download', 'MVSEP Download'), ('transcription', 'Transcription'), ('finalization', 'Finalization')], max_length=30, verbose_name='Stage')),
+                ('bucket', models.PositiveSmallIntegerField(verbose_name='Duration Bucket')),
+                ('runs', models.BigIntegerField(default=0, verbose_name='Runs')),
+                ('failures', models.BigIntegerField(default=0, verbose_name='Failures')),
+                ('duration_seconds', models.FloatField(default=0.0, verbose_name='Duration Sum (seconds)')),
+                ('retries', models.BigIntegerField(default=0, verbose_name='Retries')),
+                ('bytes_in', models.BigIntegerField(default=0, verbose_name='Bytes In')),
+                ('bytes_out', models.BigIntegerField(default=0, verbose_name='Bytes Out')),
+            ],
+            options={
+                'verbose_name': 'Stage Counter',
+                'verbose_name_plural': 'Stage Counters',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stagetiming',
+            index=models.Index(fields=['started_at'], name='subtitle_ge_started_40ba36_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='stagecounter',
+            constraint=models.UniqueConstraint(fields=('stage', 'bucket'), name='unique_stage_counter_bucket'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
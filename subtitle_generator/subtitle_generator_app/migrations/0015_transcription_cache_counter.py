@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0014_stage_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptionCacheCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('hits', 'Hits'), ('misses', 'Misses')], max_length=20, unique=True, verbose_name='Counter')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Value')),
+            ],
+            options={
+                'verbose_name': 'Transcription Cache Counter',
+                'verbose_name_plural': 'Transcription Cache Counters',
+            },
+        ),
+    ]
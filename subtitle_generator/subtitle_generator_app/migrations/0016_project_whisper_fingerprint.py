@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:26
+
+import hashlib
+import json
+from django.db import migrations, models
+
+
+def fill_fingerprints(apps, schema_editor):
+    """Хэши уже сохраненных ответов (как subtitle_cache.response_fingerprint)"""
+    Project = apps.get_model('subtitle_generator_app', 'Project')
+    ProjectTranscript = apps.get_model('subtitle_generator_app', 'ProjectTranscript')
+    rows = ProjectTranscript.objects.values_list('project_id', 'whisper_response').iterator(chunk_size=100)
+    for project_id, response in rows:
+        if not response:
+            continue
+        payload = json.dumps(response, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        fingerprint = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        Project.objects.filter(id=project_id).update(whisper_fingerprint=fingerprint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subtitle_generator_app', '0015_transcription_cache_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='whisper_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Whisper Response SHA-256'),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+    ]
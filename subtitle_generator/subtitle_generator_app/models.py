@@ -1,15 +1,26 @@
-from django.db import models
+from django.db import models, transaction
 import os
 import uuid
 import re
+from . import subtitle_cache, subtitle_renderer, timing
+from .services import hashing
 
 class Project(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
+        ('importing', 'Importing'),
         ('processing', 'Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
+
+    STAGE_CHOICES = [
+        ('', 'Not Started'),
+        ('separation', 'Separation'),
+        ('transcription', 'Transcription'),
+        ('finalization', 'Finalization'),
+        ('done', 'Done'),
+    ]
     
     name = models.CharField(max_length=255, verbose_name='Project Name')
     status = models.CharField(
@@ -18,12 +29,25 @@ class Project(models.Model):
         default='draft',
         verbose_name='Status'
     )
+    processing_stage = models.CharField(
+        max_length=20,
+        choices=STAGE_CHOICES,
+        blank=True,
+        default='',
+        verbose_name='Processing Stage'
+    )
     audio = models.FileField(
         upload_to='audio/',
         blank=True,
         null=True,
         verbose_name='Audio File'
     )
+    source_url = models.URLField(
+        max_length=2000,
+        blank=True,
+        default='',
+        verbose_name='Audio Source URL'
+    )
     vocal_audio = models.FileField(
         upload_to='audio/',
         blank=True,
@@ -36,333 +60,215 @@ class Project(models.Model):
         null=True,
         verbose_name='Instrumental Audio File'
     )
-    whisper_response = models.JSONField(
+    audio_sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        db_index=True,
+        verbose_name='Audio SHA-256'
+    )
+    separation_hash = models.CharField(
+        max_length=512,
+        blank=True,
+        default='',
+        verbose_name='MVSEP Task Hash'
+    )
+    use_transcription_cache = models.BooleanField(
+        blank=True,
+        null=True,
+        verbose_name='Use Transcription Cache'
+    )
+    vocal_offset_map = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name='Vocal Silence Offset Map'
+    )
+    whisper_fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='Whisper Response SHA-256'
+    )
+    whisper_source_bytes = models.BigIntegerField(
+        blank=True,
+        null=True,
+        verbose_name='Vocal Size Before Upload Preparation (bytes)'
+    )
+    whisper_upload_bytes = models.BigIntegerField(
         blank=True,
         null=True,
-        verbose_name='Whisper Response JSON'
+        verbose_name='Bytes Uploaded To Whisper'
+    )
+    whisper_upload_seconds = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name='Whisper Upload Time (seconds)'
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Постраничный список проектов: ORDER BY created_at DESC, id DESC (+ фильтр по статусу)
+            models.Index(fields=['-created_at', '-id'], name='project_created_id_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='project_status_created_idx'),
+        ]
         verbose_name = 'Project'
         verbose_name_plural = 'Projects'
     
+    @property
+    def whisper_response(self):
+        """
+        Ответ Whisper хранится в отдельной таблице ProjectTranscript, чтобы
+        чтение строки проекта (статус, список, удаление) не тянуло многомегабайтный JSON.
+        Загружается при первом обращении, присвоенное значение сохраняется в save()
+        """
+        if '_whisper_response' not in self.__dict__:
+            response = None
+            if self.pk is not None:
+                response = (
+                    ProjectTranscript.objects
+                    .filter(project_id=self.pk)
+                    .values_list('whisper_response', flat=True)
+                    .first()
+                )
+            self.__dict__['_whisper_response'] = response
+        return self.__dict__['_whisper_response']
+
+    @whisper_response.setter
+    def whisper_response(self, value):
+        self.__dict__['_whisper_response'] = value
+        self.__dict__['_whisper_response_changed'] = True
+
+    def has_transcript(self):
+        """Есть ли ответ Whisper (без загрузки JSON, если он еще не загружен)"""
+        if '_whisper_response' in self.__dict__:
+            return bool(self.__dict__['_whisper_response'])
+        return self.pk is not None and ProjectTranscript.objects.filter(project_id=self.pk).exists()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        save_transcript = self.__dict__.get('_whisper_response_changed', False) and (
+            update_fields is None or 'whisper_response' in update_fields
+        )
+        if update_fields is not None:
+            kwargs['update_fields'] = [field for field in update_fields if field != 'whisper_response']
+        if save_transcript:
+            # Хэш для ключей кэша субтитров считается один раз здесь, а не при каждой отдаче
+            response = self.__dict__['_whisper_response']
+            self.whisper_fingerprint = subtitle_cache.response_fingerprint(response) if response else ''
+            if update_fields is not None:
+                kwargs['update_fields'].append('whisper_fingerprint')
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if save_transcript:
+                response = self.__dict__['_whisper_response']
+                if response is None:
+                    ProjectTranscript.objects.filter(project_id=self.pk).delete()
+                else:
+                    ProjectTranscript.objects.update_or_create(project_id=self.pk, defaults={'whisper_response': response})
+                self.__dict__['_whisper_response_changed'] = False
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        if fields is None or 'whisper_response' in fields:
+            self.__dict__.pop('_whisper_response', None)
+            self.__dict__.pop('_whisper_response_changed', None)
+        if fields is not None:
+            if 'whisper_response' in fields:
+                fields = [field for field in fields if field != 'whisper_response'] + ['whisper_fingerprint']
+            if not fields:
+                return
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
     def format_timestamp(self, seconds):
         """Форматирует секунды в SRT timestamp формат (HH:MM:SS,mmm)"""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
-        millis = int((seconds % 1) * 1000)
-        return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+        return subtitle_renderer.format_timestamp(seconds)
+
+    def format_timestamp_ass(self, seconds):
+        """Форматирует секунды в ASS timestamp формат (H:MM:SS.cc)"""
+        return subtitle_renderer.format_timestamp_ass(seconds)
 
     def generate_srt_from_whisper_response(self, response):
         """Генерирует SRT контент из Whisper verbose JSON ответа с отображением слов и их временных меток"""
-        segments = response.get('segments', [])
-
-        # Если segments есть, используем их с words
-        if segments:
-            srt_lines = []
-            all_words = response.get('words', [])
-            for i, segment in enumerate(segments, 1):
-                start = self.format_timestamp(segment['start'])
-                end = self.format_timestamp(segment['end'])
-
-                srt_lines.append(str(i))
-                srt_lines.append(f"{start} --> {end}")
-
-                # Находим слова, которые принадлежат этому сегменту
-                segment_words = [word for word in all_words if word['start'] >= segment['start'] and word['end'] <= segment['end']]
-                for word in segment_words:
-                    word_start = self.format_timestamp(word['start'])
-                    word_end = self.format_timestamp(word['end'])
-                    word_text = word['word']
-                    srt_lines.append(f"{word_text} {word_start} --> {word_end}")
-
-                srt_lines.append("")
-            return "\n".join(srt_lines)
-
-        # Если segments нет, группируем words в сегменты
-        words = response.get('words', [])
-        if not words:
-            return ""
-
-        # Группируем слова в сегменты по времени (например, каждые 5 секунд или по смыслу)
-        segments_grouped = []
-        current_segment = []
-        segment_start = None
-        segment_end = None
-
-        for word in words:
-            if segment_start is None:
-                segment_start = word['start']
-            segment_end = word['end']
-            current_segment.append(word)
-
-            # Создаем новый сегмент каждые 5 секунд или если текст становится слишком длинным
-            if segment_end - segment_start >= 5 or len(' '.join(w['word'] for w in current_segment)) > 100:
-                text = ' '.join(w['word'] for w in current_segment).strip()
-                if text:
-                    segments_grouped.append({
-                        'start': segment_start,
-                        'end': segment_end,
-                        'text': text,
-                        'words': current_segment
-                    })
-                current_segment = []
-                segment_start = None
-
-        # Добавляем последний сегмент
-        if current_segment:
-            text = ' '.join(w['word'] for w in current_segment).strip()
-            if text:
-                segments_grouped.append({
-                    'start': segment_start if segment_start is not None else words[-1]['start'],
-                    'end': segment_end if segment_end is not None else words[-1]['end'],
-                    'text': text,
-                    'words': current_segment
-                })
-
-        # Генерируем SRT
-        srt_lines = []
-        for i, segment in enumerate(segments_grouped, 1):
-            start = self.format_timestamp(segment['start'])
-            end = self.format_timestamp(segment['end'])
-
-            srt_lines.append(str(i))
-            srt_lines.append(f"{start} --> {end}")
-
-            # Добавляем слова с их временными метками
-            for word in segment['words']:
-                word_start = self.format_timestamp(word['start'])
-                word_end = self.format_timestamp(word['end'])
-                word_text = word['word']
-                srt_lines.append(f"{word_text} {word_start} --> {word_end}")
-
-            srt_lines.append("")
-
-
-        return "\n".join(srt_lines)
+        return subtitle_renderer.render_response(response, 'srt')
 
     def generate_standard_srt_from_whisper_response(self, response):
         """Генерирует стандартный SRT контент из Whisper verbose JSON ответа без временных меток слов"""
-        segments = response.get('segments', [])
-
-        srt_lines = []
-
-        if segments:
-            # Используем segments напрямую
-            for i, segment in enumerate(segments, 1):
-                start = self.format_timestamp(segment['start'])
-                end = self.format_timestamp(segment['end'])
-                text = segment.get('text', '').strip()
-
-                if text:
-                    srt_lines.append(str(i))
-                    srt_lines.append(f"{start} --> {end}")
-                    srt_lines.append(text)
-                    srt_lines.append("")
-        else:
-            # Группируем words в сегменты
-            words = response.get('words', [])
-            if not words:
-                return ""
-
-            segments_grouped = []
-            current_segment = []
-            segment_start = None
-            segment_end = None
-
-            for word in words:
-                if segment_start is None:
-                    segment_start = word['start']
-                segment_end = word['end']
-                current_segment.append(word)
-
-                # Создаем новый сегмент каждые 5 секунд или если текст становится слишком длинным
-                if segment_end - segment_start >= 5 or len(' '.join(w['word'] for w in current_segment)) > 100:
-                    text = ' '.join(w['word'] for w in current_segment).strip()
-                    if text:
-                        segments_grouped.append({
-                            'start': segment_start,
-                            'end': segment_end,
-                            'text': text
-                        })
-                    current_segment = []
-                    segment_start = None
-
-            # Добавляем последний сегмент
-            if current_segment:
-                text = ' '.join(w['word'] for w in current_segment).strip()
-                if text:
-                    segments_grouped.append({
-                        'start': segment_start if segment_start is not None else words[-1]['start'],
-                        'end': segment_end if segment_end is not None else words[-1]['end'],
-                        'text': text
-                    })
-
-            # Генерируем стандартный SRT
-            for i, segment in enumerate(segments_grouped, 1):
-                start = self.format_timestamp(segment['start'])
-                end = self.format_timestamp(segment['end'])
-
-                srt_lines.append(str(i))
-                srt_lines.append(f"{start} --> {end}")
-                srt_lines.append(segment['text'])
-                srt_lines.append("")
-
-        return "\n".join(srt_lines)
+        return subtitle_renderer.render_response(response, 'standard_srt')
 
     def generate_ass_from_whisper_response(self, response):
         """Генерирует ASS контент из Whisper verbose JSON ответа с караоке эффектами"""
-        segments = response.get('segments', [])
-        words = response.get('words', [])
-
-        # ASS header
-        ass_content = """[Script Info]
-Title: Karaoke Lyrics
-ScriptType: v4.00+
-PlayResX: 1920
-PlayResY: 1080
-Collisions: Normal
-PlayDepth: 0
-
-[V4+ Styles]
-Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-Style: Default,Arial,60,&H00FFFFFF,&H0000FFFF,&H00000000,&H80000000,-1,0,0,0,100,100,0,0,1,3,0,2,10,10,50,1
-
-[Events]
-Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
-"""
-
-        events = []
-
-        # Собираем сегменты
-        karaoke_segments = []
-
-        if segments:
-            for segment in segments:
-                seg_start = segment['start']
-                seg_end = segment['end']
-                seg_text = segment.get('text', '').strip()
-
-                # Фильтруем слова для сегмента
-                segment_words = [w for w in words if w['start'] >= seg_start and w['end'] <= seg_end]
-
-                if segment_words:
-                    karaoke_segments.append({
-                        'start': seg_start,
-                        'end': seg_end,
-                        'words': segment_words
-                    })
-        else:
-            # Группируем words в сегменты
-            if words:
-                current_segment = []
-                segment_start = None
-                segment_end = None
-
-                for word in words:
-                    if segment_start is None:
-                        segment_start = word['start']
-                    segment_end = word['end']
-                    current_segment.append(word)
-
-                    if segment_end - segment_start >= 5 or len(' '.join(w['word'] for w in current_segment)) > 100:
-                        if current_segment:
-                            karaoke_segments.append({
-                                'start': segment_start,
-                                'end': segment_end,
-                                'words': current_segment
-                            })
-                        current_segment = []
-                        segment_start = None
-
-                if current_segment:
-                    karaoke_segments.append({
-                        'start': segment_start if segment_start is not None else words[-1]['start'],
-                        'end': segment_end if segment_end is not None else words[-1]['end'],
-                        'words': current_segment
-                    })
-
-        # Создаем караоке Dialogue для сегментов
-        for segment in karaoke_segments:
-            start_time = max(0, segment['start'] - 0.2)
-            end_time = segment['end'] + 0.2
-
-            karaoke_text = "{\\fad(400,0)\\an2}"
-
-            for i, word in enumerate(segment['words']):
-                w_start = word['start']
-                w_end = word['end']
-                w_text = word['word']
-
-                duration = int((w_end - w_start) * 100)
-                karaoke_text += f"{{\\kf{duration}}}{w_text} "
-
-            event_str = f"Dialogue: 0,{self.format_timestamp_ass(start_time)},{self.format_timestamp_ass(end_time)},Default,,0,0,0,,{karaoke_text.strip()}"
-            events.append((start_time, event_str))
-
-        # Добавляем ноты для длинных пауз
-        if karaoke_segments:
-            sorted_segments = sorted(karaoke_segments, key=lambda x: x['start'])
-
-            for i in range(len(sorted_segments) - 1):
-                current_end = sorted_segments[i]['end']
-                next_start = sorted_segments[i + 1]['start']
-                pause_duration = next_start - current_end
-
-                if pause_duration > 5:
-                    # Добавляем ноты каждые 0.4 секунды
-                    note_positions = [(1240, 540), (1340, 540), (1440, 540)]
-                    note_index = 0
-                    current_time = current_end
-
-                    while current_time < next_start:
-                        note_end = min(current_time + 0.8, next_start)
-                        pos_x, pos_y = note_positions[note_index % len(note_positions)]
-
-                        note_event = f"Dialogue: 0,{self.format_timestamp_ass(current_time)},{self.format_timestamp_ass(note_end)},Default,,0,0,0,,{{\\an5\\fad(200,200)\\fs100\\c&HFFFFFF&}}{{\\pos({pos_x},{pos_y})}}♫"
-                        events.append((current_time, note_event))
-
-                        current_time += 0.4
-                        note_index += 1
-
-        # Сортируем события по времени
-        events.sort(key=lambda x: x[0])
-
-        # Добавляем события в контент
-        for _, event in events:
-            ass_content += event + "\n"
-
-        return ass_content
+        return subtitle_renderer.render_response(response, 'ass')
+
+    def get_subtitle_timeline(self):
+        """
+        Возвращает таймлайн субтитров, разобранный из whisper_response.
+        Разбор кэшируется на экземпляре, пока whisper_response не заменен.
+        """
+        cached = getattr(self, '_subtitle_timeline', None)
+        if cached is not None and cached[0] is self.whisper_response:
+            return cached[1]
+        timeline = subtitle_renderer.build_timeline(self.whisper_response)
+        self._subtitle_timeline = (self.whisper_response, timeline)
+        return timeline
+
+    def get_whisper_fingerprint(self):
+        """
+        Хэш whisper_response для ключей кэша субтитров. Для сохраненного ответа
+        берется из whisper_fingerprint без загрузки JSON, для присвоенного,
+        но еще не сохраненного — считается (и кэшируется на экземпляре)
+        """
+        if not self.__dict__.get('_whisper_response_changed'):
+            return self.whisper_fingerprint
+        response = self.__dict__['_whisper_response']
+        if not response:
+            return ''
+        cached = getattr(self, '_whisper_fingerprint', None)
+        if cached is not None and cached[0] is response:
+            return cached[1]
+        fingerprint = subtitle_cache.response_fingerprint(response)
+        self._whisper_fingerprint = (response, fingerprint)
+        return fingerprint
+
+    def render_subtitles(self, fmt):
+        """Рендерит субтитры проекта в указанный формат, используя кэш отрендеренных субтитров"""
+        def render():
+            with timing.measure('render'):
+                return subtitle_renderer.render(self.get_subtitle_timeline(), fmt)
+
+        if self.pk is None:
+            return render() if self.whisper_response else ""
+        # Транскрипт загружается только при промахе кэша
+        fingerprint = self.get_whisper_fingerprint()
+        if not fingerprint:
+            return ""
+        return subtitle_cache.get_or_render(self.pk, fmt, fingerprint, render)
 
-    def format_timestamp_ass(self, seconds):
-        """Форматирует секунды в ASS timestamp формат (H:MM:SS.cc)"""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
-        centisecs = int((seconds % 1) * 100)
-        return f"{hours}:{minutes:02d}:{secs:02d}.{centisecs:02d}"
+    def iter_subtitles(self, fmt):
+        """Отдает субтитры проекта в указанном формате частями (для потоковой отдачи)"""
+        def iter_render():
+            return subtitle_renderer.iter_render(self.get_subtitle_timeline(), fmt)
+
+        if self.pk is None:
+            return iter_render() if self.whisper_response else iter(())
+        fingerprint = self.get_whisper_fingerprint()
+        if not fingerprint:
+            return iter(())
+        return subtitle_cache.iter_cached_or_render(self.pk, fmt, fingerprint, iter_render)
 
     def get_subtitle_content(self):
         """Возвращает содержимое субтитров в формате SRT, сгенерированное из whisper_response"""
-        if not self.whisper_response:
-            return ""
-        return self.generate_srt_from_whisper_response(self.whisper_response)
+        return self.render_subtitles('srt')
 
     def get_standard_srt_content(self):
         """Возвращает содержимое субтитров в стандартном формате SRT, сгенерированное из whisper_response"""
-        if not self.whisper_response:
-            return ""
-        return self.generate_standard_srt_from_whisper_response(self.whisper_response)
+        return self.render_subtitles('standard_srt')
 
     def get_ass_content(self):
         """Возвращает содержимое субтитров в формате ASS, сгенерированное из whisper_response"""
-        if not self.whisper_response:
-            return ""
-        return self.generate_ass_from_whisper_response(self.whisper_response)
+        return self.render_subtitles('ass')
 
     def get_subtitle_filename(self):
         """Возвращает имя файла субтитров на основе названия проекта"""
@@ -377,12 +283,22 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         return f"{clean_name}.ass"
 
     def has_subtitles(self):
-        """Проверяет, есть ли субтитры для проекта"""
-        return self.whisper_response is not None and bool(self.whisper_response.get('words', []) or self.whisper_response.get('segments', []))
+        """Проверяет, есть ли субтитры для проекта (для сохраненного ответа — запросом, без загрузки JSON)"""
+        if '_whisper_response' in self.__dict__ or self.pk is None:
+            return self.whisper_response is not None and bool(self.whisper_response.get('words', []) or self.whisper_response.get('segments', []))
+        return ProjectTranscript.objects.filter(
+            models.Q(whisper_response__words__0__isnull=False) | models.Q(whisper_response__segments__0__isnull=False),
+            project_id=self.pk,
+        ).exists()
 
     def __str__(self):
         return self.name
     
+    def update_audio_sha256(self):
+        """Считает SHA-256 загруженного аудио (по нему ищутся готовые стемы)"""
+        self.audio_sha256 = hashing.file_sha256(self.audio.path) if self.audio else ''
+        return self.audio_sha256
+
     def get_audio_path(self):
         """Возвращает полный путь к аудио файлу"""
         if self.audio:
@@ -419,4 +335,178 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
         if self.instrumental_audio:
             return self.instrumental_audio.url
         return None
-    
+
+
+class SeparatedStems(models.Model):
+    """
+    Стемы (вокал и инструментал), адресуемые по SHA-256 исходного аудио.
+    Одни и те же файлы используют все проекты с таким же аудио;
+    ref_count — число таких проектов.
+    """
+    audio_sha256 = models.CharField(max_length=64, unique=True, verbose_name='Audio SHA-256')
+    vocal_audio = models.FileField(upload_to='audio/stems/', verbose_name='Vocal Audio File')
+    instrumental_audio = models.FileField(upload_to='audio/stems/', verbose_name='Instrumental Audio File')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='Reference Count')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Separated Stems'
+        verbose_name_plural = 'Separated Stems'
+
+    def __str__(self):
+        return f"{self.audio_sha256} ({self.ref_count})"
+
+
+class TranscriptionCacheEntry(models.Model):
+    """
+    Сохраненный verbose JSON ответ Whisper. Ключ — SHA-256 от хэша вокала
+    и параметров запроса (модель, prompt, temperature, granularities).
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name='Cache Key')
+    vocal_sha256 = models.CharField(max_length=64, db_index=True, verbose_name='Vocal SHA-256')
+    model = models.CharField(max_length=100, verbose_name='Whisper Model')
+    response = models.JSONField(verbose_name='Whisper Response JSON')
+    offset_map = models.JSONField(blank=True, null=True, verbose_name='Silence Offset Map')
+    size_bytes = models.PositiveIntegerField(default=0, verbose_name='Size (bytes)')
+    hits = models.PositiveIntegerField(default=0, verbose_name='Hits')
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Transcription Cache Entry'
+        verbose_name_plural = 'Transcription Cache Entries'
+
+    def __str__(self):
+        return f"{self.model}:{self.vocal_sha256}"
+
+
+class TranscriptionCacheCounter(models.Model):
+    """
+    Счетчик попаданий или промахов кэша транскрипций. Хранится в БД, чтобы
+    /metrics веб-процесса видел значения, накопленные воркерами
+    """
+    NAME_CHOICES = [
+        ('hits', 'Hits'),
+        ('misses', 'Misses'),
+    ]
+
+    name = models.CharField(max_length=20, choices=NAME_CHOICES, unique=True, verbose_name='Counter')
+    value = models.BigIntegerField(default=0, verbose_name='Value')
+
+    class Meta:
+        verbose_name = 'Transcription Cache Counter'
+        verbose_name_plural = 'Transcription Cache Counters'
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+
+class ProjectTranscript(models.Model):
+    """Ответ Whisper проекта (отдельно от строки Project, см. Project.whisper_response)"""
+    project = models.OneToOneField(
+        Project,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='transcript'
+    )
+    whisper_response = models.JSONField(verbose_name='Whisper Response JSON')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Project Transcript'
+        verbose_name_plural = 'Project Transcripts'
+
+    def __str__(self):
+        return f"Transcript of project {self.project_id}"
+
+
+class StageTiming(models.Model):
+    """Время выполнения одного этапа обработки проекта"""
+    STAGE_CHOICES = [
+        ('upload', 'Upload'),
+        ('separation_cache', 'Separation Cache Hit'),
+        ('separation_submit', 'MVSEP Submit'),
+        ('separation_wait', 'MVSEP Queue And Processing'),
+        ('separation_download', 'MVSEP Download'),
+        ('transcription', 'Transcription'),
+        ('finalization', 'Finalization'),
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='stage_timings')
+    stage = models.CharField(max_length=30, choices=STAGE_CHOICES, verbose_name='Stage')
+    started_at = models.DateTimeField(verbose_name='Started At')
+    finished_at = models.DateTimeField(verbose_name='Finished At')
+    duration_seconds = models.FloatField(verbose_name='Duration (seconds)')
+    bytes_in = models.BigIntegerField(blank=True, null=True, verbose_name='Bytes In')
+    bytes_out = models.BigIntegerField(blank=True, null=True, verbose_name='Bytes Out')
+    retries = models.PositiveIntegerField(default=0, verbose_name='Retries')
+    success = models.BooleanField(default=True, verbose_name='Success')
+    error = models.TextField(blank=True, default='', verbose_name='Error')
+
+    class Meta:
+        ordering = ['started_at']
+        indexes = [models.Index(fields=['stage', 'started_at']), models.Index(fields=['started_at'])]
+        verbose_name = 'Stage Timing'
+        verbose_name_plural = 'Stage Timings'
+
+    def __str__(self):
+        return f"{self.project_id}:{self.stage} {self.duration_seconds:.3f}s"
+
+
+class StageCounter(models.Model):
+    """
+    Накопленные счетчики этапа для /metrics: одна строка на этап и корзину
+    длительности (индекс в instrumentation.DURATION_BUCKETS, последняя — +Inf).
+    Не связаны с проектами, поэтому только растут
+    """
+    stage = models.CharField(max_length=30, choices=StageTiming.STAGE_CHOICES, verbose_name='Stage')
+    bucket = models.PositiveSmallIntegerField(verbose_name='Duration Bucket')
+    runs = models.BigIntegerField(default=0, verbose_name='Runs')
+    failures = models.BigIntegerField(default=0, verbose_name='Failures')
+    duration_seconds = models.FloatField(default=0.0, verbose_name='Duration Sum (seconds)')
+    retries = models.BigIntegerField(default=0, verbose_name='Retries')
+    bytes_in = models.BigIntegerField(default=0, verbose_name='Bytes In')
+    bytes_out = models.BigIntegerField(default=0, verbose_name='Bytes Out')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['stage', 'bucket'], name='unique_stage_counter_bucket')]
+        verbose_name = 'Stage Counter'
+        verbose_name_plural = 'Stage Counters'
+
+    def __str__(self):
+        return f"{self.stage}[{self.bucket}] {self.runs}"
+
+
+class UploadSession(models.Model):
+    """Докачиваемая загрузка аудио частями (протокол tus)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255, verbose_name='Original Filename')
+    project_name = models.CharField(max_length=255, verbose_name='Project Name')
+    use_transcription_cache = models.BooleanField(blank=True, null=True, verbose_name='Use Transcription Cache')
+    upload_length = models.BigIntegerField(verbose_name='Upload Length')
+    upload_offset = models.BigIntegerField(default=0, verbose_name='Upload Offset')
+    project = models.OneToOneField(
+        Project,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='upload_session',
+        verbose_name='Project'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Updated At')
+
+    class Meta:
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+
+    def __str__(self):
+        return f"{self.filename} {self.upload_offset}/{self.upload_length}"
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.filename)[1].lstrip('.').lower()
+
+    @property
+    def is_complete(self):
+        return self.upload_offset >= self.upload_length
@@ -2,90 +2,290 @@
 Custom RangedFileResponse для поддержки HTTP Range Requests
 """
 import os
-from django.http import HttpResponse, Http404
+import secrets
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+# Размер блока, которым файл отдается клиенту
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Больше диапазонов в одном запросе не обслуживаем (отдаем весь файл)
+MAX_RANGES = 16
+
+
+class RangeFileWrapper:
+    """
+    Файловая обертка, ограниченная диапазоном байт [start, start + length).
+
+    Отдает файл блоками фиксированного размера, поэтому память на запрос
+    не зависит от размера файла. Метод fileno() позволяет WSGI серверу
+    (например, gunicorn через wsgi.file_wrapper) отдать диапазон через
+    os.sendfile: позиция в файле уже выставлена на start, а длина берется
+    из Content-Length.
+    """
+
+    def __init__(self, file_obj, start=0, length=None, block_size=STREAM_BLOCK_SIZE):
+        self.file_obj = file_obj
+        self.block_size = block_size
+        self.remaining = length
+        file_obj.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining is not None:
+            if size < 0 or size > self.remaining:
+                size = self.remaining
+            if size == 0:
+                return b''
+        data = self.file_obj.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file_obj.fileno()
+
+    def tell(self):
+        return self.file_obj.tell()
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.block_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.file_obj.close()
+
+
+def file_validators(file_path):
+    """
+    Возвращает валидаторы файла: (stat, ETag, Last-Modified timestamp).
+    ETag строгий и строится из inode, размера и mtime файла.
+    """
+    stat = os.stat(file_path)
+    etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return stat, etag, int(stat.st_mtime)
+
+
+def parse_range_header(range_header, file_size):
+    """
+    Разбирает заголовок Range вида bytes=start-end[, start-end...].
+
+    Возвращает список удовлетворимых диапазонов (start, end) в порядке запроса
+    (пустой список, если ни один диапазон не пересекается с файлом).
+    Бросает ValueError при невалидном формате заголовка.
+    """
+    if not range_header.startswith('bytes='):
+        raise ValueError("Невалидный формат диапазона")
+
+    range_specs = [spec.strip() for spec in range_header[6:].split(',')]  # Убираем 'bytes='
+    if not range_specs or len(range_specs) > MAX_RANGES:
+        raise ValueError("Невалидный формат диапазона")
+
+    ranges = []
+    for range_spec in range_specs:
+        if '-' not in range_spec:
+            raise ValueError("Невалидный формат диапазона")
+
+        start_str, end_str = range_spec.split('-', 1)
+        if not (start_str or end_str) or not (start_str or '0').isdigit() or not (end_str or '0').isdigit():
+            raise ValueError("Невалидный формат диапазона")
+
+        if not start_str:
+            # bytes=-500 (последние 500 bytes)
+            start = max(0, file_size - int(end_str))
+            end = file_size - 1
+        elif not end_str:
+            # bytes=500- (от 500 bytes до конца)
+            start = int(start_str)
+            end = file_size - 1
+        else:
+            # bytes=500-999 (от 500 до 999 bytes)
+            start = int(start_str)
+            if int(end_str) < start:
+                raise ValueError("Невалидный диапазон")
+            end = min(int(end_str), file_size - 1)
+
+        # Диапазон за пределами файла пропускаем
+        if start <= end:
+            ranges.append((start, end))
+
+    return ranges
+
+
+def coalesce_ranges(ranges):
+    """Объединяет пересекающиеся и соседние диапазоны"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_passes(request, etag, last_modified):
+    """
+    Проверяет If-Range: Range учитывается, только если представление не менялось.
+    ETag сравнивается строго, дата — на точное совпадение с Last-Modified.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def stream_file_response(file_obj, content_type, status=200, start=0, length=None):
+    """
+    Создает потоковый ответ для открытого файла (или его диапазона).
+    Файл закрывается вместе с ответом.
+    """
+    wrapper = RangeFileWrapper(file_obj, start, length)
+    response = StreamingHttpResponse(wrapper, content_type=content_type, status=status)
+    # Как у FileResponse: WSGI сервер может отдать файл через wsgi.file_wrapper (sendfile)
+    response.file_to_stream = wrapper
+    response.block_size = wrapper.block_size
+    return response
+
+
+def multipart_byteranges_response(file_obj, content_type, ranges, file_size):
+    """Создает ответ multipart/byteranges для нескольких диапазонов"""
+    boundary = secrets.token_hex(16)
+    part_headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+        ).encode('ascii')
+        for start, end in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode('ascii')
+    content_length = sum(
+        len(header) + (end - start + 1) + 2
+        for header, (start, end) in zip(part_headers, ranges)
+    ) + len(closing)
+
+    def parts():
+        for header, (start, end) in zip(part_headers, ranges):
+            yield header
+            yield from RangeFileWrapper(file_obj, start, end - start + 1)
+            yield b'\r\n'
+        yield closing
+
+    response = StreamingHttpResponse(
+        parts(),
+        content_type=f'multipart/byteranges; boundary={boundary}',
+        status=206
+    )
+    # Файл закрывается вместе с ответом, даже если тело так и не начали читать
+    # (обрыв соединения, HEAD, ответ заменен middleware)
+    response._resource_closers.append(file_obj.close)
+    response['Content-Length'] = str(content_length)
+    return response
+
+
+def set_validator_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
 
 
 def ranged_file_response(request, file_path, content_type='audio/mpeg'):
     """
-    Возвращает HTTP Response с поддержкой Range Requests для аудиофайлов
+    Возвращает HTTP Response с поддержкой Range Requests для аудиофайлов.
+
+    Поддерживает условные запросы (ETag, Last-Modified, If-None-Match,
+    If-Modified-Since, If-Range) и несколько диапазонов (multipart/byteranges).
     """
     try:
-        # Открываем файл и получаем его размер
-        file_size = os.path.getsize(file_path)
+        stat, etag, last_modified = file_validators(file_path)
+    except FileNotFoundError:
+        raise Http404("Файл не найден")
+    file_size = stat.st_size
+
+    # Клиент уже имеет актуальную версию файла - 304 Not Modified
+    conditional_response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional_response is not None:
+        set_validator_headers(conditional_response, etag, last_modified)
+        return conditional_response
+
+    # Получаем Range заголовок из запроса
+    range_header = request.META.get('HTTP_RANGE')
+    ranges = None
+    if range_header and if_range_passes(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except ValueError:
+            # При ошибке парсинга возвращаем весь файл
+            ranges = None
+
+    if ranges is not None and not ranges:
+        # Ни один диапазон не пересекается с файлом
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{file_size}'
+        set_validator_headers(response, etag, last_modified)
+        return response
+
+    try:
         file_obj = open(file_path, 'rb')
-        
-        # Получаем Range заголовок из запроса
-        range_header = request.META.get('HTTP_RANGE')
-        
-        if range_header and range_header.startswith('bytes='):
-            try:
-                # Парсим Range заголовок
-                range_spec = range_header[6:]  # Убираем 'bytes='
-                if '-' in range_spec:
-                    start_str, end_str = range_spec.split('-', 1)
-                    
-                    if not start_str:
-                        # bytes=-500 (последние 500 bytes)
-                        start = max(0, file_size - int(end_str))
-                        end = file_size - 1
-                    elif not end_str:
-                        # bytes=500- (от 500 bytes до конца)
-                        start = int(start_str)
-                        end = file_size - 1
-                    else:
-                        # bytes=500-999 (от 500 до 999 bytes)
-                        start = int(start_str)
-                        end = min(int(end_str), file_size - 1)
-                    
-                    if start > end or start < 0:
-                        raise ValueError("Невалидный диапазон")
-                    
-                    # Устанавливаем позицию в файле
-                    file_obj.seek(start)
-                    content_length = end - start + 1
-                    
-                    # Создаем ответ с частичным контентом
-                    response = HttpResponse(
-                        content=file_obj.read(content_length),
-                        content_type=content_type,
-                        status=206  # Partial Content
-                    )
-                    response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
-                    response['Content-Length'] = str(content_length)
-                    
-                else:
-                    raise ValueError("Невалидный формат диапазона")
-            except (ValueError, IndexError):
-                # При ошибке парсинга возвращаем весь файл
-                file_obj.seek(0)
-                response = HttpResponse(
-                    content=file_obj.read(),
-                    content_type=content_type,
-                    status=200
-                )
-                response['Content-Length'] = str(file_size)
-        else:
+    except FileNotFoundError:
+        raise Http404("Файл не найден")
+
+    try:
+        if not ranges:
             # Нет Range заголовка - возвращаем весь файл
-            file_obj.seek(0)
-            response = HttpResponse(
-                content=file_obj.read(),
-                content_type=content_type,
-                status=200
-            )
+            response = stream_file_response(file_obj, content_type)
             response['Content-Length'] = str(file_size)
-        
+        else:
+            ranges = coalesce_ranges(ranges) if len(ranges) > 1 else ranges
+            if len(ranges) == 1:
+                # Создаем ответ с частичным контентом
+                start, end = ranges[0]
+                content_length = end - start + 1
+                response = stream_file_response(file_obj, content_type, status=206, start=start, length=content_length)
+                response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+                response['Content-Length'] = str(content_length)
+            else:
+                response = multipart_byteranges_response(file_obj, content_type, ranges, file_size)
+
         # Добавляем обязательные заголовки для поддержки Range Requests
-        response['Accept-Ranges'] = 'bytes'
+        set_validator_headers(response, etag, last_modified)
         response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
-        
-        # Устанавливаем обработчик закрытия файла
-        response.file_to_close = file_obj
-        
+
         return response
-    
-    except FileNotFoundError:
-        raise Http404("Файл не найден")
+
     except Exception:
-        if 'file_obj' in locals():
-            file_obj.close()
-        raise
\ No newline at end of file
+        file_obj.close()
+        raise
+
+
+def offloaded_file_response(file_path, content_type='audio/mpeg'):
+    """
+    Возвращает пустой ответ с заголовком X-Accel-Redirect или X-Sendfile:
+    файл (включая Range и условные запросы) отдает фронтовой сервер,
+    а Python воркер освобождается сразу после проверки доступа.
+    """
+    mode = settings.MEDIA_OFFLOAD_MODE
+    response = HttpResponse(content_type=content_type)
+
+    if mode == 'x-accel-redirect':
+        relative_path = os.path.relpath(file_path, settings.MEDIA_ROOT)
+        if relative_path.startswith('..'):
+            raise ImproperlyConfigured(f"File is outside MEDIA_ROOT: {file_path}")
+        prefix = settings.MEDIA_OFFLOAD_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = f"{prefix}/{quote(relative_path.replace(os.sep, '/'))}"
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = file_path
+    else:
+        raise ImproperlyConfigured(f"Unknown MEDIA_OFFLOAD_MODE: {mode}")
+
+    response['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
+    return response
@@ -0,0 +1,139 @@
+"""
+Замер времени обработки запросов: заголовок Server-Timing и выборочный профилинг.
+
+Middleware считает время запросов к БД (через connection.execute_wrapper),
+время рендера субтитров (timing.measure('render') в коде рендера) и общее время
+и отдает их в заголовке Server-Timing (по умолчанию выключен, SERVER_TIMING_ENABLED). Доля sample_rate запросов дополнительно
+профилируется cProfile, дампы складываются в REQUEST_PROFILE_DIR, старые
+удаляются сверх REQUEST_PROFILE_MAX_FILES.
+
+Настройки можно менять без перезапуска через JSON файл REQUEST_PROFILE_CONTROL_FILE,
+например {"server_timing": true, "sample_rate": 0.05, "path_prefixes": ["/api/"]}:
+файл перечитывается при изменении mtime, отсутствующие ключи берутся из settings.
+"""
+import cProfile
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from .timing import collect, measure
+
+_control_lock = threading.Lock()
+_control_cache = {'path': None, 'mtime': None, 'values': {}}
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    with measure('db'):
+        return execute(sql, params, many, context)
+
+
+def read_control_file(path):
+    """Содержимое файла управления; перечитывается только при изменении mtime"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    with _control_lock:
+        if _control_cache['path'] == path and _control_cache['mtime'] == mtime:
+            return _control_cache['values']
+        try:
+            with open(path) as f:
+                values = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Не удалось прочитать {path}: {e}")
+            values = {}
+        if not isinstance(values, dict):
+            values = {}
+        _control_cache.update(path=path, mtime=mtime, values=values)
+        return values
+
+
+def current_config():
+    """Настройки из settings, переопределенные файлом управления"""
+    config = {
+        'server_timing': settings.SERVER_TIMING_ENABLED,
+        'sample_rate': settings.REQUEST_PROFILE_SAMPLE_RATE,
+        'path_prefixes': settings.REQUEST_PROFILE_PATH_PREFIXES,
+    }
+    if settings.REQUEST_PROFILE_CONTROL_FILE:
+        config.update(read_control_file(settings.REQUEST_PROFILE_CONTROL_FILE))
+    return config
+
+
+def format_server_timing(timings, total_seconds, profile_name=None):
+    """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+    metrics = []
+    for name, (seconds, count) in timings.items():
+        metrics.append(f'{name};dur={seconds * 1000:.1f};desc="{count}x"')
+    metrics.append(f'total;dur={total_seconds * 1000:.1f}')
+    if profile_name:
+        metrics.append(f'profile;desc="{profile_name}"')
+    return ', '.join(metrics)
+
+
+def save_profile(profiler, request, total_seconds):
+    """Сохраняет дамп cProfile и удаляет самые старые дампы сверх лимита"""
+    profile_dir = settings.REQUEST_PROFILE_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'root'
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{time.time_ns() % 10 ** 9:09d}_{request.method}_{slug[:80]}_{total_seconds * 1000:.0f}ms.prof"
+    profiler.dump_stats(os.path.join(profile_dir, name))
+
+    dumps = sorted(
+        (entry for entry in os.scandir(profile_dir) if entry.name.endswith('.prof')),
+        key=lambda entry: (entry.stat().st_mtime_ns, entry.name),
+    )
+    for entry in dumps[:max(len(dumps) - settings.REQUEST_PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    return name
+
+
+class ServerTimingMiddleware:
+    """Заголовок Server-Timing (db, render, total) и выборочный профилинг запросов"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = current_config()
+        sample_rate = float(config.get('sample_rate') or 0)
+        should_profile = (
+            sample_rate > 0
+            and request.path.startswith(tuple(config.get('path_prefixes') or ('/',)))
+            and random.random() < sample_rate
+        )
+        if not config.get('server_timing') and not should_profile:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile() if should_profile else None
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            timings = stack.enter_context(collect())
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(_db_wrapper))
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # В потоке уже работает другой профилировщик
+                    profiler = None
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        total_seconds = time.perf_counter() - started
+
+        profile_name = save_profile(profiler, request, total_seconds) if profiler is not None else None
+        if config.get('server_timing'):
+            # Для потоковых ответов рендер идет уже после заголовков и в замер не попадает
+            response['Server-Timing'] = format_server_timing(timings, total_seconds, profile_name)
+        return response
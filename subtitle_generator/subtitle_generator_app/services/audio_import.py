@@ -0,0 +1,98 @@
+"""
+Импорт аудио по URL: файл скачивается потоком во временный файл (целиком
+в памяти не держится), размер ограничен AUDIO_IMPORT_MAX_BYTES, формат
+определяется по сигнатуре первых байт, а при неизвестной сигнатуре — по
+Content-Type и расширению в URL.
+"""
+import hashlib
+import os
+from urllib.parse import urlparse
+import requests
+from django.conf import settings
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Сколько первых байт нужно для определения формата
+SNIFF_BYTES = 16
+
+
+class AudioImportError(Exception):
+    """Файл по URL нельзя импортировать (повтор не поможет)"""
+
+
+def sniff_extension(head):
+    """Определяет формат аудио по первым байтам файла, None — если формат неизвестен"""
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return 'wav'
+    if head.startswith(b'OggS'):
+        return 'ogg'
+    if head.startswith(b'fLaC'):
+        return 'flac'
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head.startswith(b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'):
+        return 'wma'
+    return None
+
+
+def extension_from_headers(content_type, url):
+    """Формат по Content-Type и расширению в URL, None — если это не похоже на аудио"""
+    path = urlparse(url).path.lower()
+    if 'audio/wav' in content_type or 'audio/x-wav' in content_type or path.endswith('.wav'):
+        return 'wav'
+    if 'audio/ogg' in content_type or path.endswith('.ogg'):
+        return 'ogg'
+    if 'audio/mp4' in content_type or 'audio/m4a' in content_type or path.endswith('.m4a'):
+        return 'm4a'
+    if 'audio/flac' in content_type or path.endswith('.flac'):
+        return 'flac'
+    if 'audio/mpeg' in content_type or path.endswith('.mp3'):
+        return 'mp3'
+    return None
+
+
+def download_audio(url, output_path):
+    """
+    Скачивает аудио по url в output_path.
+    Возвращает (расширение, размер в байтах, SHA-256 содержимого).
+    Непригодный файл (слишком большой, не аудио, ответ 4xx) — AudioImportError,
+    сетевые ошибки и ответы 5xx пробрасываются как requests.RequestException.
+    """
+    max_bytes = settings.AUDIO_IMPORT_MAX_BYTES
+    timeout = (settings.AUDIO_IMPORT_CONNECT_TIMEOUT, settings.AUDIO_IMPORT_READ_TIMEOUT)
+
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        if 400 <= response.status_code < 500:
+            raise AudioImportError(f"Audio URL returned HTTP {response.status_code}")
+        response.raise_for_status()
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise AudioImportError(f"Audio file is too large: {content_length} bytes (limit {max_bytes})")
+
+        content_type = response.headers.get('Content-Type', '').lower()
+        digest = hashlib.sha256()
+        head = b''
+        size = 0
+        try:
+            with open(output_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise AudioImportError(f"Audio file is larger than {max_bytes} bytes")
+                    if len(head) < SNIFF_BYTES:
+                        head += chunk[:SNIFF_BYTES - len(head)]
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+    extension = sniff_extension(head) or extension_from_headers(content_type, url)
+    if extension is None:
+        os.remove(output_path)
+        raise AudioImportError(f"URL does not point to a supported audio file (Content-Type: {content_type or 'unknown'})")
+    return extension, size, digest.hexdigest()
@@ -3,100 +3,150 @@ import uuid
 import time
 import shutil
 from django.conf import settings
-from . import demucs_client
+from . import demucs_client, hashing
+from .. import stem_cache
 
 
-def separate_audio(project_id, audio_path):
+class SeparationFailed(Exception):
+    """MVSEP сообщил об ошибке задачи разделения - ее нужно создавать заново"""
+
+
+def get_temp_output_dir(project_id):
+    """Временная директория для скачивания результатов разделения"""
+    return os.path.join(settings.MEDIA_ROOT, 'temp_separation', str(project_id))
+
+
+def start_separation(audio_path):
     """
-    Разделяет аудио файл на вокал и инструментал с использованием Demucs API.
-    Возвращает пути к созданным файлам вокала и инструментала.
+    Отправляет аудио файл на разделение и сразу возвращает хэш задачи MVSEP,
+    не дожидаясь ее завершения.
     """
     if not os.path.exists(audio_path):
         raise FileNotFoundError(f"Audio file not found at: {audio_path}")
 
-    # Создаем временную директорию для сохранения результатов разделения
-    temp_output_dir = os.path.join(settings.MEDIA_ROOT, 'temp_separation', str(project_id))
+    task_hash = demucs_client.create_separation(audio_path, sep_type='40')
+    if not task_hash:
+        raise Exception("Failed to create separation task")
+    return task_hash
+
+
+def collect_separation(project_id, task_hash):
+    """
+    Однократно проверяет задачу разделения.
+    Возвращает None, если задача еще обрабатывается (недокачанные файлы
+    остаются во временной директории и докачаются при следующей проверке),
+    или пути к файлам вокала и инструментала относительно MEDIA_ROOT.
+    """
+    temp_output_dir = get_temp_output_dir(project_id)
     os.makedirs(temp_output_dir, exist_ok=True)
 
+    status = demucs_client.check_and_download_result(task_hash, output_dir=temp_output_dir)
+    if status == 'processing':
+        return None
+
     try:
-        # Шаг 1: Отправляем файл на разделение
-        task_hash = demucs_client.create_separation(audio_path, sep_type='40')
-        if not task_hash:
-            raise Exception("Failed to create separation task")
+        if status == 'error':
+            raise SeparationFailed("Ошибка при разделении аудио")
 
-        # Шаг 2: Ожидаем завершения разделения
-        print(f"Ожидаем завершения разделения для задачи: {task_hash}")
-        while True:
-            status = demucs_client.check_and_download_result(task_hash, output_dir=temp_output_dir)
-            
-            if status == 'done':
-                print("Разделение завершено!")
-                break
-            elif status == 'error':
-                raise Exception("Ошибка при разделении аудио")
-            
-            # Ждем 10 секунд перед следующей проверкой
-            time.sleep(10)
+        print("Разделение завершено!")
+        return store_separated_files(temp_output_dir)
+    finally:
+        # Очищаем временную директорию
+        if os.path.exists(temp_output_dir):
+            shutil.rmtree(temp_output_dir)
 
-        # Шаг 3: Находим файлы вокала и инструментала в директории
-        vocal_file = None
-        instrumental_file = None
-        
-        print(f"Проверяем файлы в директории: {temp_output_dir}")
-        for filename in os.listdir(temp_output_dir):
-            print(f"Найден файл: {filename}")
-            if 'vocals' in filename.lower() or 'vocal' in filename.lower():
-                vocal_file = os.path.join(temp_output_dir, filename)
-                print(f"Найден вокальный файл: {vocal_file}")
-            elif 'other' in filename.lower() or 'instrumental' in filename.lower() or 'instr' in filename.lower():
-                instrumental_file = os.path.join(temp_output_dir, filename)
-                print(f"Найден инструментальный файл: {instrumental_file}")
-
-        if not vocal_file or not instrumental_file:
-            # Если не нашли файлы по ключевым словам, пробуем использовать все доступные файлы
-            files = [f for f in os.listdir(temp_output_dir) if f.endswith('.mp3')]
-            print(f"Всего найдено mp3 файлов: {len(files)}")
-            
-            if len(files) >= 2:
-                # Предполагаем, что первый файл - вокал, второй - инструментал
-                vocal_file = os.path.join(temp_output_dir, files[0])
-                instrumental_file = os.path.join(temp_output_dir, files[1])
-                print(f"Используем альтернативное определение файлов:")
-                print(f"  Вокал: {vocal_file}")
-                print(f"  Инструментал: {instrumental_file}")
-            else:
-                raise Exception("Не удалось найти достаточное количество файлов after разделения")
-
-        # Шаг 4: Генерируем уникальные имена для файлов
-        file_extension = 'mp3'  # Предполагаем, что всегда mp3
+
+def store_separated_files(temp_output_dir):
+    """
+    Находит файлы вокала и инструментала среди скачанных и перемещает их
+    в постоянное хранилище. Возвращает пути относительно MEDIA_ROOT.
+    """
+    # Шаг 1: Находим файлы вокала и инструментала в директории
+    vocal_file = None
+    instrumental_file = None
+    
+    print(f"Проверяем файлы в директории: {temp_output_dir}")
+    for filename in os.listdir(temp_output_dir):
+        print(f"Найден файл: {filename}")
+        if 'vocals' in filename.lower() or 'vocal' in filename.lower():
+            vocal_file = os.path.join(temp_output_dir, filename)
+            print(f"Найден вокальный файл: {vocal_file}")
+        elif 'other' in filename.lower() or 'instrumental' in filename.lower() or 'instr' in filename.lower():
+            instrumental_file = os.path.join(temp_output_dir, filename)
+            print(f"Найден инструментальный файл: {instrumental_file}")
+
+    if not vocal_file or not instrumental_file:
+        # Если не нашли файлы по ключевым словам, пробуем использовать все доступные файлы
+        files = [f for f in os.listdir(temp_output_dir) if f.endswith('.mp3')]
+        print(f"Всего найдено mp3 файлов: {len(files)}")
         
-        vocal_filename = f"{uuid.uuid4()}_vocal.{file_extension}"
-        instrumental_filename = f"{uuid.uuid4()}_instrumental.{file_extension}"
+        if len(files) >= 2:
+            # Предполагаем, что первый файл - вокал, второй - инструментал
+            vocal_file = os.path.join(temp_output_dir, files[0])
+            instrumental_file = os.path.join(temp_output_dir, files[1])
+            print(f"Используем альтернативное определение файлов:")
+            print(f"  Вокал: {vocal_file}")
+            print(f"  Инструментал: {instrumental_file}")
+        else:
+            raise Exception("Не удалось найти достаточное количество файлов after разделения")
 
-        # Шаг 5: Перемещаем файлы в постоянное хранилище
-        audio_storage_dir = os.path.join(settings.MEDIA_ROOT, 'audio')
-        os.makedirs(audio_storage_dir, exist_ok=True)
+    # Шаг 2: Генерируем уникальные имена для файлов
+    file_extension = 'mp3'  # Предполагаем, что всегда mp3
+    
+    vocal_filename = f"{uuid.uuid4()}_vocal.{file_extension}"
+    instrumental_filename = f"{uuid.uuid4()}_instrumental.{file_extension}"
 
-        vocal_destination = os.path.join(audio_storage_dir, vocal_filename)
-        instrumental_destination = os.path.join(audio_storage_dir, instrumental_filename)
+    # Шаг 3: Перемещаем файлы в постоянное хранилище
+    audio_storage_dir = os.path.join(settings.MEDIA_ROOT, 'audio')
+    os.makedirs(audio_storage_dir, exist_ok=True)
 
-        print(f"Перемещаем вокальный файл из {vocal_file} в {vocal_destination}")
-        print(f"Перемещаем инструментальный файл из {instrumental_file} in {instrumental_destination}")
-        
-        shutil.move(vocal_file, vocal_destination)
-        shutil.move(instrumental_file, instrumental_destination)
+    vocal_destination = os.path.join(audio_storage_dir, vocal_filename)
+    instrumental_destination = os.path.join(audio_storage_dir, instrumental_filename)
 
-        # Шаг 6: Возвращаем пути к файлам относительно MEDIA_ROOT
-        vocal_path = os.path.join('audio', vocal_filename)
-        instrumental_path = os.path.join('audio', instrumental_filename)
-        
-        print(f"Возвращаем пути:")
-        print(f"  Вокал: {vocal_path}")
-        print(f"  Инструментал: {instrumental_path}")
+    print(f"Перемещаем вокальный файл из {vocal_file} в {vocal_destination}")
+    print(f"Перемещаем инструментальный файл из {instrumental_file} in {instrumental_destination}")
+    
+    shutil.move(vocal_file, vocal_destination)
+    shutil.move(instrumental_file, instrumental_destination)
+
+    # Шаг 4: Возвращаем пути к файлам относительно MEDIA_ROOT
+    vocal_path = os.path.join('audio', vocal_filename)
+    instrumental_path = os.path.join('audio', instrumental_filename)
+    
+    print(f"Возвращаем пути:")
+    print(f"  Вокал: {vocal_path}")
+    print(f"  Инструментал: {instrumental_path}")
+
+    return vocal_path, instrumental_path
+
+
+def separate_audio(project_id, audio_path):
+    """
+    Разделяет аудио файл на вокал и инструментал с использованием Demucs API.
+    Возвращает пути к созданным файлам вокала и инструментала.
+    Если этот же трек уже разделялся, возвращает стемы из кэша
+    (вызывающий получает на них ссылку, см. stem_cache.release).
+    Блокирует вызывающий поток до завершения разделения; в Celery
+    используется неблокирующий опрос (см. tasks.separate_audio_task).
+    """
+    audio_sha256 = hashing.file_sha256(audio_path)
+    cached_stems = stem_cache.acquire(audio_sha256)
+    if cached_stems is not None:
+        return cached_stems
+
+    task_hash = start_separation(audio_path)
 
-        return vocal_path, instrumental_path
+    # Ожидаем завершения разделения
+    print(f"Ожидаем завершения разделения для задачи: {task_hash}")
+    try:
+        while True:
+            result = collect_separation(project_id, task_hash)
+            if result is not None:
+                return stem_cache.store(audio_sha256, *result)
 
+            # Ждем 10 секунд перед следующей проверкой
+            time.sleep(10)
     finally:
-        # Очищаем временную директорию
+        temp_output_dir = get_temp_output_dir(project_id)
         if os.path.exists(temp_output_dir):
-            shutil.rmtree(temp_output_dir)
\ No newline at end of file
+            shutil.rmtree(temp_output_dir)
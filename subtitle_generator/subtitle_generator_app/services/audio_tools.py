@@ -0,0 +1,265 @@
+"""
+Работа с аудио через ffmpeg: длительность, энергия сигнала и нарезка на фрагменты.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import mul
+
+# Частота дискретизации для анализа энергии (моно, 16 бит)
+ANALYSIS_SAMPLE_RATE = 8000
+# Длина кадра анализа энергии в секундах
+ENERGY_FRAME_SECONDS = 0.05
+# Частота, к которой приводится вокал перед вырезанием тишины: границы участков
+# режутся по отсчетам этой частоты, и карта смещений строится по тем же отсчетам
+COMPACT_SAMPLE_RATE = 16000
+# Битрейт Opus для речи: моно 16 кГц, для распознавания этого достаточно
+SPEECH_BITRATE = '32k'
+
+
+def encoder_args(output_path):
+    """Параметры кодирования по расширению: .ogg — Opus для речи, иначе mp3"""
+    if output_path.endswith('.ogg'):
+        return ['-ar', '16000', '-c:a', 'libopus', '-b:a', SPEECH_BITRATE, '-application', 'voip']
+    return ['-c:a', 'libmp3lame', '-b:a', '96k']
+
+
+def probe_duration(file_path):
+    """Возвращает длительность аудио в секундах (через ffprobe)"""
+    result = subprocess.run(
+        [
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'json',
+            file_path,
+        ],
+        capture_output=True,
+        check=True,
+    )
+    return float(json.loads(result.stdout)['format']['duration'])
+
+
+def frame_energies(file_path, frame_seconds=ENERGY_FRAME_SECONDS, sample_rate=ANALYSIS_SAMPLE_RATE):
+    """
+    Декодирует аудио в моно PCM и возвращает среднюю энергию (средний квадрат
+    амплитуды) для каждого кадра длиной frame_seconds. Файл читается потоком,
+    в памяти хранится только один кадр.
+    """
+    frame_samples = max(1, int(sample_rate * frame_seconds))
+    frame_bytes = frame_samples * 2
+    process = subprocess.Popen(
+        [
+            'ffmpeg', '-v', 'error', '-i', file_path,
+            '-vn', '-ac', '1', '-ar', str(sample_rate),
+            '-f', 's16le', '-',
+        ],
+        stdout=subprocess.PIPE,
+    )
+
+    energies = []
+    try:
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < 2:
+                break
+            samples = array('h', data[:len(data) - len(data) % 2])
+            energies.append(sum(map(mul, samples, samples)) / len(samples))
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {file_path}")
+
+    return energies
+
+
+def choose_split_points(energies, frame_seconds, chunk_seconds, search_seconds):
+    """
+    Выбирает точки разреза (в секундах) примерно каждые chunk_seconds:
+    разрез ставится в самый тихий кадр среди последних search_seconds
+    очередного фрагмента, чтобы не резать посреди слова.
+    """
+    duration = len(energies) * frame_seconds
+    chunk_frames = max(1, int(chunk_seconds / frame_seconds))
+    search_frames = max(1, min(int(search_seconds / frame_seconds), chunk_frames))
+
+    points = []
+    start = 0
+    while len(energies) - start > chunk_frames:
+        window_end = start + chunk_frames
+        window_start = max(start + 1, window_end - search_frames)
+        # При равной энергии берем более поздний кадр (фрагмент ближе к целевой длине)
+        cut = min(range(window_start, window_end), key=lambda i: (energies[i], -i))
+        points.append(round(cut * frame_seconds, 3))
+        start = cut
+
+    return [point for point in points if 0 < point < duration]
+
+
+def plan_chunks(duration, split_points, overlap_seconds):
+    """
+    Строит фрагменты по точкам разреза. Каждый фрагмент расширяется на
+    overlap_seconds в обе стороны; cut_start/cut_end — границы, по которым
+    при склейке распределяются слова из перекрытий.
+    """
+    cuts = [0.0] + list(split_points) + [duration]
+    return [
+        {
+            'start': max(0.0, cut_start - overlap_seconds),
+            'end': min(duration, cut_end + overlap_seconds),
+            'cut_start': cut_start,
+            'cut_end': cut_end,
+        }
+        for cut_start, cut_end in zip(cuts, cuts[1:])
+    ]
+
+
+def extract_chunk(file_path, start, duration, output_path):
+    """Вырезает фрагмент [start, start + duration) в моно файл (кодек — по расширению)"""
+    subprocess.run(
+        [
+            'ffmpeg', '-v', 'error', '-y',
+            '-ss', f"{start:.3f}", '-t', f"{duration:.3f}",
+            '-i', file_path,
+            '-vn', '-ac', '1', *encoder_args(output_path),
+            output_path,
+        ],
+        check=True,
+    )
+    return output_path
+
+
+def ffmpeg_available():
+    """Проверяет, что ffmpeg и ffprobe установлены"""
+    return bool(shutil.which('ffmpeg') and shutil.which('ffprobe'))
+
+
+def voiced_regions(energies, frame_seconds, threshold_ratio, min_silence_seconds, padding_seconds):
+    """
+    Находит участки с голосом по энергии кадров. Порог берется между уровнем
+    шума (10-й перцентиль) и громкими кадрами (95-й перцентиль); участки
+    расширяются на padding_seconds, а паузы короче min_silence_seconds
+    не вырезаются. Возвращает список (начало, конец) в секундах.
+    """
+    duration = len(energies) * frame_seconds
+    if not energies:
+        return []
+
+    ordered = sorted(energies)
+    noise_floor = ordered[len(ordered) // 10]
+    peak = ordered[len(ordered) * 95 // 100]
+    if peak <= noise_floor:
+        # Ровный сигнал — вырезать нечего
+        return [(0.0, duration)]
+    threshold = noise_floor + (peak - noise_floor) * threshold_ratio
+
+    regions = []
+    for index, energy in enumerate(energies):
+        if energy <= threshold:
+            continue
+        start = max(0.0, index * frame_seconds - padding_seconds)
+        end = min(duration, (index + 1) * frame_seconds + padding_seconds)
+        if regions and start - regions[-1][1] < min_silence_seconds:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+
+    return [(round(start, 3), round(end, 3)) for start, end in regions]
+
+
+def region_samples(regions, sample_rate=COMPACT_SAMPLE_RATE):
+    """Границы участков в отсчетах: [(первый отсчет, отсчет после последнего)]"""
+    return [(round(start * sample_rate), round(end * sample_rate)) for start, end in regions]
+
+
+def build_offset_map(regions, sample_rate=COMPACT_SAMPLE_RATE):
+    """
+    Карта смещений для сжатого файла, склеенного из regions:
+    список [начало в сжатом файле, начало в исходном файле, длительность].
+    Начала в сжатом файле считаются по целым отсчетам, как их режет compact_audio,
+    поэтому ошибка округления не накапливается от участка к участку.
+    """
+    offset_map = []
+    compact_samples = 0
+    for start_sample, end_sample in region_samples(regions, sample_rate):
+        offset_map.append([
+            round(compact_samples / sample_rate, 3),
+            round(start_sample / sample_rate, 3),
+            round((end_sample - start_sample) / sample_rate, 3),
+        ])
+        compact_samples += end_sample - start_sample
+    return offset_map
+
+
+def map_time(seconds, offset_map, is_end=False, compact_starts=None):
+    """
+    Переводит время в сжатом файле во время в исходном. Конец слова,
+    попавший ровно на стык участков, относится к предыдущему участку.
+    compact_starts — заранее посчитанные начала участков (для пакетного перевода).
+    """
+    if compact_starts is None:
+        compact_starts = [entry[0] for entry in offset_map]
+    if is_end:
+        index = bisect_left(compact_starts, seconds) - 1
+    else:
+        index = bisect_right(compact_starts, seconds) - 1
+    compact_start, original_start, duration = offset_map[max(index, 0)]
+    return round(original_start + min(max(seconds - compact_start, 0.0), duration), 3)
+
+
+def compact_filter_graph(regions, sample_rate=COMPACT_SAMPLE_RATE):
+    """
+    Граф фильтров ffmpeg, склеивающий участки regions. Каждый участок вырезается
+    atrim по номерам отсчетов (а не целыми декодированными кадрами, как aselect),
+    поэтому длина сжатого файла совпадает с картой build_offset_map.
+    """
+    labels = [f"[r{index}]" for index in range(len(regions))]
+    parts = [
+        f"[0:a]aformat=channel_layouts=mono,aresample={sample_rate},asplit={len(regions)}"
+        + ''.join(f"[s{index}]" for index in range(len(regions)))
+    ]
+    for index, (start_sample, end_sample) in enumerate(region_samples(regions, sample_rate)):
+        parts.append(
+            f"[s{index}]atrim=start_sample={start_sample}:end_sample={end_sample},asetpts=PTS-STARTPTS{labels[index]}"
+        )
+    parts.append(f"{''.join(labels)}concat=n={len(regions)}:v=0:a=1[out]")
+    return ';\n'.join(parts)
+
+
+def compact_audio(file_path, regions, output_path):
+    """Склеивает участки regions исходного файла в один моно файл без пауз"""
+    # Граф со множеством участков может не поместиться в аргумент командной строки
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as script:
+        script.write(compact_filter_graph(regions))
+    try:
+        subprocess.run(
+            [
+                'ffmpeg', '-v', 'error', '-y',
+                '-i', file_path,
+                '-filter_complex_script', script.name,
+                '-map', '[out]',
+                *encoder_args(output_path),
+                output_path,
+            ],
+            check=True,
+        )
+    finally:
+        os.remove(script.name)
+    return output_path
+
+
+def transcode_for_speech(file_path, output_path):
+    """Перекодирует аудио в компактный моно файл для распознавания речи (Opus в .ogg)"""
+    subprocess.run(
+        [
+            'ffmpeg', '-v', 'error', '-y',
+            '-i', file_path,
+            '-vn', '-ac', '1', *encoder_args(output_path),
+            output_path,
+        ],
+        check=True,
+    )
+    return output_path
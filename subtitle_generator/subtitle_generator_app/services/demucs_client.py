@@ -1,12 +1,24 @@
 import os
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
 
 # Константы
 API_TOKEN = settings.DEMUCS_API_KEY
-BASE_URL = "https://mvsep.com/api/separation"
+BASE_URL = getattr(settings, 'MVSEP_BASE_URL', "https://mvsep.com/api/separation")
+
+# Таймауты (connect, read) в секундах: воркер не должен зависать навсегда
+TIMEOUT = (
+    getattr(settings, 'MVSEP_CONNECT_TIMEOUT', 10),
+    getattr(settings, 'MVSEP_READ_TIMEOUT', 60),
+)
+
+# Размер чанка при скачивании стемов
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 # Путь к вашему файлу (проверьте, что он существует)
 MY_AUDIO = "/Users/nikitaklenskij/Documents/programs/subtitle-generator/subtitle_generator/subtitle_generator_app/media/audio/91ec145f-583b-4cc5-a88e-ea3f30fde8af_Radio_Tapok_-_Nochnye_vedmy_75359838_mp3.mp3"
@@ -17,6 +29,37 @@ EXISTING_HASH = "20251122173128-60ff8d1376-91ec145f-583b-4cc5-a88e-ea3f30fde8af-
 EXISTING_HASH = None
 
 
+def create_session():
+    """
+    Создает HTTP сессию с пулом keep-alive соединений и повторами с backoff.
+    GET запросы повторяются при сетевых ошибках и ответах 429/5xx,
+    POST (создание задачи) — только при ошибках установки соединения,
+    чтобы не создать задачу дважды.
+    """
+    retry = Retry(
+        total=getattr(settings, 'MVSEP_MAX_RETRIES', 5),
+        backoff_factor=getattr(settings, 'MVSEP_RETRY_BACKOFF', 1),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=getattr(settings, 'MVSEP_POOL_SIZE', 10),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Общая сессия модуля: соединения с mvsep.com переиспользуются между
+# созданием задачи, опросами статуса и скачиванием файлов
+session = create_session()
+
+
 def create_separation(file_path, sep_type='40'):
     """
     Отправляет файл на разделение.
@@ -40,7 +83,7 @@ def create_separation(file_path, sep_type='40'):
                 'is_demo': (None, '0'),
             }
 
-            response = requests.post(url, files=files)
+            response = session.post(url, files=files, timeout=TIMEOUT)
             
             # Проверяем статус ответа HTTP
             if response.status_code != 200:
@@ -62,22 +105,75 @@ def create_separation(file_path, sep_type='40'):
         return None
 
 
+def content_total_size(response):
+    """Полный размер файла из Content-Range (bytes 0-99/1000 или bytes */1000)"""
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
 def download_file(url, filename, save_path):
-    """Скачивает один файл по URL"""
-    try:
-        print(f"Скачиваю {filename}...")
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            full_path = os.path.join(save_path, filename)
-            with open(full_path, 'wb') as f:
-                for chunk in response.iter_content(1024 * 1024): # Чанки по 1МБ
-                    f.write(chunk)
+    """
+    Скачивает один файл по URL с докачкой.
+    Данные пишутся в <filename>.part; после обрыва скачивание продолжается
+    с места остановки через Range запрос, готовый файл атомарно
+    переименовывается в <filename>.
+    """
+    full_path = os.path.join(save_path, filename)
+    part_path = f"{full_path}.part"
+
+    if os.path.exists(full_path):
+        print(f"-> Уже скачан: {full_path}")
+        return full_path
+
+    attempts = getattr(settings, 'MVSEP_DOWNLOAD_ATTEMPTS', 3)
+    expected_size = None
+    for attempt in range(1, attempts + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        try:
+            print(f"Скачиваю {filename} (с байта {offset})...")
+            with session.get(url, stream=True, timeout=TIMEOUT, headers=headers) as response:
+                if response.status_code == 416 and offset:
+                    expected_size = content_total_size(response) or expected_size
+                    if offset == expected_size:
+                        # Файл уже скачан целиком
+                        os.replace(part_path, full_path)
+                        print(f"-> Сохранено: {full_path}")
+                        return full_path
+                    # Размер .part не совпал с файлом на сервере - качаем заново
+                    print(f"Недокачанный {filename} ({offset} байт) не совпал с файлом ({expected_size} байт)")
+                    os.remove(part_path)
+                    continue
+
+                if response.status_code == 206 and response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                    mode = 'ab'
+                    expected_size = content_total_size(response)
+                elif response.status_code == 200:
+                    # Сервер не поддерживает Range - качаем заново
+                    mode = 'wb'
+                    content_length = response.headers.get('Content-Length', '')
+                    expected_size = int(content_length) if content_length.isdigit() else None
+                else:
+                    print(f"Ошибка HTTP при скачивании {filename}: {response.status_code}")
+                    return None
+
+                # Небольшие чанки: при обрыве теряется не больше одного чанка
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+
+            os.replace(part_path, full_path)
             print(f"-> Сохранено: {full_path}")
             return full_path
-        else:
-            print(f"Ошибка HTTP при скачивании {filename}: {response.status_code}")
-    except Exception as e:
-        print(f"Ошибка при скачивании: {e}")
+
+        except requests.RequestException as e:
+            print(f"Обрыв при скачивании {filename} (попытка {attempt}/{attempts}): {e}")
+            if attempt < attempts:
+                time.sleep(attempt)
+        except Exception as e:
+            print(f"Ошибка при скачивании: {e}")
+            return None
     return None
 
 
@@ -89,7 +185,7 @@ def check_and_download_result(task_hash, output_dir="./my_stems"):
     params = {'hash': task_hash}
     
     try:
-        response = requests.get(url, params=params)
+        response = session.get(url, params=params, timeout=TIMEOUT)
         data = response.json()
         
         # 1. Проверяем наличие ключа success
@@ -106,15 +202,22 @@ def check_and_download_result(task_hash, output_dir="./my_stems"):
         if files_list and len(files_list) > 0:
             print("Файлы найдены! Начинаю скачивание...")
             os.makedirs(output_dir, exist_ok=True)
-            
-            for file_info in files_list:
+
+            def download(file_info):
                 # Получаем URL и чистим его от экранирования
                 download_url = file_info['url'].replace('\\/', '/')
-                filename = file_info['download']
-                
-                # Скачиваем
-                download_file(download_url, filename, output_dir)
-            
+                return download_file(download_url, file_info['download'], output_dir)
+
+            # Скачиваем стемы параллельно
+            workers = min(getattr(settings, 'MVSEP_DOWNLOAD_WORKERS', 4), len(files_list))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(download, files_list))
+
+            if not all(results):
+                # Недокачанные файлы остаются в .part и докачаются при следующей проверке
+                print("Не все файлы скачаны, повторим при следующей проверке")
+                return 'processing'
+
             return 'done'
             
         # 4. Если файлов нет, проверяем статус (для обработки ошибок)
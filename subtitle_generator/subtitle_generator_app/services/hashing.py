@@ -0,0 +1,13 @@
+import hashlib
+
+# Размер блока, которым файл читается при хэшировании
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """Считает SHA-256 файла, читая его блоками (файл целиком в память не загружается)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
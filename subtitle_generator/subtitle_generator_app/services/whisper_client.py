@@ -1,32 +1,282 @@
 import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from openai import OpenAI
+from . import audio_tools, hashing
+from .. import transcription_cache
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# OPENAI_BASE_URL позволяет направить запросы на совместимый сервер (например, локальную заглушку)
+client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=getattr(settings, 'OPENAI_BASE_URL', None))
 
-def transcribe_audio_vocal(vocal_file_path):
-    """
-    Транскрибирует вокальную дорожку в формат verbose JSON с timestamps слов.
-    """
-    if not os.path.exists(vocal_file_path):
-        raise FileNotFoundError(f"Vocal audio file not found at: {vocal_file_path}")
+# Параметры запроса транскрипции (входят в ключ кэша результатов)
+TRANSCRIPTION_PARAMS = {
+    'model': "whisper-1",
+    'prompt': "Transcribe the song lyrics accurately. Ignore silence.",
+    'temperature': 0.2,
+    'timestamp_granularities': ["word", "segment"],
+}
 
+def request_transcription(vocal_file_path, params=TRANSCRIPTION_PARAMS):
+    """Отправляет файл в Whisper и возвращает verbose JSON ответ (без кэша)"""
     with open(vocal_file_path, "rb") as audio_file:
         transcription = client.audio.transcriptions.create(
-            model="whisper-1",
-            prompt="Transcribe the song lyrics accurately. Ignore silence.",
+            model=params['model'],
+            prompt=params['prompt'],
             file=audio_file,
             response_format="verbose_json",
-            timestamp_granularities=["word", "segment"],
-            temperature=0.2,
+            timestamp_granularities=params['timestamp_granularities'],
+            temperature=params['temperature'],
         )
 
     return transcription.to_dict()
 
+def chunking_params():
+    """Параметры нарезки (входят в ключ кэша, т.к. влияют на результат)"""
+    return {
+        'chunk_seconds': settings.WHISPER_CHUNK_SECONDS,
+        'chunk_search_seconds': settings.WHISPER_CHUNK_SEARCH_SECONDS,
+        'chunk_overlap_seconds': settings.WHISPER_CHUNK_OVERLAP_SECONDS,
+    }
+
+def should_chunk(vocal_file_path):
+    """Решает, транскрибировать ли файл фрагментами (см. WHISPER_CHUNKING)"""
+    mode = settings.WHISPER_CHUNKING
+    if mode == 'never':
+        return False
+    if not audio_tools.ffmpeg_available():
+        print("ffmpeg не найден, файл будет отправлен в Whisper целиком")
+        return False
+    if mode == 'always':
+        return True
+    if os.path.getsize(vocal_file_path) > settings.WHISPER_MAX_UPLOAD_BYTES:
+        return True
+    return audio_tools.probe_duration(vocal_file_path) > settings.WHISPER_CHUNK_MIN_DURATION
+
+def merge_chunk_responses(results):
+    """
+    Склеивает ответы Whisper по фрагментам в один verbose JSON ответ.
+
+    results — список (фрагмент, ответ) в порядке фрагментов. Время слов и
+    сегментов сдвигается на начало фрагмента; из перекрытий берутся только
+    слова и сегменты, середина которых попадает в [cut_start, cut_end)
+    своего фрагмента, поэтому каждое слово остается ровно один раз.
+    """
+    words = []
+    segments = []
+    last_index = len(results) - 1
+
+    for index, (chunk, response) in enumerate(results):
+        offset = chunk['start']
+
+        def keep(item):
+            center = offset + (item['start'] + item['end']) / 2
+            return center >= chunk['cut_start'] and (center < chunk['cut_end'] or index == last_index)
+
+        def shifted(item):
+            return dict(item, start=round(item['start'] + offset, 3), end=round(item['end'] + offset, 3))
+
+        for word in response.get('words') or []:
+            if keep(word):
+                words.append(shifted(word))
+        for segment in response.get('segments') or []:
+            if keep(segment):
+                segments.append(dict(shifted(segment), id=len(segments)))
+
+    merged = {key: value for key, value in results[0][1].items() if key not in ('words', 'segments')}
+    merged['duration'] = results[-1][0]['end']
+    merged['text'] = "".join(segment.get('text', '') for segment in segments) if segments else " ".join(w['word'] for w in words)
+    merged['words'] = words
+    merged['segments'] = segments
+    return merged
+
+def transcribe_chunked(vocal_file_path):
+    """
+    Транскрибирует длинный файл фрагментами: файл режется в тихих местах на
+    перекрывающиеся окна, окна транскрибируются параллельно (не больше
+    WHISPER_CHUNK_WORKERS запросов одновременно), ответы склеиваются.
+    Возвращает (ответ, число отправленных байт).
+    """
+    energies = audio_tools.frame_energies(vocal_file_path)
+    duration = len(energies) * audio_tools.ENERGY_FRAME_SECONDS
+    split_points = audio_tools.choose_split_points(
+        energies,
+        audio_tools.ENERGY_FRAME_SECONDS,
+        settings.WHISPER_CHUNK_SECONDS,
+        settings.WHISPER_CHUNK_SEARCH_SECONDS,
+    )
+    if not split_points:
+        return request_transcription(vocal_file_path), os.path.getsize(vocal_file_path)
+
+    chunks = audio_tools.plan_chunks(duration, split_points, settings.WHISPER_CHUNK_OVERLAP_SECONDS)
+    print(f"Транскрибируем {len(chunks)} фрагментов по ~{settings.WHISPER_CHUNK_SECONDS} с")
+
+    extension = os.path.splitext(vocal_file_path)[1] or '.mp3'
+
+    with tempfile.TemporaryDirectory(prefix='whisper_chunks_') as temp_dir:
+        def transcribe_chunk(numbered_chunk):
+            number, chunk = numbered_chunk
+            chunk_path = audio_tools.extract_chunk(
+                vocal_file_path,
+                chunk['start'],
+                chunk['end'] - chunk['start'],
+                os.path.join(temp_dir, f"chunk_{number:04d}{extension}"),
+            )
+            return chunk, request_transcription(chunk_path), os.path.getsize(chunk_path)
+
+        with ThreadPoolExecutor(max_workers=min(settings.WHISPER_CHUNK_WORKERS, len(chunks))) as executor:
+            results = list(executor.map(transcribe_chunk, enumerate(chunks)))
+
+    upload_bytes = sum(size for _, _, size in results)
+    return merge_chunk_responses([(chunk, response) for chunk, response, _ in results]), upload_bytes
+
+def processing_params():
+    """
+    Параметры предобработки, влияющие на результат (входят в ключ кэша):
+    нарезка на фрагменты, перекодирование и вырезание тишины, если они включены
+    """
+    params = {}
+    if settings.WHISPER_CHUNKING != 'never':
+        params.update(chunking_params())
+    if settings.WHISPER_TRANSCODE:
+        params['transcode_bitrate'] = audio_tools.SPEECH_BITRATE
+    if settings.WHISPER_TRIM_SILENCE:
+        params.update({
+            'trim_threshold': settings.WHISPER_TRIM_THRESHOLD,
+            'trim_min_silence_seconds': settings.WHISPER_TRIM_MIN_SILENCE_SECONDS,
+            'trim_padding_seconds': settings.WHISPER_TRIM_PADDING_SECONDS,
+        })
+    return params
+
+def trim_silence(vocal_file_path, output_path):
+    """
+    Вырезает из вокала участки без голоса в output_path.
+    Возвращает (путь к файлу для загрузки, карту смещений) или
+    (исходный путь, None), если вырезать нечего или ffmpeg недоступен.
+    """
+    if not settings.WHISPER_TRIM_SILENCE or not audio_tools.ffmpeg_available():
+        return vocal_file_path, None
+
+    energies = audio_tools.frame_energies(vocal_file_path)
+    duration = len(energies) * audio_tools.ENERGY_FRAME_SECONDS
+    regions = audio_tools.voiced_regions(
+        energies,
+        audio_tools.ENERGY_FRAME_SECONDS,
+        settings.WHISPER_TRIM_THRESHOLD,
+        settings.WHISPER_TRIM_MIN_SILENCE_SECONDS,
+        settings.WHISPER_TRIM_PADDING_SECONDS,
+    )
+    voiced = sum(end - start for start, end in regions)
+    if not regions or duration - voiced < settings.WHISPER_TRIM_MIN_SAVING_SECONDS:
+        return vocal_file_path, None
+
+    print(f"Вырезаем тишину: {duration:.0f} с -> {voiced:.0f} с")
+    compact_path = audio_tools.compact_audio(vocal_file_path, regions, output_path)
+    return compact_path, audio_tools.build_offset_map(regions)
+
+def remap_response(response, offset_map):
+    """Переводит время слов и сегментов из сжатого файла обратно в исходный"""
+    compact_starts = [entry[0] for entry in offset_map]
+
+    def remapped(item):
+        return dict(
+            item,
+            start=audio_tools.map_time(item['start'], offset_map, compact_starts=compact_starts),
+            end=audio_tools.map_time(item['end'], offset_map, is_end=True, compact_starts=compact_starts),
+        )
+
+    result = dict(response)
+    result['words'] = [remapped(word) for word in response.get('words') or []]
+    result['segments'] = [remapped(segment) for segment in response.get('segments') or []]
+    _, original_start, duration = offset_map[-1]
+    result['duration'] = round(original_start + duration, 3)
+    return result
+
+def prepare_upload(vocal_file_path, temp_dir):
+    """
+    Готовит файл для загрузки в Whisper во временной директории: вырезает
+    тишину и (WHISPER_TRANSCODE) перекодирует в компактный моно Opus.
+    Возвращает (путь к файлу для загрузки, карта смещений или None).
+    """
+    speech = settings.WHISPER_TRANSCODE and audio_tools.ffmpeg_available()
+    extension = '.ogg' if speech else '.mp3'
+
+    upload_path, offset_map = trim_silence(vocal_file_path, os.path.join(temp_dir, f"compact{extension}"))
+    if speech and upload_path == vocal_file_path:
+        upload_path = audio_tools.transcode_for_speech(vocal_file_path, os.path.join(temp_dir, 'speech.ogg'))
+    return upload_path, offset_map
+
+def transcribe_file(vocal_file_path):
+    """
+    Транскрибирует файл целиком или фрагментами (без кэша и предобработки).
+    Возвращает (ответ, число отправленных байт).
+    """
+    if should_chunk(vocal_file_path):
+        return transcribe_chunked(vocal_file_path)
+    return request_transcription(vocal_file_path), os.path.getsize(vocal_file_path)
+
+def transcribe_vocal_track(vocal_file_path, use_cache=None):
+    """
+    Транскрибирует вокальную дорожку в формат verbose JSON с timestamps слов.
+    Перед загрузкой из вокала вырезается тишина (WHISPER_TRIM_SILENCE) и файл
+    перекодируется в компактный моно (WHISPER_TRANSCODE), длинные файлы
+    транскрибируются фрагментами (WHISPER_CHUNKING); время в ответе всегда
+    относится к исходному файлу. Временные файлы удаляются сразу после загрузки.
+
+    Возвращает (ответ, сведения о загрузке): offset_map — карта смещений
+    вырезанной тишины или None, source_bytes — размер вокала, upload_bytes
+    и upload_seconds — сколько отправлено в Whisper и сколько заняли запросы
+    (0 при ответе из кэша).
+    Результат для того же файла и тех же параметров берется из кэша;
+    use_cache=False отключает кэш (по умолчанию — настройка WHISPER_CACHE_ENABLED).
+    """
+    if not os.path.exists(vocal_file_path):
+        raise FileNotFoundError(f"Vocal audio file not found at: {vocal_file_path}")
+
+    upload = {
+        'offset_map': None,
+        'source_bytes': os.path.getsize(vocal_file_path),
+        'upload_bytes': 0,
+        'upload_seconds': 0.0,
+    }
+
+    def transcribe():
+        with tempfile.TemporaryDirectory(prefix='whisper_') as temp_dir:
+            upload_path, upload['offset_map'] = prepare_upload(vocal_file_path, temp_dir)
+            started = time.monotonic()
+            response, upload['upload_bytes'] = transcribe_file(upload_path)
+            upload['upload_seconds'] = round(time.monotonic() - started, 3)
+        print(f"Отправлено в Whisper {upload['upload_bytes']} из {upload['source_bytes']} байт за {upload['upload_seconds']} с")
+        if upload['offset_map']:
+            response = remap_response(response, upload['offset_map'])
+        return response
+
+    if not transcription_cache.is_enabled(use_cache):
+        return transcribe(), upload
+
+    params = dict(TRANSCRIPTION_PARAMS, **processing_params())
+    vocal_sha256 = hashing.file_sha256(vocal_file_path)
+    key = transcription_cache.cache_key(vocal_sha256, params)
+    cached = transcription_cache.get(key)
+    if cached is not None:
+        response, upload['offset_map'] = cached
+        return response, upload
+
+    response = transcribe()
+    transcription_cache.store(key, vocal_sha256, TRANSCRIPTION_PARAMS['model'], response, upload['offset_map'])
+    return response, upload
+
+def transcribe_audio_vocal(vocal_file_path, use_cache=None):
+    """
+    Транскрибирует вокальную дорожку в формат verbose JSON с timestamps слов
+    (см. transcribe_vocal_track).
+    """
+    return transcribe_vocal_track(vocal_file_path, use_cache=use_cache)[0]
+
 def transcribe_audio(file_path):
     """
     Отправляет файл в Whisper и возвращает контент SRT.
     Устаревшая функция, оставлена для совместимости.
     """
     return transcribe_audio_vocal(file_path)
-
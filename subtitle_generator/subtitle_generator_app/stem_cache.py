@@ -0,0 +1,122 @@
+"""
+Контентно-адресуемый кэш результатов разделения.
+
+Стемы хранятся под SHA-256 исходного аудио (audio/stems/<sha256>_vocal.mp3),
+поэтому повторная загрузка того же трека не создает новую задачу MVSEP.
+Каждый проект, использующий стемы, увеличивает ref_count записи; файлы
+удаляются, только когда проектов со ссылкой на них не осталось.
+"""
+import os
+import shutil
+from django.conf import settings
+from django.db import transaction
+from .models import SeparatedStems
+
+STEMS_DIR = os.path.join('audio', 'stems')
+
+
+def _files_exist(entry):
+    return all(
+        os.path.exists(os.path.join(settings.MEDIA_ROOT, name))
+        for name in (entry.vocal_audio.name, entry.instrumental_audio.name)
+    )
+
+
+def _remove_files(*names):
+    for name in names:
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def acquire(audio_sha256):
+    """
+    Берет ссылку на готовые стемы для аудио с таким хэшем.
+    Возвращает пути (вокал, инструментал) относительно MEDIA_ROOT или None.
+    """
+    if not audio_sha256:
+        return None
+
+    with transaction.atomic():
+        entry = SeparatedStems.objects.select_for_update().filter(audio_sha256=audio_sha256).first()
+        if entry is None:
+            return None
+        if not _files_exist(entry):
+            # Файлы пропали с диска. Запись со ссылками не удаляем: проекты
+            # по-прежнему учтены в ref_count, а store восстановит файлы
+            if not entry.ref_count:
+                entry.delete()
+            return None
+        entry.ref_count += 1
+        entry.save(update_fields=['ref_count'])
+        return entry.vocal_audio.name, entry.instrumental_audio.name
+
+
+def store(audio_sha256, vocal_path, instrumental_path):
+    """
+    Переносит только что полученные стемы в кэш под хэшем аудио и берет
+    на них ссылку. Если стемы для этого хэша уже есть (параллельное разделение
+    того же трека), новые файлы удаляются и используются существующие.
+    Возвращает пути (вокал, инструментал) относительно MEDIA_ROOT.
+    """
+    if not audio_sha256:
+        return vocal_path, instrumental_path
+
+    existing = acquire(audio_sha256)
+    if existing is not None:
+        _remove_files(vocal_path, instrumental_path)
+        return existing
+
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, STEMS_DIR), exist_ok=True)
+    stored_paths = []
+    for path, kind in ((vocal_path, 'vocal'), (instrumental_path, 'instrumental')):
+        extension = os.path.splitext(path)[1]
+        stored_path = os.path.join(STEMS_DIR, f"{audio_sha256}_{kind}{extension}")
+        shutil.move(os.path.join(settings.MEDIA_ROOT, path), os.path.join(settings.MEDIA_ROOT, stored_path))
+        stored_paths.append(stored_path)
+
+    with transaction.atomic():
+        entry, created = SeparatedStems.objects.select_for_update().get_or_create(
+            audio_sha256=audio_sha256,
+            defaults={'vocal_audio': stored_paths[0], 'instrumental_audio': stored_paths[1], 'ref_count': 1},
+        )
+        if not created:
+            # Запись создал параллельный воркер или ее файлы пропали с диска:
+            # указываем ее на новые файлы и сохраняем прежние ссылки
+            entry.vocal_audio.name, entry.instrumental_audio.name = stored_paths
+            entry.ref_count += 1
+            entry.save(update_fields=['vocal_audio', 'instrumental_audio', 'ref_count'])
+
+    return stored_paths[0], stored_paths[1]
+
+
+def release(project):
+    """
+    Отпускает ссылку проекта на стемы. Файлы удаляются, когда ссылок
+    не осталось; стемы проекта не из кэша удаляются сразу.
+    """
+    if not project.vocal_audio:
+        return
+
+    with transaction.atomic():
+        entry = SeparatedStems.objects.select_for_update().filter(
+            audio_sha256=project.audio_sha256,
+            vocal_audio=project.vocal_audio.name,
+        ).first()
+
+        if entry is None:
+            # Стемы принадлежат только этому проекту
+            project.vocal_audio.delete(save=False)
+            if project.instrumental_audio:
+                project.instrumental_audio.delete(save=False)
+            return
+
+        entry.ref_count = max(entry.ref_count - 1, 0)
+        if entry.ref_count:
+            entry.save(update_fields=['ref_count'])
+            return
+
+        names = (entry.vocal_audio.name, entry.instrumental_audio.name)
+        entry.delete()
+
+    _remove_files(*names)
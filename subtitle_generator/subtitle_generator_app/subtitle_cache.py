@@ -0,0 +1,160 @@
+"""
+Кэш отрендеренных субтитров.
+
+Рендер — чистая функция от whisper_response, поэтому результат кэшируется
+по ключу (проект, формат, хэш whisper_response); хэш считается один раз
+при сохранении ответа (Project.whisper_fingerprint). Первый уровень — LRU в памяти
+процесса с ограничением по объему, второй — кэш Django (общий для процессов,
+если настроен Redis). При изменении whisper_response меняется хэш, и старые
+записи перестают использоваться.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+
+def response_fingerprint(response):
+    """Возвращает SHA-256 канонического JSON представления whisper_response"""
+    payload = json.dumps(response, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def content_size(content):
+    """Размер субтитров в байтах UTF-8: лимиты кэша заданы в байтах, а не в символах"""
+    return len(content.encode('utf-8'))
+
+
+class LRUCache:
+    """Потокобезопасный LRU кэш с ограничением суммарного размера записей"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, size):
+        with self._lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+
+# В памяти процесса храним по одной записи на (проект, формат): запись
+# с другим хэшем сразу вытесняет устаревшую
+local_cache = LRUCache(getattr(settings, 'SUBTITLE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'SUBTITLE_CACHE_ALIAS', 'default')]
+
+
+def _shared_key(project_id, fmt, fingerprint):
+    return f"subtitles:{project_id}:{fmt}:{fingerprint}"
+
+
+def get_cached(project_id, fmt, fingerprint):
+    """Возвращает отрендеренные субтитры из кэша или None"""
+    local_key = (project_id, fmt)
+    cached = local_cache.get(local_key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    content = _shared_cache().get(_shared_key(project_id, fmt, fingerprint))
+    if content is not None:
+        local_cache.set(local_key, (fingerprint, content), content_size(content))
+    return content
+
+
+def store(project_id, fmt, fingerprint, content):
+    """Сохраняет отрендеренные субтитры в оба уровня кэша"""
+    size = content_size(content)
+    if size <= getattr(settings, 'SUBTITLE_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024):
+        _shared_cache().set(
+            _shared_key(project_id, fmt, fingerprint),
+            content,
+            getattr(settings, 'SUBTITLE_CACHE_TIMEOUT', 24 * 60 * 60),
+        )
+    local_cache.set((project_id, fmt), (fingerprint, content), size)
+
+
+def get_or_render(project_id, fmt, fingerprint, render):
+    """
+    Возвращает отрендеренные субтитры из кэша или вызывает render()
+    и сохраняет результат.
+    """
+    content = get_cached(project_id, fmt, fingerprint)
+    if content is None:
+        content = render()
+        store(project_id, fmt, fingerprint, content)
+    return content
+
+
+def iter_cached_or_render(project_id, fmt, fingerprint, iter_render, chunk_size=64 * 1024):
+    """
+    Отдает субтитры частями: из кэша, если они там есть, иначе из генератора
+    iter_render(). Результат рендера попадает в кэш, только если не превышает
+    SUBTITLE_CACHE_MAX_ENTRY_BYTES, поэтому память на запрос остается ограниченной.
+    """
+    content = get_cached(project_id, fmt, fingerprint)
+    if content is not None:
+        for offset in range(0, len(content), chunk_size):
+            yield content[offset:offset + chunk_size]
+        return
+
+    max_entry_size = getattr(settings, 'SUBTITLE_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024)
+    parts = []
+    size = 0
+    for chunk in iter_render():
+        if parts is not None:
+            parts.append(chunk)
+            size += content_size(chunk)
+            if size > max_entry_size:
+                # Слишком большой результат не кэшируем и не держим в памяти
+                parts = None
+        yield chunk
+
+    if parts is not None:
+        store(project_id, fmt, fingerprint, "".join(parts))
+
+
+def invalidate_project(project_id):
+    """Удаляет из памяти процесса все отрендеренные субтитры проекта"""
+    for key in local_cache.keys():
+        if key[0] == project_id:
+            local_cache.delete(key)
+
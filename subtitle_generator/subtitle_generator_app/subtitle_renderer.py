@@ -0,0 +1,340 @@
+"""
+Рендеринг субтитров из Whisper verbose JSON.
+
+Ответ Whisper один раз разбирается в промежуточный таймлайн (список блоков
+со временем, текстом и словами), а форматы (SRT со словами, стандартный SRT,
+ASS и т.д.) реализованы как writer'ы поверх этого таймлайна.
+"""
+import heapq
+from bisect import bisect_left
+
+# Параметры группировки слов в блоки, если Whisper не вернул segments
+GROUP_MAX_DURATION = 5
+GROUP_MAX_TEXT_LENGTH = 100
+
+ASS_HEADER = """[Script Info]
+Title: Karaoke Lyrics
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+Collisions: Normal
+PlayDepth: 0
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,60,&H00FFFFFF,&H0000FFFF,&H00000000,&H80000000,-1,0,0,0,100,100,0,0,1,3,0,2,10,10,50,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+# Зарегистрированные writer'ы: имя формата -> генератор(timeline) частей текста
+WRITERS = {}
+
+
+def format_timestamp(seconds):
+    """Форматирует секунды в SRT timestamp формат (HH:MM:SS,mmm)"""
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    secs = int(seconds % 60)
+    millis = int((seconds % 1) * 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+
+def format_timestamp_ass(seconds):
+    """Форматирует секунды в ASS timestamp формат (H:MM:SS.cc)"""
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    secs = int(seconds % 60)
+    centisecs = int((seconds % 1) * 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centisecs:02d}"
+
+
+def _is_sorted_timeline(words):
+    """Проверяет, что слова отсортированы по началу и у каждого start <= end"""
+    previous_start = None
+    for word in words:
+        if word['start'] > word['end']:
+            return False
+        if previous_start is not None and word['start'] < previous_start:
+            return False
+        previous_start = word['start']
+    return True
+
+
+def assign_words_to_segments(segments, words):
+    """
+    Распределяет слова по сегментам за линейное время.
+
+    Возвращает список списков слов: для каждого сегмента — слова, у которых
+    start >= segment['start'] и end <= segment['end'], в исходном порядке.
+    Результат совпадает с поштучной фильтрацией всего списка слов для каждого
+    сегмента, но слова и сегменты проходятся одновременно (bisect + указатель).
+    """
+    if not _is_sorted_timeline(words):
+        # Порядок слов нарушен — используем прямую фильтрацию, чтобы результат не изменился
+        return [
+            [w for w in words if w['start'] >= segment['start'] and w['end'] <= segment['end']]
+            for segment in segments
+        ]
+
+    starts = [word['start'] for word in words]
+    assigned = []
+    lo = 0
+    previous_segment_start = None
+
+    for segment in segments:
+        seg_start = segment['start']
+        seg_end = segment['end']
+
+        # Для отсортированных сегментов указатель только сдвигается вперед
+        if previous_segment_start is None or seg_start < previous_segment_start:
+            lo = 0
+        lo = bisect_left(starts, seg_start, lo)
+        previous_segment_start = seg_start
+
+        segment_words = []
+        index = lo
+        # Слово с началом позже конца сегмента уже не может в него попасть
+        while index < len(words) and starts[index] <= seg_end:
+            word = words[index]
+            if word['end'] <= seg_end:
+                segment_words.append(word)
+            index += 1
+        assigned.append(segment_words)
+
+    return assigned
+
+
+def group_words(words):
+    """
+    Группирует слова в блоки: новый блок начинается каждые 5 секунд
+    или когда текст блока становится длиннее 100 символов.
+    """
+    groups = []
+    current_group = []
+    group_start = None
+    # Длина ' '.join(...) по словам текущего блока, считается инкрементально
+    text_length = -1
+
+    for word in words:
+        if group_start is None:
+            group_start = word['start']
+        group_end = word['end']
+        current_group.append(word)
+        text_length += len(word['word']) + 1
+
+        if group_end - group_start >= GROUP_MAX_DURATION or text_length > GROUP_MAX_TEXT_LENGTH:
+            groups.append({'start': group_start, 'end': group_end, 'words': current_group})
+            current_group = []
+            group_start = None
+            text_length = -1
+
+    # Добавляем последний блок
+    if current_group:
+        groups.append({'start': group_start, 'end': group_end, 'words': current_group})
+
+    return groups
+
+
+def build_timeline(response):
+    """
+    Разбирает Whisper verbose JSON в таймлайн — список блоков вида
+    {'index', 'start', 'end', 'text', 'words'}.
+
+    index — номер блока в SRT: позиция сегмента, если Whisper вернул segments,
+    иначе порядковый номер среди сгруппированных блоков с непустым текстом
+    (у блоков без текста index = None).
+    """
+    segments = response.get('segments', [])
+    words = response.get('words', [])
+    timeline = []
+
+    if segments:
+        words_by_segment = assign_words_to_segments(segments, words)
+        for i, (segment, segment_words) in enumerate(zip(segments, words_by_segment), 1):
+            timeline.append({
+                'index': i,
+                'start': segment['start'],
+                'end': segment['end'],
+                'text': segment.get('text', '').strip(),
+                'words': segment_words,
+            })
+        return timeline
+
+    index = 0
+    for group in group_words(words):
+        text = ' '.join(w['word'] for w in group['words']).strip()
+        if text:
+            index += 1
+        timeline.append({
+            'index': index if text else None,
+            'start': group['start'],
+            'end': group['end'],
+            'text': text,
+            'words': group['words'],
+        })
+    return timeline
+
+
+def register_writer(name):
+    """
+    Декоратор для регистрации writer'а формата субтитров.
+    Writer — генератор, который по таймлайну отдает текст субтитров частями.
+    """
+    def decorator(writer):
+        WRITERS[name] = writer
+        return writer
+    return decorator
+
+
+def iter_render(timeline, fmt):
+    """Отдает субтитры указанного формата частями, не собирая всю строку в памяти"""
+    try:
+        writer = WRITERS[fmt]
+    except KeyError:
+        raise ValueError(f"Unknown subtitle format: {fmt}")
+    return writer(timeline)
+
+
+def render(timeline, fmt):
+    """Рендерит таймлайн в указанный формат"""
+    return "".join(iter_render(timeline, fmt))
+
+
+def render_response(response, fmt):
+    """Рендерит Whisper verbose JSON ответ в указанный формат"""
+    return render(build_timeline(response), fmt)
+
+
+def iter_encoded(chunks, buffer_size=64 * 1024):
+    """Кодирует части текста в UTF-8 и объединяет их в блоки примерно по buffer_size байт"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= buffer_size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _iter_srt_blocks(blocks):
+    """Соединяет блоки строк SRT переводами строк, как join по всем строкам сразу"""
+    for i, lines in enumerate(blocks):
+        if i:
+            yield "\n"
+        yield "\n".join(lines)
+
+
+def _is_sorted(values):
+    return all(values[i] <= values[i + 1] for i in range(len(values) - 1))
+
+
+@register_writer('srt')
+def write_word_srt(timeline):
+    """SRT с отображением слов и их временных меток"""
+    def blocks():
+        for entry in timeline:
+            if entry['index'] is None:
+                continue
+
+            lines = [
+                str(entry['index']),
+                f"{format_timestamp(entry['start'])} --> {format_timestamp(entry['end'])}",
+            ]
+            for word in entry['words']:
+                word_start = format_timestamp(word['start'])
+                word_end = format_timestamp(word['end'])
+                lines.append(f"{word['word']} {word_start} --> {word_end}")
+            lines.append("")
+            yield lines
+
+    return _iter_srt_blocks(blocks())
+
+
+@register_writer('standard_srt')
+def write_standard_srt(timeline):
+    """Стандартный SRT без временных меток слов"""
+    blocks = (
+        [
+            str(entry['index']),
+            f"{format_timestamp(entry['start'])} --> {format_timestamp(entry['end'])}",
+            entry['text'],
+            "",
+        ]
+        for entry in timeline
+        if entry['text']
+    )
+    return _iter_srt_blocks(blocks)
+
+
+def _karaoke_event(segment):
+    """Караоке Dialogue для сегмента: (время начала, строка события)"""
+    start_time = max(0, segment['start'] - 0.2)
+    end_time = segment['end'] + 0.2
+
+    karaoke_text = "{\\fad(400,0)\\an2}"
+    for word in segment['words']:
+        duration = int((word['end'] - word['start']) * 100)
+        karaoke_text += f"{{\\kf{duration}}}{word['word']} "
+
+    return start_time, f"Dialogue: 0,{format_timestamp_ass(start_time)},{format_timestamp_ass(end_time)},Default,,0,0,0,,{karaoke_text.strip()}"
+
+
+def _note_events(karaoke_segments):
+    """Ноты для пауз длиннее 5 секунд между сегментами"""
+    sorted_segments = sorted(karaoke_segments, key=lambda x: x['start'])
+    note_positions = [(1240, 540), (1340, 540), (1440, 540)]
+    events = []
+
+    for i in range(len(sorted_segments) - 1):
+        current_end = sorted_segments[i]['end']
+        next_start = sorted_segments[i + 1]['start']
+
+        if next_start - current_end > 5:
+            # Добавляем ноты каждые 0.4 секунды
+            note_index = 0
+            current_time = current_end
+
+            while current_time < next_start:
+                note_end = min(current_time + 0.8, next_start)
+                pos_x, pos_y = note_positions[note_index % len(note_positions)]
+
+                note_event = f"Dialogue: 0,{format_timestamp_ass(current_time)},{format_timestamp_ass(note_end)},Default,,0,0,0,,{{\\an5\\fad(200,200)\\fs100\\c&HFFFFFF&}}{{\\pos({pos_x},{pos_y})}}♫"
+                events.append((current_time, note_event))
+
+                current_time += 0.4
+                note_index += 1
+
+    return events
+
+
+@register_writer('ass')
+def write_ass(timeline):
+    """ASS с караоке эффектами и нотами в длинных паузах"""
+    yield ASS_HEADER
+
+    karaoke_segments = [entry for entry in timeline if entry['words']]
+    notes = _note_events(karaoke_segments)
+    karaoke_starts = [max(0, segment['start'] - 0.2) for segment in karaoke_segments]
+
+    if _is_sorted(karaoke_starts) and _is_sorted([time for time, _ in notes]):
+        # Обе последовательности уже упорядочены: сливаем их на лету.
+        # heapq.merge устойчив, поэтому при равном времени караоке идет раньше нот,
+        # как и при общей сортировке
+        events = heapq.merge(
+            (_karaoke_event(segment) for segment in karaoke_segments),
+            notes,
+            key=lambda x: x[0],
+        )
+    else:
+        events = [_karaoke_event(segment) for segment in karaoke_segments] + notes
+        events.sort(key=lambda x: x[0])
+
+    for _, event in events:
+        yield event + "\n"
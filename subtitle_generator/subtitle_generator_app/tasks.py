@@ -1,152 +1,298 @@
+"""
+Celery пайплайн обработки проекта.
+
+Обработка разбита на этапы, каждый в своей очереди со своим лимитом времени:
+разделение (separation) -> транскрипция (transcription) -> финализация (render).
+Результат каждого этапа сохраняется в Project, поэтому повторная попытка
+продолжает работу с упавшего этапа, а не начинает сначала.
+"""
+import json
 import os
-import uuid
+import shutil
 from celery import shared_task
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from . import chunked_upload, instrumentation, stem_cache, subtitle_renderer
 from .models import Project
-from .services import audio_separator, whisper_client
-
-
-def format_timestamp(seconds):
-    """Форматирует секунды в SRT timestamp формат (HH:MM:SS,mmm)"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds % 1) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
-
-
-def generate_srt_from_whisper_response(response):
-    """Генерирует SRT контент из Whisper verbose JSON ответа с отображением слов и их временных меток"""
-    segments = response.get('segments', [])
-
-    # Если segments есть, используем их с words
-    if segments:
-        srt_lines = []
-        all_words = response.get('words', [])
-        for i, segment in enumerate(segments, 1):
-            start = format_timestamp(segment['start'])
-            end = format_timestamp(segment['end'])
-
-            srt_lines.append(str(i))
-            srt_lines.append(f"{start} --> {end}")
-
-            # Находим слова, которые принадлежат этому сегменту
-            segment_words = [word for word in all_words if word['start'] >= segment['start'] and word['end'] <= segment['end']]
-            for word in segment_words:
-                word_start = format_timestamp(word['start'])
-                word_end = format_timestamp(word['end'])
-                word_text = word['word']
-                srt_lines.append(f"{word_text} {word_start} --> {word_end}")
-
-            srt_lines.append("")
-        return "\n".join(srt_lines)
-
-    # Если segments нет, группируем words в сегменты
-    words = response.get('words', [])
-    if not words:
-        return ""
-
-    # Группируем слова в сегменты по времени (например, каждые 5 секунд или по смыслу)
-    segments_grouped = []
-    current_segment = []
-    segment_start = None
-    segment_end = None
-
-    for word in words:
-        if segment_start is None:
-            segment_start = word['start']
-        segment_end = word['end']
-        current_segment.append(word)
-
-        # Создаем новый сегмент каждые 5 секунд или если текст становится слишком длинным
-        if segment_end - segment_start >= 5 or len(' '.join(w['word'] for w in current_segment)) > 100:
-            text = ' '.join(w['word'] for w in current_segment).strip()
-            if text:
-                segments_grouped.append({
-                    'start': segment_start,
-                    'end': segment_end,
-                    'text': text,
-                    'words': current_segment
-                })
-            current_segment = []
-            segment_start = None
-
-    # Добавляем последний сегмент
-    if current_segment:
-        text = ' '.join(w['word'] for w in current_segment).strip()
-        if text:
-            segments_grouped.append({
-                'start': segment_start if segment_start is not None else words[-1]['start'],
-                'end': segment_end if segment_end is not None else words[-1]['end'],
-                'text': text,
-                'words': current_segment
-            })
-
-    # Генерируем SRT
-    srt_lines = []
-    for i, segment in enumerate(segments_grouped, 1):
-        start = format_timestamp(segment['start'])
-        end = format_timestamp(segment['end'])
-
-        srt_lines.append(str(i))
-        srt_lines.append(f"{start} --> {end}")
-
-        # Добавляем слова с их временными метками
-        for word in segment['words']:
-            word_start = format_timestamp(word['start'])
-            word_end = format_timestamp(word['end'])
-            word_text = word['word']
-            srt_lines.append(f"{word_text} {word_start} --> {word_end}")
-
-        srt_lines.append("")
-
-    return "\n".join(srt_lines)
+from .services import audio_import, audio_separator, whisper_client
+
+
+def separation_poll_delay(attempt):
+    """
+    Задержка перед очередной проверкой разделения: растет экспоненциально
+    от SEPARATION_POLL_INITIAL_DELAY до SEPARATION_POLL_MAX_DELAY
+    """
+    delay = settings.SEPARATION_POLL_INITIAL_DELAY * settings.SEPARATION_POLL_BACKOFF ** attempt
+    return min(delay, settings.SEPARATION_POLL_MAX_DELAY)
+
+
+def set_stage(project, stage, status='processing'):
+    """Сохраняет текущий этап и статус проекта"""
+    project.processing_stage = stage
+    project.status = status
+    project.save(update_fields=['processing_stage', 'status', 'updated_at'])
+
+
+def mark_failed(project_id, clear_separation=False):
+    """Помечает проект как failed (и при необходимости сбрасывает задачу MVSEP)"""
+    try:
+        project = Project.objects.get(id=project_id)
+        project.status = 'failed'
+        if clear_separation:
+            project.separation_hash = ''
+        project.save()
+    except Exception:
+        pass
+
+
+def retry_or_fail(task, project_id, exc, clear_separation=False):
+    """Повторяет этап через минуту, а после исчерпания попыток помечает проект как failed"""
+    if task.request.retries >= task.max_retries:
+        mark_failed(project_id, clear_separation=clear_separation)
+        raise exc
+    if clear_separation:
+        Project.objects.filter(id=project_id).update(separation_hash='')
+    raise task.retry(exc=exc, countdown=60)
+
+
+def next_stage_task(project):
+    """Возвращает задачу первого незавершенного этапа проекта"""
+    if not (project.vocal_audio and project.instrumental_audio):
+        return separate_audio_task
+    if not project.has_transcript():
+        return transcribe_audio_task
+    return finalize_project_task
+
+
+def import_filename(project_name, extension):
+    """Имя файла аудио по названию проекта"""
+    clean_name = "".join(c for c in project_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    clean_name = clean_name.replace(' ', '_') or 'audio'
+    return f"{clean_name}.{extension}"
+
+
+@shared_task(bind=True, max_retries=3, time_limit=settings.AUDIO_IMPORT_TASK_TIME_LIMIT)
+def import_audio_task(self, project_id):
+    """
+    Этап 0: скачивание аудио по source_url проекта потоком во временный файл,
+    перенос его в MEDIA_ROOT и запуск обработки
+    """
+    temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp_import', str(project_id))
+    try:
+        project = Project.objects.get(id=project_id)
+        os.makedirs(temp_dir, exist_ok=True)
+        temp_path = os.path.join(temp_dir, 'download')
+
+        with instrumentation.stage_timer(project_id, 'upload', retries=self.request.retries) as timing:
+            extension, size, audio_sha256 = audio_import.download_audio(project.source_url, temp_path)
+            timing['bytes_in'] = size
+
+            # Файл уже на диске - переносим его, а не копируем через storage.save
+            audio_name = default_storage.get_available_name(
+                os.path.join('audio', import_filename(project.name, extension))
+            )
+            os.makedirs(os.path.dirname(default_storage.path(audio_name)), exist_ok=True)
+            shutil.move(temp_path, default_storage.path(audio_name))
+
+        project.audio.name = audio_name
+        project.audio_sha256 = audio_sha256
+        project.status = 'draft'
+        project.save()
+
+        print(f"[Celery] Аудио для проекта {project_id} импортировано ({size} байт)")
+
+    except audio_import.AudioImportError as exc:
+        # Файл непригоден, повтор не поможет
+        print(f"[Celery] ОШИБКА импорта аудио проекта {project_id}: {exc}")
+        mark_failed(project_id)
+        return {'status': 'failed', 'project_id': project_id}
+    except Exception as exc:
+        print(f"[Celery] ОШИБКА импорта аудио проекта {project_id}: {exc}")
+        retry_or_fail(self, project_id, exc)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    process_audio_task.delay(project_id)
+    return {'status': 'imported', 'project_id': project_id}
 
 
 @shared_task(bind=True, max_retries=3)
 def process_audio_task(self, project_id):
-    """Фоновая обработка аудио: разделение + транскрипция"""
+    """
+    Фоновая обработка аудио: запускает пайплайн с первого незавершенного этапа
+    """
+    project = Project.objects.get(id=project_id)
+    project.status = 'processing'
+    project.save()
+
+    print(f"[Celery] Начинаем обработку проекта {project_id}")
+
+    next_stage_task(project).delay(project_id)
+    return {'status': 'processing', 'project_id': project_id}
+
+
+@shared_task(bind=True, max_retries=3, time_limit=settings.SEPARATION_TASK_TIME_LIMIT)
+def separate_audio_task(self, project_id, attempt=0, errors=0):
+    """
+    Этап 1: разделение на вокал и инструментал через MVSEP.
+    Создает задачу MVSEP (хэш сохраняется в проекте) и однократно проверяет
+    ее результат. Пока задача обрабатывается, перепланирует себя с растущей
+    задержкой, не занимая воркер. errors - число сбоев опроса подряд.
+    """
+    polling = False
     try:
         project = Project.objects.get(id=project_id)
-        project.status = 'processing'
-        project.save()
-        
-        print(f"[Celery] Начинаем обработку проекта {project_id}")
-        
-        # Шаг 1: Разделение аудио
-        audio_path = project.get_audio_path()
-        vocal_path, instrumental_path = audio_separator.separate_audio(
-            project.id, audio_path
-        )
-        
+
+        if project.vocal_audio and project.instrumental_audio:
+            # Этап уже выполнен
+            transcribe_audio_task.delay(project_id)
+            return {'status': 'processing', 'project_id': project_id}
+
+        set_stage(project, 'separation')
+
+        if not project.separation_hash:
+            # Тот же трек уже разделялся - берем стемы из кэша
+            if not project.audio_sha256:
+                project.update_audio_sha256()
+                project.save(update_fields=['audio_sha256', 'updated_at'])
+            lookup_started = timezone.now()
+            cached_stems = stem_cache.acquire(project.audio_sha256)
+            if cached_stems is not None:
+                project.vocal_audio.name, project.instrumental_audio.name = cached_stems
+                project.save()
+                instrumentation.record_stage(project_id, 'separation_cache', lookup_started)
+                print(f"[Celery] Стемы для проекта {project_id} взяты из кэша")
+                transcribe_audio_task.delay(project_id)
+                return {'status': 'separated', 'project_id': project_id}
+
+            with instrumentation.stage_timer(project_id, 'separation_submit', retries=self.request.retries) as timing:
+                timing['bytes_out'] = project.audio.size
+                project.separation_hash = audio_separator.start_separation(project.get_audio_path())
+            project.save(update_fields=['separation_hash', 'updated_at'])
+            print(f"[Celery] Задача разделения {project.separation_hash} создана для проекта {project_id}")
+            separate_audio_task.apply_async((project_id, 0), countdown=separation_poll_delay(0))
+            return {'status': 'processing', 'project_id': project_id}
+
+        polling = True
+        poll_started = timezone.now()
+        result = audio_separator.collect_separation(project_id, project.separation_hash)
+
+        if result is None:
+            if attempt + 1 >= settings.SEPARATION_POLL_MAX_ATTEMPTS:
+                print(f"[Celery] Разделение для проекта {project_id} не завершилось за {attempt + 1} проверок")
+                mark_failed(project_id, clear_separation=True)
+                return {'status': 'failed', 'project_id': project_id}
+
+            delay = separation_poll_delay(attempt + 1)
+            print(f"[Celery] Разделение проекта {project_id} еще идет, следующая проверка через {delay:.0f} с")
+            separate_audio_task.apply_async((project_id, attempt + 1), countdown=delay)
+            return {'status': 'processing', 'project_id': project_id}
+
+        # Ожидание в очереди MVSEP - от отправки до готовности результата,
+        # скачивание - последняя проверка, которая забрала файлы
+        submitted_at = instrumentation.last_finished_at(project_id, 'separation_submit')
+        if submitted_at is not None:
+            instrumentation.record_stage(project_id, 'separation_wait', submitted_at, poll_started, retries=attempt)
+        stems_bytes = sum(os.path.getsize(os.path.join(settings.MEDIA_ROOT, path)) for path in result)
+        instrumentation.record_stage(project_id, 'separation_download', poll_started, bytes_in=stems_bytes)
+
+        vocal_path, instrumental_path = stem_cache.store(project.audio_sha256, *result)
         project.vocal_audio.name = vocal_path
         project.instrumental_audio.name = instrumental_path
         project.save()
-        
+
         print(f"[Celery] Разделение завершено для проекта {project_id}")
-        
-        # Шаг 2: Транскрипция
-        vocal_full_path = os.path.join(settings.MEDIA_ROOT, vocal_path)
-        whisper_response = whisper_client.transcribe_audio_vocal(vocal_full_path)
-
-        # Сохраняем JSON ответ
-        project.whisper_response = whisper_response
-        project.status = 'completed'
-        project.save()
-        
+
+    except audio_separator.SeparationFailed as exc:
+        # MVSEP не смог разделить трек: повторная попытка создаст новую задачу
+        print(f"[Celery] ОШИБКА разделения проекта {project_id}: {exc}")
+        retry_or_fail(self, project_id, exc, clear_separation=True)
+    except Exception as exc:
+        print(f"[Celery] ОШИБКА разделения проекта {project_id}: {exc}")
+        if not polling:
+            retry_or_fail(self, project_id, exc)
+        # Сбой опроса или скачивания: задача MVSEP жива, опрашиваем ее дальше.
+        # Повторы Celery тут не подходят - их счетчик общий для всей цепочки
+        # перепланированных проверок
+        if errors + 1 >= settings.SEPARATION_POLL_MAX_ERRORS:
+            mark_failed(project_id)
+            raise
+        separate_audio_task.apply_async(
+            (project_id, attempt + 1, errors + 1), countdown=separation_poll_delay(attempt + 1)
+        )
+        return {'status': 'processing', 'project_id': project_id}
+
+    transcribe_audio_task.delay(project_id)
+    return {'status': 'separated', 'project_id': project_id}
+
+
+@shared_task(bind=True, max_retries=3, time_limit=settings.TRANSCRIPTION_TASK_TIME_LIMIT)
+def transcribe_audio_task(self, project_id):
+    """Этап 2: транскрипция вокала через Whisper"""
+    try:
+        project = Project.objects.get(id=project_id)
+
+        if not project.has_transcript():
+            set_stage(project, 'transcription')
+
+            vocal_full_path = os.path.join(settings.MEDIA_ROOT, project.vocal_audio.name)
+            with instrumentation.stage_timer(project_id, 'transcription', retries=self.request.retries) as timing:
+                project.whisper_response, upload = whisper_client.transcribe_vocal_track(
+                    vocal_full_path, use_cache=project.use_transcription_cache
+                )
+                timing['bytes_out'] = upload['upload_bytes']
+                timing['bytes_in'] = len(json.dumps(project.whisper_response))
+            project.vocal_offset_map = upload['offset_map']
+            project.whisper_source_bytes = upload['source_bytes']
+            project.whisper_upload_bytes = upload['upload_bytes']
+            project.whisper_upload_seconds = upload['upload_seconds']
+            project.save()
+
+            print(f"[Celery] Транскрипция завершена для проекта {project_id}")
+
+    except Exception as exc:
+        # Стемы уже сохранены, поэтому повторяется только транскрипция
+        print(f"[Celery] ОШИБКА при транскрипции проекта {project_id}: {exc}")
+        retry_or_fail(self, project_id, exc)
+
+    finalize_project_task.delay(project_id)
+    return {'status': 'transcribed', 'project_id': project_id}
+
+
+@shared_task(bind=True, max_retries=3, time_limit=settings.FINALIZE_TASK_TIME_LIMIT)
+def finalize_project_task(self, project_id):
+    """Этап 3: рендер субтитров во все форматы (прогрев кэша) и завершение проекта"""
+    try:
+        project = Project.objects.get(id=project_id)
+        set_stage(project, 'finalization')
+
+        with instrumentation.stage_timer(project_id, 'finalization', retries=self.request.retries) as timing:
+            timing['bytes_out'] = sum(
+                len(project.render_subtitles(fmt).encode('utf-8')) for fmt in subtitle_renderer.WRITERS
+            )
+
+        set_stage(project, 'done', status='completed')
+
         print(f"[Celery] Проект {project_id} успешно обработан")
-        
+
         return {'status': 'completed', 'project_id': project_id}
-        
+
     except Exception as exc:
-        print(f"[Celery] ОШИБКА при обработке проекта {project_id}: {exc}")
-        
-        try:
-            project = Project.objects.get(id=project_id)
-            project.status = 'failed'
-            project.save()
-        except:
-            pass
-        
-        # Повторная попытка через минуту
-        raise self.retry(exc=exc, countdown=60)
+        print(f"[Celery] ОШИБКА при финализации проекта {project_id}: {exc}")
+        retry_or_fail(self, project_id, exc)
+
+
+@shared_task
+def expire_upload_sessions_task():
+    """Удаляет брошенные докачиваемые загрузки (запускается celery beat)"""
+    expired = chunked_upload.expire_sessions()
+    if expired:
+        print(f"[Celery] Удалено брошенных загрузок: {expired}")
+    return {'expired': expired}
+
+
+@shared_task
+def prune_stage_timings_task():
+    """Удаляет старые замеры этапов (запускается celery beat)"""
+    return {'deleted': instrumentation.prune_stage_timings()}
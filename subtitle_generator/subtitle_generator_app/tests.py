@@ -1,3 +1,1382 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from wsgiref.util import FileWrapper
+from unittest import mock
 
-# Create your tests here.
+import requests
+from openai import OpenAI
+
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmarking, chunked_upload, instrumentation, request_profiling, subtitle_cache, subtitle_renderer, transcription_cache
+from .services import audio_import, audio_separator, audio_tools, demucs_client, hashing, whisper_client
+from . import tasks
+from subtitle_generator.celery import app as celery_app
+from .fake_services import FakeMVSEPServer, FakeWhisperServer, make_wav
+from .models import Project, ProjectTranscript, SeparatedStems, StageCounter, StageTiming, TranscriptionCacheEntry, UploadSession
+from .ranged_file_response import ranged_file_response
+from .subtitle_renderer import assign_words_to_segments
+
+
+def naive_assign_words_to_segments(segments, words):
+    """Исходная квадратичная фильтрация слов по сегментам"""
+    return [
+        [w for w in words if w['start'] >= segment['start'] and w['end'] <= segment['end']]
+        for segment in segments
+    ]
+
+
+def make_whisper_response(rng, word_count=300, with_segments=True):
+    """Строит синтетический verbose JSON ответ Whisper"""
+    words = []
+    t = 0.0
+    for i in range(word_count):
+        # Иногда делаем длинные паузы и слова нулевой длины на границах
+        t += rng.choice([0.0, 0.1, 0.25, 0.5, 6.0 if rng.random() < 0.03 else 0.3])
+        duration = rng.choice([0.0, 0.2, 0.4, 0.7])
+        words.append({'word': f"w{i}", 'start': round(t, 2), 'end': round(t + duration, 2)})
+        t += duration
+
+    segments = []
+    if with_segments:
+        index = 0
+        while index < len(words):
+            size = rng.randint(1, 12)
+            chunk = words[index:index + size]
+            segments.append({
+                'id': len(segments),
+                'start': chunk[0]['start'],
+                'end': chunk[-1]['end'],
+                'text': ' ' + ' '.join(w['word'] for w in chunk),
+            })
+            index += size
+    return {'words': words, 'segments': segments}
+
+
+class AssignWordsToSegmentsTests(SimpleTestCase):
+    def test_matches_naive_filter_on_sorted_timelines(self):
+        rng = random.Random(42)
+        for _ in range(50):
+            response = make_whisper_response(rng, word_count=rng.randint(0, 200))
+            self.assertEqual(
+                assign_words_to_segments(response['segments'], response['words']),
+                naive_assign_words_to_segments(response['segments'], response['words']),
+            )
+
+    def test_matches_naive_filter_on_overlapping_and_unsorted_input(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            words = []
+            for i in range(rng.randint(0, 60)):
+                start = round(rng.uniform(0, 30), 1)
+                words.append({'word': f"w{i}", 'start': start, 'end': round(start + rng.uniform(0, 2), 1)})
+            if rng.random() < 0.5:
+                words.sort(key=lambda w: w['start'])
+            segments = []
+            for _ in range(rng.randint(0, 15)):
+                start = round(rng.uniform(0, 30), 1)
+                segments.append({'start': start, 'end': round(start + rng.uniform(0, 8), 1)})
+            self.assertEqual(
+                assign_words_to_segments(segments, words),
+                naive_assign_words_to_segments(segments, words),
+            )
+
+    def test_rendered_output_is_unchanged(self):
+        rng = random.Random(1)
+        project = Project(name='Test')
+        for with_segments in (True, False):
+            response = make_whisper_response(rng, word_count=500, with_segments=with_segments)
+            renders = (
+                project.generate_srt_from_whisper_response,
+                project.generate_standard_srt_from_whisper_response,
+                project.generate_ass_from_whisper_response,
+            )
+            for render in renders:
+                actual = render(response)
+                with mock.patch.object(subtitle_renderer, 'assign_words_to_segments', naive_assign_words_to_segments):
+                    expected = render(response)
+                self.assertEqual(actual, expected)
+
+
+class SubtitleRendererTests(SimpleTestCase):
+    def test_project_formats_share_parsed_timeline(self):
+        project = Project(name='Test', whisper_response=make_whisper_response(random.Random(5)))
+        with mock.patch.object(subtitle_renderer, 'build_timeline', wraps=subtitle_renderer.build_timeline) as build:
+            project.get_subtitle_content()
+            project.get_standard_srt_content()
+            project.get_ass_content()
+        self.assertEqual(build.call_count, 1)
+
+    def test_unknown_format_raises(self):
+        with self.assertRaises(ValueError):
+            subtitle_renderer.render_response({'words': []}, 'vtt')
+
+
+class SubtitleCacheTests(SimpleTestCase):
+    def setUp(self):
+        subtitle_cache.local_cache.clear()
+        caches['default'].clear()
+
+    def test_render_is_cached_until_response_changes(self):
+        rng = random.Random(11)
+        project = Project(pk=1, name='Test', whisper_response=make_whisper_response(rng))
+        with mock.patch.object(subtitle_renderer, 'render', wraps=subtitle_renderer.render) as render:
+            first = project.get_ass_content()
+            self.assertEqual(Project(pk=1, name='Test', whisper_response=project.whisper_response).get_ass_content(), first)
+            self.assertEqual(render.call_count, 1)
+
+            project.whisper_response = make_whisper_response(rng)
+            self.assertNotEqual(project.get_ass_content(), first)
+            self.assertEqual(render.call_count, 2)
+
+    def test_shared_cache_is_used_after_local_eviction(self):
+        project = Project(pk=2, name='Test', whisper_response=make_whisper_response(random.Random(12)))
+        content = project.get_subtitle_content()
+        subtitle_cache.invalidate_project(2)
+        with mock.patch.object(subtitle_renderer, 'render') as render:
+            self.assertEqual(project.get_subtitle_content(), content)
+        render.assert_not_called()
+
+    def test_cache_size_is_counted_in_bytes(self):
+        content = 'Привет, мир\n' * 10
+        subtitle_cache.store(3, 'srt', 'f' * 64, content)
+        self.assertEqual(subtitle_cache.local_cache.current_bytes, len(content.encode('utf-8')))
+
+        with self.settings(SUBTITLE_CACHE_MAX_ENTRY_BYTES=len(content) + 1):
+            subtitle_cache.store(4, 'srt', 'f' * 64, content)
+        subtitle_cache.invalidate_project(4)
+        self.assertIsNone(subtitle_cache.get_cached(4, 'srt', 'f' * 64))
+
+    def test_lru_is_bounded_by_size(self):
+        lru = subtitle_cache.LRUCache(max_bytes=10)
+        lru.set('a', 'aaaa', 4)
+        lru.set('b', 'bbbb', 4)
+        lru.get('a')
+        lru.set('c', 'cccc', 4)
+        self.assertEqual(lru.keys(), ['a', 'c'])
+        self.assertLessEqual(lru.current_bytes, 10)
+        lru.set('d', 'd' * 11, 11)
+        self.assertIsNone(lru.get('d'))
+
+
+class StreamingSubtitleDownloadTests(TestCase):
+    def setUp(self):
+        subtitle_cache.local_cache.clear()
+        caches['default'].clear()
+        self.project = Project.objects.create(
+            name='My Song',
+            status='completed',
+            whisper_response=make_whisper_response(random.Random(21), word_count=2000),
+        )
+
+    def test_downloads_are_streamed_and_match_rendered_content(self):
+        cases = (
+            ('download_subtitle', 'srt', 'My_Song.srt'),
+            ('download_srt', 'standard_srt', 'My_Song.srt'),
+            ('download_ass', 'ass', 'My_Song.ass'),
+        )
+        for url_name, fmt, filename in cases:
+            expected = subtitle_renderer.render_response(self.project.whisper_response, fmt)
+            response = self.client.get(reverse(url_name, args=[self.project.id]))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertIn(filename, response['Content-Disposition'])
+            self.assertEqual(b"".join(response.streaming_content).decode('utf-8'), expected)
+
+    def test_streamed_render_populates_cache(self):
+        fingerprint = self.project.get_whisper_fingerprint()
+        content = "".join(self.project.iter_subtitles('ass'))
+        self.assertEqual(subtitle_cache.get_cached(self.project.pk, 'ass', fingerprint), content)
+
+    def test_oversized_render_is_not_cached(self):
+        with self.settings(SUBTITLE_CACHE_MAX_ENTRY_BYTES=10):
+            content = "".join(self.project.iter_subtitles('srt'))
+        self.assertTrue(content)
+        self.assertIsNone(subtitle_cache.get_cached(self.project.pk, 'srt', self.project.get_whisper_fingerprint()))
+
+
+class ListProjectsTests(TestCase):
+    def setUp(self):
+        base = timezone.now().replace(microsecond=0) - timedelta(days=10)
+        self.projects = []
+        # Два проекта с одинаковым created_at: порядок между ними задает id
+        for index, (days, status) in enumerate([(0, 'completed'), (1, 'failed'), (1, 'completed'), (2, 'processing'),
+                                                (3, 'completed'), (4, 'draft'), (5, 'completed')]):
+            project = Project.objects.create(name=f"Song {index}", status=status, whisper_response={'text': 'x' * 100})
+            Project.objects.filter(id=project.id).update(created_at=base + timedelta(days=days))
+            project.refresh_from_db()
+            self.projects.append(project)
+        self.expected = sorted(self.projects, key=lambda p: (p.created_at, p.id), reverse=True)
+
+    def list(self, **params):
+        response = self.client.get(reverse('list_projects'), params)
+        return response.status_code, response.json()
+
+    def test_cursor_walks_all_pages_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 3, **({'cursor': cursor} if cursor else {})}
+            with CaptureQueriesContext(connection) as queries:
+                status, data = self.list(**params)
+            self.assertEqual(status, 200)
+            self.assertTrue(all('whisper_response' not in query['sql'] for query in queries.captured_queries))
+            self.assertEqual(data['count'], len(data['projects']))
+            self.assertNotIn('total', data)
+            seen += [project['project_id'] for project in data['projects']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [project.id for project in self.expected])
+
+    def test_filters_by_status_and_creation_range(self):
+        status, data = self.list(status='completed,draft')
+        self.assertEqual(
+            [project['project_id'] for project in data['projects']],
+            [project.id for project in self.expected if project.status in ('completed', 'draft')],
+        )
+
+        after = self.expected[-1].created_at + timedelta(days=1)
+        before = self.expected[0].created_at
+        status, data = self.list(created_after=after.isoformat(), created_before=before.isoformat())
+        self.assertEqual(
+            [project['project_id'] for project in data['projects']],
+            [project.id for project in self.expected if after <= project.created_at < before],
+        )
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.list(cursor='garbage')[0], 400)
+        self.assertEqual(self.list(status='unknown')[0], 400)
+        self.assertEqual(self.list(limit='0')[0], 400)
+        self.assertEqual(self.list(created_after='yesterday')[0], 400)
+        with self.settings(API_PROJECTS_MAX_PAGE_SIZE=2):
+            self.assertEqual(len(self.list(limit=100)[1]['projects']), 2)
+
+
+class ProjectTranscriptTests(TestCase):
+    def setUp(self):
+        self.response = make_whisper_response(random.Random(23))
+        self.project = Project.objects.create(name='My Song', status='completed', whisper_response=self.response)
+
+    def test_transcript_is_stored_separately(self):
+        self.assertEqual(ProjectTranscript.objects.get(project=self.project).whisper_response, self.response)
+        project = Project.objects.get(id=self.project.id)
+        self.assertEqual(project.whisper_response, self.response)
+        self.assertTrue(project.has_subtitles())
+
+        project.whisper_response = {'text': '', 'words': [], 'segments': []}
+        project.save(update_fields=['whisper_response', 'updated_at'])
+        project.refresh_from_db()
+        self.assertFalse(project.has_subtitles())
+
+        project.whisper_response = None
+        project.save()
+        self.assertFalse(ProjectTranscript.objects.exists())
+        self.assertFalse(Project.objects.get(id=project.id).has_transcript())
+
+    def test_saving_other_fields_does_not_touch_transcript(self):
+        project = Project.objects.get(id=self.project.id)
+        with CaptureQueriesContext(connection) as queries:
+            project.status = 'processing'
+            project.save(update_fields=['status', 'updated_at'])
+        self.assertTrue(all('projecttranscript' not in query['sql'] for query in queries.captured_queries))
+
+    def test_status_and_list_do_not_read_transcript(self):
+        for url in (reverse('project_status', args=[self.project.id]), reverse('list_projects')):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertTrue(all('projecttranscript' not in query['sql'] for query in queries.captured_queries))
+
+    def test_cached_download_does_not_load_transcript(self):
+        subtitle_cache.local_cache.clear()
+        caches['default'].clear()
+        self.assertEqual(self.project.whisper_fingerprint, subtitle_cache.response_fingerprint(self.response))
+        url = reverse('download_subtitle', args=[self.project.id])
+
+        def transcript_loads(queries):
+            load = 'SELECT "subtitle_generator_app_projecttranscript"."whisper_response"'
+            return sum(query['sql'].startswith(load) for query in queries.captured_queries)
+
+        with CaptureQueriesContext(connection) as queries:
+            first = b''.join(self.client.get(url).streaming_content)
+        self.assertEqual(transcript_loads(queries), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(b''.join(self.client.get(url).streaming_content), first)
+        self.assertEqual(transcript_loads(queries), 0)
+
+        content_url = reverse('subtitle_content', args=[self.project.id])
+        content = self.client.get(content_url).json()['content']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(content_url).json()['content'], content)
+        self.assertEqual(transcript_loads(queries), 0)
+
+        # Новый ответ дает новый хэш, старые записи кэша не используются
+        project = Project.objects.get(id=self.project.id)
+        project.whisper_response = make_whisper_response(random.Random(24))
+        project.save(update_fields=['whisper_response', 'updated_at'])
+        self.assertNotEqual(Project.objects.get(id=project.id).whisper_fingerprint, self.project.whisper_fingerprint)
+        self.assertNotEqual(b''.join(self.client.get(url).streaming_content), first)
+
+    def test_transcript_is_deleted_with_project(self):
+        self.client.post(reverse('project_delete', args=[self.project.id]))
+        self.assertFalse(Project.objects.exists())
+        self.assertFalse(ProjectTranscript.objects.exists())
+
+
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        subtitle_cache.local_cache.clear()
+        caches['default'].clear()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.control_file = os.path.join(self.temp_dir, 'profiling.json')
+        self.profile_dir = os.path.join(self.temp_dir, 'profiles')
+        settings_override = self.settings(
+            SERVER_TIMING_ENABLED=True,
+            REQUEST_PROFILE_SAMPLE_RATE=0,
+            REQUEST_PROFILE_CONTROL_FILE=self.control_file,
+            REQUEST_PROFILE_DIR=self.profile_dir,
+            REQUEST_PROFILE_MAX_FILES=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.project = Project.objects.create(
+            name='My Song',
+            status='completed',
+            whisper_response=make_whisper_response(random.Random(22)),
+        )
+
+    def write_control_file(self, **values):
+        with open(self.control_file, 'w') as f:
+            json.dump(values, f)
+        # mtime должен измениться даже на файловых системах с грубым разрешением времени
+        stat = os.stat(self.control_file)
+        os.utime(self.control_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def server_timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_header_contains_db_render_and_total(self):
+        response = self.client.get(reverse('subtitle_content', args=[self.project.id]))
+        metrics = self.server_timing(response)
+        self.assertGreaterEqual(int(metrics['db']['desc'].strip('"x')), 1)
+        self.assertEqual(metrics['render']['desc'], '"1x"')
+        self.assertGreaterEqual(float(metrics['total']['dur']), float(metrics['render']['dur']))
+
+        # Повторный запрос берет субтитры из кэша, рендера нет
+        metrics = self.server_timing(self.client.get(reverse('subtitle_content', args=[self.project.id])))
+        self.assertNotIn('render', metrics)
+
+    def test_control_file_toggles_without_restart(self):
+        self.write_control_file(server_timing=False)
+        self.assertNotIn('Server-Timing', self.client.get(reverse('list_projects')))
+
+        self.write_control_file(server_timing=True, sample_rate=1.0)
+        response = self.client.get(reverse('list_projects'))
+        profile_name = self.server_timing(response)['profile']['desc'].strip('"')
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir, profile_name)))
+
+    def test_profiles_are_rotated(self):
+        self.write_control_file(sample_rate=1.0, path_prefixes=['/api/'])
+        for _ in range(4):
+            self.client.get(reverse('list_projects'))
+        # Страницы вне path_prefixes не профилируются
+        self.client.get(reverse('project_list'))
+        dumps = os.listdir(self.profile_dir)
+        self.assertEqual(len(dumps), 2)
+        self.assertTrue(all('_GET_api_projects_' in name for name in dumps))
+
+
+class RangedFileResponseTests(SimpleTestCase):
+    def setUp(self):
+        self.data = os.urandom(300 * 1024)
+        handle, self.path = tempfile.mkstemp(suffix='.mp3')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(self.data)
+        self.addCleanup(os.remove, self.path)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get('/audio/', headers=headers)
+        response = ranged_file_response(request, self.path)
+        self.addCleanup(response.close)
+        return response
+
+    def test_full_file_is_streamed_in_blocks(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), self.data)
+
+    def test_ranges(self):
+        cases = (
+            ('bytes=0-1023', 0, 1023),
+            ('bytes=1000-', 1000, len(self.data) - 1),
+            ('bytes=-500', len(self.data) - 500, len(self.data) - 1),
+            ('bytes=100-999999999', 100, len(self.data) - 1),
+        )
+        for header, start, end in cases:
+            response = self.get(range=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(self.data)}')
+            self.assertEqual(b"".join(response.streaming_content), self.data[start:end + 1])
+
+    def test_wsgi_file_wrapper_reads_only_the_range(self):
+        response = self.get(range='bytes=5000-70000')
+        self.assertEqual(b"".join(FileWrapper(response.file_to_stream, response.block_size)), self.data[5000:70001])
+        self.assertEqual(response.file_to_stream.tell(), 70001)
+
+    def test_not_modified_by_etag_and_date(self):
+        response = self.get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=last_modified).status_code, 304)
+        self.assertEqual(self.get(if_none_match='"other"').status_code, 200)
+
+    def test_if_range(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(range='bytes=0-9', if_range=etag).status_code, 206)
+        stale = self.get(range='bytes=0-9', if_range='"stale"')
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale['Content-Length'], str(len(self.data)))
+
+    def test_multiple_ranges(self):
+        response = self.get(range='bytes=0-9, 100-109, 5-14')
+        self.assertEqual(response.status_code, 206)
+        boundary = response['Content-Type'].split('boundary=')[1]
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        parts = body.split(f'--{boundary}'.encode())[1:-1]
+        self.assertEqual(len(parts), 2)
+        for part, (start, end) in zip(parts, ((0, 14), (100, 109))):
+            headers, payload = part.split(b'\r\n\r\n', 1)
+            self.assertIn(f'Content-Range: bytes {start}-{end}/{len(self.data)}'.encode(), headers)
+            self.assertEqual(payload[:-2], self.data[start:end + 1])
+
+    def test_multiple_ranges_file_is_closed_without_iteration(self):
+        opened = []
+
+        def tracking_open(*args, **kwargs):
+            opened.append(open(*args, **kwargs))
+            return opened[-1]
+
+        with mock.patch('subtitle_generator_app.ranged_file_response.open', tracking_open, create=True):
+            response = ranged_file_response(self.factory.get('/audio/', headers={'range': 'bytes=0-9, 100-109'}), self.path)
+        self.assertEqual(response.status_code, 206)
+        # Клиент отключился до чтения тела: сервер только закрывает ответ
+        response.close()
+        self.assertTrue(opened[0].closed)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(range=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+
+class MediaRootMixin:
+    """Временный MEDIA_ROOT для тестов, которые пишут файлы"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class MediaOffloadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(name='Song')
+        self.project.audio.save('song.mp3', ContentFile(b'ID3' + b'\0' * 100))
+
+    def test_x_accel_redirect(self):
+        with self.settings(MEDIA_OFFLOAD_MODE='x-accel-redirect', MEDIA_OFFLOAD_PREFIX='/protected-media/'):
+            response = self.client.get(reverse('serve_audio', args=[self.project.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/audio/song.mp3')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertEqual(response.content, b'')
+
+    def test_x_sendfile(self):
+        with self.settings(MEDIA_OFFLOAD_MODE='x-sendfile'):
+            response = self.client.get(reverse('serve_audio', args=[self.project.id]))
+        self.assertEqual(response['X-Sendfile'], self.project.audio.path)
+
+    def test_django_serves_file_when_offload_disabled(self):
+        with self.settings(MEDIA_OFFLOAD_MODE=''):
+            response = self.client.get(reverse('serve_audio', args=[self.project.id]))
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b"".join(response.streaming_content), b'ID3' + b'\0' * 100)
+
+
+class FakeMVSEPMixin:
+    server_options = {}
+
+    def setUp(self):
+        self.server = FakeMVSEPServer(**self.server_options).start()
+        self.addCleanup(self.server.stop)
+        for name, value in (('BASE_URL', self.server.base_url), ('session', demucs_client.create_session())):
+            patcher = mock.patch.object(demucs_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+
+    def run_job(self):
+        audio_path = os.path.join(self.workdir, 'song.mp3')
+        with open(audio_path, 'wb') as f:
+            f.write(b'ID3' + os.urandom(10000))
+        task_hash = demucs_client.create_separation(audio_path)
+        output_dir = os.path.join(self.workdir, 'stems')
+        statuses = [demucs_client.check_and_download_result(task_hash, output_dir=output_dir) for _ in range(3)]
+        return statuses, output_dir
+
+
+class DemucsClientTests(FakeMVSEPMixin, SimpleTestCase):
+    server_options = {'processing_polls': 2}
+
+    def test_job_reuses_single_connection(self):
+        statuses, output_dir = self.run_job()
+        self.assertEqual(statuses, ['processing', 'processing', 'done'])
+        for name, content in self.server.stems.items():
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                self.assertEqual(f.read(), content)
+        # create + 3 опроса + 2 файла через keep-alive соединения пула:
+        # второе соединение нужно только для параллельного скачивания
+        self.assertEqual(self.server.request_count, 6)
+        self.assertLessEqual(self.server.connection_count, 2)
+
+
+class ResumableStemDownloadTests(FakeMVSEPMixin, SimpleTestCase):
+    server_options = {
+        'processing_polls': 0,
+        'truncate_first_download': 100 * 1024,
+        'stems': {'song_vocals.mp3': os.urandom(300 * 1024), 'song_other.mp3': os.urandom(200 * 1024)},
+    }
+
+    def test_interrupted_downloads_resume_with_range(self):
+        with mock.patch.object(demucs_client.time, 'sleep'):
+            statuses, output_dir = self.run_job()
+        self.assertEqual(statuses[0], 'done')
+        self.assertEqual(sorted(self.server.range_requests), ['bytes=65536-', 'bytes=65536-'])
+        self.assertEqual(sorted(os.listdir(output_dir)), sorted(self.server.stems))
+        for name, content in self.server.stems.items():
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+    def test_oversized_partial_file_is_downloaded_again(self):
+        output_dir = os.path.join(self.workdir, 'stems')
+        os.makedirs(output_dir)
+        for name, content in self.server.stems.items():
+            # .part длиннее файла на сервере: сервер ответит 416
+            with open(os.path.join(output_dir, f'{name}.part'), 'wb') as f:
+                f.write(content + b'stale')
+
+        with mock.patch.object(demucs_client.time, 'sleep'):
+            statuses, output_dir = self.run_job()
+        self.assertEqual(statuses[0], 'done')
+        for name, content in self.server.stems.items():
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+
+class PipelineMixin(MediaRootMixin):
+    """Прогон Celery пайплайна синхронно против локального MVSEP"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeMVSEPServer(processing_polls=2).start()
+        self.addCleanup(self.server.stop)
+        patchers = (
+            mock.patch.object(demucs_client, 'BASE_URL', self.server.base_url),
+            mock.patch.object(demucs_client, 'session', demucs_client.create_session()),
+        )
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        transcribe_patcher = mock.patch.object(
+            whisper_client, 'transcribe_vocal_track', return_value=(make_whisper_response(random.Random(3)), self.upload_info())
+        )
+        self.transcribe = transcribe_patcher.start()
+        self.addCleanup(transcribe_patcher.stop)
+
+        # Задачи Celery выполняются сразу в текущем процессе
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+    def upload_info(self):
+        return {'offset_map': None, 'source_bytes': 4000, 'upload_bytes': 1000, 'upload_seconds': 0.5}
+
+    def create_project(self, content=b'ID3' + b'\0' * 1000):
+        project = Project.objects.create(name='Song')
+        project.audio.save('song.mp3', ContentFile(content))
+        return project
+
+
+class StagedPipelineTests(PipelineMixin, TestCase):
+    def test_separation_polls_are_rescheduled_with_backoff(self):
+        project = self.create_project()
+        with mock.patch.object(tasks.separate_audio_task, 'apply_async', wraps=tasks.separate_audio_task.apply_async) as poll:
+            tasks.process_audio_task.delay(project.id)
+
+        delays = [call.kwargs['countdown'] for call in poll.call_args_list if 'countdown' in call.kwargs]
+        self.assertEqual(len(delays), 3)
+        self.assertEqual(delays, sorted(delays))
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'completed')
+        self.assertEqual(project.processing_stage, 'done')
+        self.assertEqual(project.separation_hash, 'fake-1')
+        self.assertEqual(project.whisper_upload_bytes, 1000)
+        self.assertEqual(project.whisper_source_bytes, 4000)
+        self.assertTrue(os.path.exists(project.vocal_audio.path))
+        self.assertTrue(os.path.exists(project.instrumental_audio.path))
+        self.transcribe.assert_called_once_with(project.vocal_audio.path, use_cache=None)
+
+    def test_failed_mvsep_job_is_resubmitted(self):
+        project = self.create_project()
+        collect = audio_separator.collect_separation
+        with mock.patch.object(
+            audio_separator, 'collect_separation',
+            side_effect=[audio_separator.SeparationFailed('MVSEP error')] + [mock.DEFAULT] * 10,
+            wraps=collect,
+        ):
+            tasks.process_audio_task.delay(project.id)
+
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'completed')
+        # Упавшая задача MVSEP заменена новой
+        self.assertEqual(project.separation_hash, 'fake-2')
+
+    def test_poll_error_keeps_mvsep_job(self):
+        project = self.create_project()
+        errors = [requests.ConnectionError('MVSEP is unreachable')] * (tasks.settings.SEPARATION_POLL_MAX_ERRORS - 1)
+        with mock.patch.object(
+            audio_separator, 'collect_separation',
+            side_effect=errors + [mock.DEFAULT] * 10, wraps=audio_separator.collect_separation,
+        ):
+            tasks.process_audio_task.delay(project.id)
+
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'completed')
+        # Сбои опроса не тратят повторы Celery и не создают новую задачу MVSEP
+        self.assertEqual(project.separation_hash, 'fake-1')
+
+    def test_repeated_poll_errors_fail_project_but_keep_mvsep_job(self):
+        project = self.create_project()
+        with mock.patch.object(audio_separator, 'collect_separation', side_effect=requests.ConnectionError('MVSEP is unreachable')) as poll:
+            tasks.process_audio_task.delay(project.id)
+
+        self.assertEqual(poll.call_count, tasks.settings.SEPARATION_POLL_MAX_ERRORS)
+
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'failed')
+        # Перезапуск проекта продолжит опрашивать ту же задачу
+        self.assertEqual(project.separation_hash, 'fake-1')
+
+    def test_transcription_retry_does_not_repeat_separation(self):
+        project = self.create_project()
+        self.transcribe.side_effect = [Exception('Whisper is down'), (make_whisper_response(random.Random(4)), self.upload_info())]
+        tasks.process_audio_task.delay(project.id)
+
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'completed')
+        self.assertEqual(self.transcribe.call_count, 2)
+        # Задача MVSEP создана только один раз
+        self.assertEqual(project.separation_hash, 'fake-1')
+
+    def test_restart_resumes_at_first_incomplete_stage(self):
+        project = self.create_project()
+        project.vocal_audio.name = project.audio.name
+        project.instrumental_audio.name = project.audio.name
+        project.save()
+        tasks.process_audio_task.delay(project.id)
+
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'completed')
+        self.assertEqual(self.server.request_count, 0)
+        self.transcribe.assert_called_once()
+
+
+class SeparatedStemsCacheTests(PipelineMixin, TestCase):
+    def test_duplicate_upload_reuses_stems(self):
+        first = self.create_project()
+        tasks.process_audio_task.delay(first.id)
+        second = self.create_project()
+        tasks.process_audio_task.delay(second.id)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'completed')
+        self.assertEqual(first.audio_sha256, second.audio_sha256)
+        self.assertEqual(second.vocal_audio.name, first.vocal_audio.name)
+        self.assertEqual(second.instrumental_audio.name, first.instrumental_audio.name)
+        # Для второго проекта задача MVSEP не создавалась
+        self.assertEqual(second.separation_hash, '')
+        self.assertEqual(SeparatedStems.objects.get().ref_count, 2)
+
+    def test_stems_are_deleted_with_last_reference(self):
+        projects = []
+        for _ in range(2):
+            project = self.create_project()
+            tasks.process_audio_task.delay(project.id)
+            project.refresh_from_db()
+            projects.append(project)
+        vocal_path = projects[0].vocal_audio.path
+
+        self.client.post(reverse('project_delete', args=[projects[0].id]))
+        self.assertTrue(os.path.exists(vocal_path))
+        self.assertEqual(SeparatedStems.objects.get().ref_count, 1)
+
+        self.client.post(reverse('project_delete', args=[projects[1].id]))
+        self.assertFalse(os.path.exists(vocal_path))
+        self.assertFalse(SeparatedStems.objects.exists())
+
+    def test_missing_stem_files_keep_existing_references(self):
+        first = self.create_project()
+        tasks.process_audio_task.delay(first.id)
+        first.refresh_from_db()
+        vocal_path = first.vocal_audio.path
+        os.remove(vocal_path)
+
+        # Файлы пропали: трек разделяется заново, но ссылка первого проекта сохраняется
+        second = self.create_project()
+        tasks.process_audio_task.delay(second.id)
+        second.refresh_from_db()
+        self.assertEqual(second.separation_hash, 'fake-2')
+        self.assertEqual(second.vocal_audio.name, first.vocal_audio.name)
+        self.assertEqual(SeparatedStems.objects.get().ref_count, 2)
+
+        # Удаление первого проекта не трогает файлы, которые использует второй
+        self.client.post(reverse('project_delete', args=[first.id]))
+        self.assertTrue(os.path.exists(vocal_path))
+        self.assertEqual(SeparatedStems.objects.get().ref_count, 1)
+
+    def test_different_audio_is_separated_again(self):
+        first = self.create_project()
+        tasks.process_audio_task.delay(first.id)
+        second = self.create_project(content=b'ID3' + b'\1' * 1000)
+        tasks.process_audio_task.delay(second.id)
+
+        second.refresh_from_db()
+        self.assertEqual(second.separation_hash, 'fake-2')
+        self.assertEqual(SeparatedStems.objects.count(), 2)
+
+
+class GenerateSubtitlesApiTests(PipelineMixin, TestCase):
+    def post_audio(self, **data):
+        audio = ContentFile(b'ID3' + b'\0' * 1000, name='song.mp3')
+        return self.client.post(reverse('generate_subtitles'), {'project_name': 'My Song', 'audio_file': audio, **data})
+
+    def test_returns_202_and_enqueues_after_commit(self):
+        with mock.patch.object(tasks.process_audio_task, 'delay') as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.post_audio()
+            delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        project = Project.objects.get(id=data['project_id'])
+        self.assertEqual(data['status_url'], reverse('project_status', args=[project.id]))
+        self.assertEqual(response['Location'], data['status_url'])
+        self.assertEqual(project.audio.name, 'audio/My_Song.mp3')
+        self.assertEqual(project.audio_sha256, hashing.file_sha256(project.audio.path))
+        delay.assert_called_once_with(project.id)
+
+    def test_metrics_error_does_not_roll_back_project(self):
+        with mock.patch.object(tasks.process_audio_task, 'delay') as delay, \
+                mock.patch.object(instrumentation, 'record_stage', side_effect=DatabaseError('metrics are down')), \
+                self.assertLogs('django.test', level='ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post_audio()
+
+        self.assertEqual(response.status_code, 202)
+        project = Project.objects.get(id=response.json()['project_id'])
+        delay.assert_called_once_with(project.id)
+
+    def test_pipeline_completes_with_request_cache_setting(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_audio(use_cache='0')
+
+        project = Project.objects.get(id=response.json()['project_id'])
+        self.assertEqual(project.status, 'completed')
+        self.assertIs(project.use_transcription_cache, False)
+        self.transcribe.assert_called_once_with(project.vocal_audio.path, use_cache=False)
+        status = self.client.get(response['Location']).json()
+        self.assertEqual(status['project']['status'], 'completed')
+
+    def test_rejects_unsupported_file_without_creating_project(self):
+        response = self.client.post(reverse('generate_subtitles'), {'audio_file': ContentFile(b'text', name='notes.txt')})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Project.objects.exists())
+
+
+class ChunkedUploadTests(PipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.audio = make_wav(3, seed=9)
+
+    def create_upload(self, length=None, **metadata):
+        metadata = {'filename': 'long take.wav', 'project_name': 'Long Take', **metadata}
+        header = ','.join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in metadata.items())
+        return self.client.post(
+            reverse('create_upload'),
+            headers={'Tus-Resumable': '1.0.0', 'Upload-Length': str(len(self.audio) if length is None else length), 'Upload-Metadata': header},
+        )
+
+    def patch(self, url, offset, data, checksum=None):
+        headers = {'Tus-Resumable': '1.0.0', 'Upload-Offset': str(offset)}
+        if checksum is not None:
+            headers['Upload-Checksum'] = 'sha256 ' + base64.b64encode(checksum).decode()
+        return self.client.patch(url, data, content_type='application/offset+octet-stream', headers=headers)
+
+    def offset(self, url):
+        return int(self.client.head(url)['Upload-Offset'])
+
+    def test_resumable_upload_creates_project(self):
+        response = self.create_upload(use_cache='0')
+        self.assertEqual(response.status_code, 201)
+        url = response['Location']
+        session = UploadSession.objects.get()
+        middle = len(self.audio) // 2
+
+        first = self.audio[:middle]
+        response = self.patch(url, 0, first, hashlib.sha256(first).digest())
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], str(middle))
+        self.assertEqual(self.offset(url), middle)
+
+        # Повтор с устаревшим смещением отклоняется
+        self.assertEqual(self.patch(url, 0, first).status_code, 409)
+
+        # Часть с неверной контрольной суммой отрезается
+        rest = self.audio[middle:]
+        response = self.patch(url, middle, rest, hashlib.sha256(b'other').digest())
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(self.offset(url), middle)
+        self.assertEqual(os.path.getsize(chunked_upload.partial_path(session)), middle)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.patch(url, middle, rest, hashlib.sha256(rest).digest())
+        self.assertEqual(response.status_code, 204)
+
+        project = Project.objects.get(id=response['Upload-Project-Id'])
+        self.assertEqual(response['Upload-Project-Status-Url'], reverse('project_status', args=[project.id]))
+        self.assertEqual(project.status, 'completed')
+        self.assertEqual(project.name, 'Long Take')
+        self.assertIs(project.use_transcription_cache, False)
+        self.assertEqual(project.audio.name, 'audio/Long_Take.wav')
+        with open(project.audio.path, 'rb') as f:
+            self.assertEqual(f.read(), self.audio)
+        self.assertEqual(project.audio_sha256, hashlib.sha256(self.audio).hexdigest())
+        self.assertFalse(os.path.exists(chunked_upload.partial_path(session)))
+        self.assertEqual(self.patch(url, len(self.audio), b'x').status_code, 403)
+
+    def test_upload_limits_and_validation(self):
+        with self.settings(CHUNKED_UPLOAD_MAX_BYTES=100):
+            self.assertEqual(self.create_upload().status_code, 413)
+        self.assertEqual(self.create_upload(filename='notes.txt').status_code, 400)
+
+        url = self.create_upload(length=10)['Location']
+        self.assertEqual(self.patch(url, 0, b'x' * 11).status_code, 413)
+        response = self.client.patch(url, b'x', content_type='application/octet-stream', headers={'Upload-Offset': '0'})
+        self.assertEqual(response.status_code, 415)
+
+    def test_overlapping_patches_do_not_corrupt_file(self):
+        url = self.create_upload()['Location']
+        session = UploadSession.objects.get()
+        first, other = self.audio[:100], b'\0' * 100
+        overlapping = []
+
+        class Stream(BytesIO):
+            # Второй PATCH с тем же смещением приходит, пока первый еще пишет файл
+            def read(stream, size=-1):
+                if not overlapping:
+                    overlapping.append(self.patch(url, 0, other))
+                return super().read(size)
+
+        self.assertEqual(chunked_upload.append_chunk(session, 0, Stream(first), len(first)), 100)
+        self.assertEqual(overlapping[0].status_code, 423)
+        # Устаревшая копия сессии не дает записать ту же часть повторно
+        stale = UploadSession.objects.get()
+        stale.upload_offset = 0
+        with self.assertRaises(chunked_upload.UploadError) as ctx:
+            chunked_upload.append_chunk(stale, 0, BytesIO(other), len(other))
+        self.assertEqual(ctx.exception.status, 409)
+        with open(chunked_upload.partial_path(session), 'rb') as f:
+            self.assertEqual(f.read(), first)
+
+    def test_failed_project_creation_keeps_upload_resumable(self):
+        url = self.create_upload()['Location']
+        session = UploadSession.objects.get()
+        with mock.patch.object(Project.objects, 'create', side_effect=RuntimeError('db is down')):
+            with self.assertRaises(RuntimeError):
+                self.patch(url, 0, self.audio)
+        self.assertFalse(Project.objects.exists())
+        self.assertIsNone(UploadSession.objects.get().project_id)
+        self.assertEqual(os.path.getsize(chunked_upload.partial_path(session)), len(self.audio))
+        self.assertFalse(os.listdir(default_storage.path('audio')))
+
+        # Повтор с последним смещением и пустым телом завершает загрузку
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                url, b'', headers={'Tus-Resumable': '1.0.0', 'Upload-Offset': str(len(self.audio))},
+                CONTENT_TYPE='application/offset+octet-stream', CONTENT_LENGTH='0',
+            )
+        self.assertEqual(response.status_code, 204)
+        project = Project.objects.get(id=response['Upload-Project-Id'])
+        with open(project.audio.path, 'rb') as f:
+            self.assertEqual(f.read(), self.audio)
+
+    def test_abandoned_sessions_expire(self):
+        stale_url = self.create_upload()['Location']
+        self.patch(stale_url, 0, self.audio[:100])
+        stale = UploadSession.objects.get()
+        UploadSession.objects.filter(id=stale.id).update(updated_at=timezone.now() - timedelta(days=2))
+        fresh_url = self.create_upload()['Location']
+
+        call_command('expire_uploads', stdout=StringIO())
+        self.assertFalse(os.path.exists(chunked_upload.partial_path(stale)))
+        self.assertEqual(self.client.head(stale_url).status_code, 404)
+        self.assertEqual(self.offset(fresh_url), 0)
+
+    def test_delete_removes_partial_file(self):
+        url = self.create_upload()['Location']
+        self.patch(url, 0, self.audio[:100])
+        path = chunked_upload.partial_path(UploadSession.objects.get())
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.client.head(url).status_code, 404)
+
+    def test_delete_waits_for_chunk_in_progress(self):
+        url = self.create_upload()['Location']
+        session = UploadSession.objects.get()
+        path = chunked_upload.partial_path(session)
+        deleting = []
+
+        class Stream(BytesIO):
+            # DELETE приходит, пока PATCH еще пишет файл
+            def read(stream, size=-1):
+                if not deleting:
+                    deleting.append(self.client.delete(url))
+                return super().read(size)
+
+        self.assertEqual(chunked_upload.append_chunk(session, 0, Stream(self.audio[:100]), 100), 100)
+        self.assertEqual(deleting[0].status_code, 423)
+        self.assertEqual(os.path.getsize(path), 100)
+        self.assertEqual(self.offset(url), 100)
+
+
+class AudioImportTests(PipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.audio = make_wav(2, seed=7)
+        self.file_server = FakeMVSEPServer(stems={'track': self.audio}).start()
+        self.addCleanup(self.file_server.stop)
+        self.audio_url = f"{self.file_server.url}/files/track"
+
+    def test_project_detail_returns_before_download(self):
+        with mock.patch.object(tasks.import_audio_task, 'delay') as delay:
+            response = self.client.get(
+                reverse('project_detail', args=[42]), {'project_name': 'My Song', 'audio_url': self.audio_url}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        project = Project.objects.get(id=42)
+        self.assertEqual(project.status, 'importing')
+        self.assertEqual(project.source_url, self.audio_url)
+        self.assertFalse(project.audio)
+        delay.assert_called_once_with(42)
+        self.assertEqual(self.file_server.request_count, 0)
+
+    def test_import_streams_file_and_starts_pipeline(self):
+        project = Project.objects.create(name='My Song', status='importing', source_url=self.audio_url)
+        tasks.import_audio_task.delay(project.id)
+
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'completed')
+        self.assertEqual(project.audio.name, 'audio/My_Song.wav')
+        with open(project.audio.path, 'rb') as f:
+            self.assertEqual(f.read(), self.audio)
+        self.assertEqual(project.audio_sha256, hashing.file_sha256(project.audio.path))
+        self.assertEqual(project.stage_timings.get(stage='upload').bytes_in, len(self.audio))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'temp_import', str(project.id))))
+
+    def test_oversized_file_fails_without_retry(self):
+        project = Project.objects.create(name='My Song', status='importing', source_url=self.audio_url)
+        with self.settings(AUDIO_IMPORT_MAX_BYTES=1000):
+            tasks.import_audio_task.delay(project.id)
+
+        project.refresh_from_db()
+        self.assertEqual(project.status, 'failed')
+        self.assertFalse(project.audio)
+        self.assertEqual(self.file_server.request_count, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'temp_import', str(project.id))))
+
+    def test_format_is_sniffed_from_content(self):
+        self.assertEqual(audio_import.sniff_extension(self.audio[:16]), 'wav')
+        self.assertEqual(audio_import.sniff_extension(b'ID3\x04\x00'), 'mp3')
+        self.assertEqual(audio_import.sniff_extension(b'\x00\x00\x00\x20ftypM4A '), 'm4a')
+        self.assertIsNone(audio_import.sniff_extension(b'<!DOCTYPE html>'))
+        self.assertEqual(audio_import.extension_from_headers('audio/flac', 'https://example.com/get?id=1'), 'flac')
+        self.assertIsNone(audio_import.extension_from_headers('text/html', 'https://example.com/page'))
+
+
+class StageTimingTests(PipelineMixin, TestCase):
+    def test_pipeline_records_stage_timings(self):
+        project = self.create_project()
+        tasks.process_audio_task.delay(project.id)
+
+        timings = {timing.stage: timing for timing in project.stage_timings.all()}
+        self.assertEqual(
+            set(timings),
+            {'separation_submit', 'separation_wait', 'separation_download', 'transcription', 'finalization'},
+        )
+        self.assertEqual(timings['separation_submit'].bytes_out, project.audio.size)
+        self.assertEqual(timings['separation_wait'].retries, 2)
+        self.assertEqual(timings['separation_download'].bytes_in, 2 * (4096 + 3))
+        self.assertEqual(timings['transcription'].bytes_out, 1000)
+        self.assertGreater(timings['finalization'].bytes_out, 0)
+        self.assertTrue(all(timing.success and timing.duration_seconds >= 0 for timing in timings.values()))
+
+    def test_failed_attempt_is_recorded_with_retry_count(self):
+        project = self.create_project()
+        self.transcribe.side_effect = [Exception('Whisper is down'), (make_whisper_response(random.Random(4)), self.upload_info())]
+        tasks.process_audio_task.delay(project.id)
+
+        attempts = list(project.stage_timings.filter(stage='transcription').values_list('success', 'retries', 'error'))
+        self.assertEqual(attempts, [(False, 0, 'Whisper is down'), (True, 1, '')])
+
+    def test_metrics_endpoint_renders_prometheus_text(self):
+        project = self.create_project()
+        started = timezone.now()
+        instrumentation.record_stage(project.id, 'transcription', started, started + timedelta(seconds=3), bytes_out=500)
+        instrumentation.record_stage(project.id, 'transcription', started, started + timedelta(seconds=45), success=False)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE subtitle_pipeline_stage_duration_seconds histogram', body)
+        self.assertIn('subtitle_pipeline_stage_duration_seconds_bucket{stage="transcription",le="2.5"} 0', body)
+        self.assertIn('subtitle_pipeline_stage_duration_seconds_bucket{stage="transcription",le="5"} 1', body)
+        self.assertIn('subtitle_pipeline_stage_duration_seconds_bucket{stage="transcription",le="+Inf"} 2', body)
+        self.assertIn('subtitle_pipeline_stage_duration_seconds_sum{stage="transcription"} 48.0', body)
+        self.assertIn('subtitle_pipeline_stage_runs_total{stage="transcription",result="failure"} 1', body)
+        self.assertIn('subtitle_pipeline_stage_bytes_out_total{stage="transcription"} 500', body)
+        self.assertIn('subtitle_projects{status="draft"} 1', body)
+
+        # Счетчики не уменьшаются, когда проект и его замеры удалены
+        project.delete()
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('subtitle_pipeline_stage_duration_seconds_bucket{stage="transcription",le="5"} 1', body)
+        self.assertIn('subtitle_pipeline_stage_runs_total{stage="transcription",result="failure"} 1', body)
+        self.assertIn('subtitle_pipeline_stage_bytes_out_total{stage="transcription"} 500', body)
+
+    def test_old_timings_are_pruned(self):
+        project = self.create_project()
+        now = timezone.now()
+        instrumentation.record_stage(project.id, 'upload', now - timedelta(days=40), now - timedelta(days=40))
+        recent = instrumentation.record_stage(project.id, 'upload', now - timedelta(days=1), now - timedelta(days=1))
+
+        with self.settings(STAGE_TIMING_RETENTION_DAYS=30):
+            self.assertEqual(tasks.prune_stage_timings_task.delay().get(), {'deleted': 1})
+        self.assertEqual(list(StageTiming.objects.all()), [recent])
+        self.assertEqual(StageCounter.objects.get(stage='upload').runs, 2)
+
+
+class TranscriptionCacheTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.response = make_whisper_response(random.Random(5), word_count=20)
+        client_patcher = mock.patch.object(whisper_client, 'client')
+        self.create = client_patcher.start().audio.transcriptions.create
+        self.addCleanup(client_patcher.stop)
+        self.create.return_value.to_dict.return_value = self.response
+
+    def write_vocal(self, name='vocal.mp3', content=b'ID3' + b'\0' * 100):
+        path = os.path.join(self.media_root, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_identical_request_is_served_from_cache(self):
+        path = self.write_vocal()
+        self.assertEqual(whisper_client.transcribe_audio_vocal(path), self.response)
+        # Тот же вокал под другим именем
+        copy_path = self.write_vocal('copy.mp3')
+        self.assertEqual(whisper_client.transcribe_audio_vocal(copy_path), self.response)
+
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(TranscriptionCacheEntry.objects.get().hits, 1)
+
+        # Счетчики в БД: их видит /metrics любого процесса, локальный кэш Django не при чем
+        caches['default'].clear()
+        self.assertEqual(transcription_cache.stats()['hits'], 1)
+        self.assertEqual(transcription_cache.stats()['misses'], 1)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('subtitle_transcription_cache_hits_total 1', body)
+        self.assertIn('subtitle_transcription_cache_misses_total 1', body)
+
+    def test_request_parameters_are_part_of_key(self):
+        path = self.write_vocal()
+        whisper_client.transcribe_audio_vocal(path)
+        params = dict(whisper_client.TRANSCRIPTION_PARAMS, temperature=0.0)
+        with mock.patch.object(whisper_client, 'TRANSCRIPTION_PARAMS', params):
+            whisper_client.transcribe_audio_vocal(path)
+
+        self.assertEqual(self.create.call_count, 2)
+        self.assertEqual(TranscriptionCacheEntry.objects.count(), 2)
+
+    def test_cache_can_be_bypassed(self):
+        path = self.write_vocal()
+        whisper_client.transcribe_audio_vocal(path)
+        whisper_client.transcribe_audio_vocal(path, use_cache=False)
+        with self.settings(WHISPER_CACHE_ENABLED=False):
+            whisper_client.transcribe_audio_vocal(path)
+
+        self.assertEqual(self.create.call_count, 3)
+        self.assertEqual(transcription_cache.stats()['hits'], 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        paths = [self.write_vocal(f'vocal{i}.mp3', bytes([i]) * 100) for i in range(3)]
+        entry_size = len(json.dumps(self.response, separators=(',', ':')).encode('utf-8'))
+        with self.settings(WHISPER_CACHE_MAX_BYTES=entry_size * 2):
+            whisper_client.transcribe_audio_vocal(paths[0])
+            whisper_client.transcribe_audio_vocal(paths[1])
+            # paths[0] использован последним, поэтому вытесняется paths[1]
+            whisper_client.transcribe_audio_vocal(paths[0])
+            whisper_client.transcribe_audio_vocal(paths[2])
+
+        cached = set(TranscriptionCacheEntry.objects.values_list('vocal_sha256', flat=True))
+        self.assertEqual(cached, {hashing.file_sha256(paths[0]), hashing.file_sha256(paths[2])})
+        self.assertEqual(transcription_cache.stats()['size_bytes'], entry_size * 2)
+
+
+class ChunkedTranscriptionTests(SimpleTestCase):
+    def test_split_points_fall_into_quiet_frames(self):
+        # 100 с по 0.05 с; тишина на 27 и 55 секунде
+        energies = [100.0] * 2000
+        energies[540] = 1.0
+        energies[1100] = 1.0
+        points = audio_tools.choose_split_points(energies, 0.05, chunk_seconds=30, search_seconds=5)
+        self.assertEqual(points[:2], [27.0, 55.0])
+        chunks = audio_tools.plan_chunks(100.0, points, overlap_seconds=1.5)
+        self.assertEqual(chunks[0], {'start': 0.0, 'end': 28.5, 'cut_start': 0.0, 'cut_end': 27.0})
+        self.assertEqual(chunks[-1]['end'], 100.0)
+        self.assertTrue(all(chunk['end'] - chunk['start'] <= 33 for chunk in chunks))
+
+    def test_chunks_are_merged_without_duplicates(self):
+        response = make_whisper_response(random.Random(6), word_count=400)
+        duration = response['words'][-1]['end'] + 1
+        energies = [1.0] * int(duration / 0.05)
+
+        windows = {}
+
+        def fake_extract(file_path, start, duration, output_path):
+            with open(output_path, 'wb') as f:
+                f.write(b'\0' * 10)
+            windows[output_path] = (start, start + duration)
+            return output_path
+
+        def fake_transcription(chunk_path):
+            # Фрагмент "слышит" все слова, целиком попавшие в его окно
+            start, end = windows[chunk_path]
+            def local(items):
+                return [
+                    dict(item, start=round(item['start'] - start, 3), end=round(item['end'] - start, 3))
+                    for item in items
+                    if item['start'] >= start and item['end'] <= end
+                ]
+            return {'language': 'english', 'words': local(response['words']), 'segments': local(response['segments'])}
+
+        with mock.patch.object(audio_tools, 'frame_energies', return_value=energies), \
+                mock.patch.object(audio_tools, 'extract_chunk', side_effect=fake_extract), \
+                mock.patch.object(whisper_client, 'request_transcription', side_effect=fake_transcription) as request, \
+                self.settings(WHISPER_CHUNK_SECONDS=20, WHISPER_CHUNK_SEARCH_SECONDS=5, WHISPER_CHUNK_OVERLAP_SECONDS=2):
+            merged, upload_bytes = whisper_client.transcribe_chunked('/vocal.mp3')
+
+        self.assertGreater(request.call_count, 3)
+        self.assertEqual(upload_bytes, 10 * request.call_count)
+        self.assertEqual([w['word'] for w in merged['words']], [w['word'] for w in response['words']])
+        for merged_word, word in zip(merged['words'], response['words']):
+            self.assertAlmostEqual(merged_word['start'], word['start'], places=3)
+        self.assertEqual([s['id'] for s in merged['segments']], list(range(len(merged['segments']))))
+        self.assertEqual(merged['language'], 'english')
+
+
+class SilenceTrimmingTests(SimpleTestCase):
+    def test_voiced_regions_skip_long_pauses_only(self):
+        # 0.1 с кадры: голос 10-20 с и 21-30 с, тишина 0-10 с и 30-60 с
+        energies = [1.0] * 600
+        for index in list(range(100, 200)) + list(range(210, 300)):
+            energies[index] = 1000.0
+        regions = audio_tools.voiced_regions(energies, 0.1, 0.05, min_silence_seconds=2, padding_seconds=0.3)
+        self.assertEqual(regions, [(9.7, 30.3)])
+
+        offset_map = audio_tools.build_offset_map([(9.7, 30.3), (40.0, 45.0)])
+        self.assertEqual(offset_map, [[0.0, 9.7, 20.6], [20.6, 40.0, 5.0]])
+        self.assertEqual(audio_tools.map_time(1.0, offset_map), 10.7)
+        self.assertEqual(audio_tools.map_time(20.6, offset_map), 40.0)
+        self.assertEqual(audio_tools.map_time(20.6, offset_map, is_end=True), 30.3)
+
+    def test_compacted_word_times_round_trip_without_drift(self):
+        # Сотни участков с границами не по сетке миллисекунд
+        rng = random.Random(5)
+        regions, position = [], 0.0
+        for _ in range(400):
+            start = position + rng.uniform(0.5, 3.0)
+            position = start + rng.uniform(0.2, 4.0)
+            regions.append((start, position))
+
+        rate = audio_tools.COMPACT_SAMPLE_RATE
+        samples = audio_tools.region_samples(regions)
+        graph = audio_tools.compact_filter_graph(regions)
+        self.assertIn(f"atrim=start_sample={samples[-1][0]}:end_sample={samples[-1][1]},asetpts=PTS-STARTPTS", graph)
+        self.assertNotIn('aselect', graph)
+
+        # Сжатый файл — это подряд идущие отсчеты [start_sample, end_sample) каждого участка,
+        # время слов Whisper отдает с точностью до миллисекунды
+        offset_map = audio_tools.build_offset_map(regions)
+        compact_samples = 0
+        for start_sample, end_sample in samples:
+            # Точки в миллисекунде от стыка: сам стык при округлении неоднозначен
+            for original_sample in (start_sample + 16, (start_sample + end_sample) // 2, end_sample - 17):
+                compact = round((compact_samples + original_sample - start_sample) / rate, 3)
+                self.assertAlmostEqual(audio_tools.map_time(compact, offset_map), original_sample / rate, delta=0.0016)
+            compact_samples += end_sample - start_sample
+
+    def test_timestamps_are_mapped_back_to_original_timeline(self):
+        offset_map = [[0.0, 12.0, 10.0], [10.0, 50.0, 5.0]]
+        response = {
+            'text': 'a b',
+            'duration': 15.0,
+            'words': [{'word': 'a', 'start': 1.0, 'end': 2.5}, {'word': 'b', 'start': 10.5, 'end': 11.0}],
+            'segments': [{'id': 0, 'start': 1.0, 'end': 10.0, 'text': 'a'}, {'id': 1, 'start': 10.0, 'end': 11.0, 'text': 'b'}],
+        }
+        with mock.patch.object(whisper_client, 'trim_silence', return_value=('/compact.mp3', offset_map)), \
+                mock.patch.object(whisper_client, 'transcribe_file', return_value=(response, 100)) as transcribe:
+            result, upload = whisper_client.transcribe_vocal_track(__file__, use_cache=False)
+
+        transcribe.assert_called_once_with('/compact.mp3')
+        self.assertEqual(upload['offset_map'], offset_map)
+        self.assertEqual([(w['start'], w['end']) for w in result['words']], [(13.0, 14.5), (50.5, 51.0)])
+        self.assertEqual([(s['start'], s['end']) for s in result['segments']], [(13.0, 22.0), (50.0, 51.0)])
+        self.assertEqual(result['duration'], 55.0)
+
+
+class UploadPreparationTests(SimpleTestCase):
+    def test_vocal_is_transcoded_to_speech_opus(self):
+        with mock.patch.object(audio_tools, 'ffmpeg_available', return_value=True), \
+                mock.patch.object(whisper_client, 'trim_silence', side_effect=lambda path, output_path: (path, None)) as trim, \
+                mock.patch.object(audio_tools, 'transcode_for_speech', side_effect=lambda path, output_path: output_path) as transcode:
+            upload_path, offset_map = whisper_client.prepare_upload('/vocal.mp3', '/tmp/upload')
+
+        self.assertEqual(trim.call_args.args[1], '/tmp/upload/compact.ogg')
+        transcode.assert_called_once_with('/vocal.mp3', '/tmp/upload/speech.ogg')
+        self.assertEqual(upload_path, '/tmp/upload/speech.ogg')
+        self.assertIsNone(offset_map)
+
+    def test_transcoding_can_be_disabled(self):
+        with mock.patch.object(audio_tools, 'ffmpeg_available', return_value=True), \
+                mock.patch.object(whisper_client, 'trim_silence', side_effect=lambda path, output_path: (path, None)), \
+                mock.patch.object(audio_tools, 'transcode_for_speech') as transcode, \
+                self.settings(WHISPER_TRANSCODE=False):
+            upload_path, _ = whisper_client.prepare_upload('/vocal.mp3', '/tmp/upload')
+
+        transcode.assert_not_called()
+        self.assertEqual(upload_path, '/vocal.mp3')
+
+
+class FakeWhisperTests(SimpleTestCase):
+    def test_transcription_request_against_fake_server(self):
+        with FakeWhisperServer(latency=0.01) as server, tempfile.NamedTemporaryFile(suffix='.wav') as audio:
+            audio.write(make_wav(0.5))
+            audio.flush()
+            with mock.patch.object(whisper_client, 'client', OpenAI(api_key='test', base_url=server.base_url)):
+                response = whisper_client.request_transcription(audio.name)
+
+        self.assertEqual(response['words'], server.transcription['words'])
+        self.assertEqual(server.request_count, 1)
+        self.assertGreater(server.received_bytes, 0)
+
+    def test_failure_rate_returns_service_unavailable(self):
+        with FakeMVSEPServer(failure_rate=1.0) as server:
+            response = requests.post(f"{server.base_url}/create", data=b'')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(server.failure_count, 1)
+
+
+class BenchmarkingTests(PipelineMixin, TestCase):
+    def test_percentiles_interpolate(self):
+        self.assertEqual(benchmarking.percentile([1, 2, 3, 4], 50), 2.5)
+        self.assertEqual(benchmarking.percentile([5], 99), 5)
+        self.assertEqual(benchmarking.summarize([1.0, 3.0])['mean'], 2.0)
+
+    def test_stage_timer_records_every_stage(self):
+        project = self.create_project()
+        with benchmarking.StageTimer() as timer:
+            tasks.process_audio_task.delay(project.id)
+
+        stages = timer.durations[project.id]
+        self.assertEqual(set(stages), {'dispatch', 'separation', 'transcription', 'finalization'})
+        self.assertTrue(all(seconds >= 0 for seconds in stages.values()))
+
+
+class RendererBenchmarkTests(SimpleTestCase):
+    def test_synthetic_transcripts_cover_render_paths(self):
+        with_segments = benchmarking.make_synthetic_transcript(2000, with_segments=True, with_pauses=True)
+        words_only = benchmarking.make_synthetic_transcript(2000, with_segments=False, with_pauses=False)
+
+        self.assertEqual(len(with_segments['words']), 2000)
+        self.assertEqual(sum(len(s['text'].split()) for s in with_segments['segments']), 2000)
+        self.assertNotIn('segments', words_only)
+        # Длинные паузы дают ноты в ASS, без пауз нот нет
+        self.assertIn('♫', subtitle_renderer.render_response(with_segments, 'ass'))
+        self.assertNotIn('♫', subtitle_renderer.render_response(words_only, 'ass'))
+
+    def test_regressions_against_baseline_fail_the_command(self):
+        baseline_path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(baseline_path))
+        options = {'sizes': '100', 'repeat': 1, 'baseline': baseline_path, 'stdout': StringIO()}
+
+        call_command('benchmark_renderer', save_baseline=True, **options)
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        self.assertIn('100:words+pauses:ass', baseline)
+
+        # Baseline "быстрее" в 1000 раз и с другим размером вывода
+        for result in baseline.values():
+            result['seconds'] /= 1000
+            result['output_bytes'] = 1
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f)
+
+        with self.assertRaisesMessage(CommandError, '100:segments:srt: размер вывода'):
+            call_command('benchmark_renderer', **options)
@@ -0,0 +1,40 @@
+"""
+Накопление времени по метрикам в пределах текущего запроса.
+
+Код, которому есть что замерить (рендер субтитров, запросы к БД), оборачивает
+блок в measure(name); вне collect() замер ничего не делает. Собранные значения
+отдает в заголовке Server-Timing request_profiling.ServerTimingMiddleware.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Накопленное время текущего запроса: метрика -> [секунды, количество]
+_timings = ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def collect():
+    """Включает замеры в блоке with и отдает словарь, куда они накапливаются"""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def measure(name):
+    """Добавляет время блока к метрике name текущего запроса (вне collect() ничего не делает)"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += time.perf_counter() - started
+        entry[1] += 1
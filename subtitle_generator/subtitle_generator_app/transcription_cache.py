@@ -0,0 +1,103 @@
+"""
+Постоянный кэш результатов Whisper.
+
+Ответ зависит только от содержимого вокала и параметров запроса, поэтому
+повторная транскрипция того же файла с теми же параметрами берется из БД.
+Суммарный размер записей ограничен WHISPER_CACHE_MAX_BYTES: при превышении
+удаляются давно не использованные записи. Счетчики попаданий и промахов
+хранятся в БД (TranscriptionCacheCounter): считает воркер, а /metrics отдает
+веб-процесс, и вытеснение записей счетчики не уменьшает.
+"""
+import hashlib
+import json
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import TranscriptionCacheCounter, TranscriptionCacheEntry
+
+
+def cache_key(vocal_sha256, params):
+    """Ключ записи: SHA-256 от хэша вокала и канонического JSON параметров запроса"""
+    payload = json.dumps({'vocal': vocal_sha256, 'params': params}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_enabled(use_cache=None):
+    """use_cache=None — по настройке WHISPER_CACHE_ENABLED, True/False — явно"""
+    if use_cache is None:
+        return getattr(settings, 'WHISPER_CACHE_ENABLED', True)
+    return use_cache
+
+
+def _count(name):
+    counter = TranscriptionCacheCounter.objects.filter(name=name)
+    if counter.update(value=F('value') + 1):
+        return
+    try:
+        with transaction.atomic():
+            TranscriptionCacheCounter.objects.create(name=name, value=1)
+    except IntegrityError:
+        # Строку успел создать параллельный воркер
+        counter.update(value=F('value') + 1)
+
+
+def get(key):
+    """
+    Возвращает сохраненные (ответ Whisper, карту смещений вырезанной тишины)
+    или None (и обновляет счетчики)
+    """
+    entry = TranscriptionCacheEntry.objects.filter(key=key).only('id', 'response', 'offset_map').first()
+    if entry is None:
+        _count('misses')
+        return None
+
+    TranscriptionCacheEntry.objects.filter(id=entry.id).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    _count('hits')
+    return entry.response, entry.offset_map
+
+
+def store(key, vocal_sha256, model, response, offset_map=None):
+    """Сохраняет ответ Whisper и вытесняет старые записи сверх лимита"""
+    size = len(json.dumps(response, separators=(',', ':')).encode('utf-8'))
+    TranscriptionCacheEntry.objects.update_or_create(
+        key=key,
+        defaults={
+            'vocal_sha256': vocal_sha256,
+            'model': model,
+            'response': response,
+            'offset_map': offset_map,
+            'size_bytes': size,
+            'last_used_at': timezone.now(),
+        },
+    )
+    evict(getattr(settings, 'WHISPER_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+
+def evict(max_bytes):
+    """Удаляет давно не использованные записи, пока суммарный размер больше max_bytes"""
+    total = TranscriptionCacheEntry.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+    if total <= max_bytes:
+        return 0
+
+    evicted_ids = []
+    for entry_id, size in TranscriptionCacheEntry.objects.order_by('last_used_at', 'id').values_list('id', 'size_bytes').iterator():
+        if total <= max_bytes:
+            break
+        evicted_ids.append(entry_id)
+        total -= size
+
+    TranscriptionCacheEntry.objects.filter(id__in=evicted_ids).delete()
+    return len(evicted_ids)
+
+
+def stats():
+    """Счетчики попаданий/промахов и текущий объем кэша"""
+    counters = dict(TranscriptionCacheCounter.objects.values_list('name', 'value'))
+    aggregate = TranscriptionCacheEntry.objects.aggregate(total=Sum('size_bytes'))
+    return {
+        'hits': counters.get('hits', 0),
+        'misses': counters.get('misses', 0),
+        'entries': TranscriptionCacheEntry.objects.count(),
+        'size_bytes': aggregate['total'] or 0,
+    }
@@ -17,7 +17,10 @@ urlpatterns = [
     path('api/project/<int:project_id>/subtitle-content/', api_views.get_subtitle_content, name='subtitle_content'),
     path('api/project/<int:project_id>/update-subtitle/', api_views.update_subtitle_content, name='update_subtitle_content'),
     path('api/projects/', api_views.list_projects, name='list_projects'),
+    path('api/uploads/', api_views.create_upload, name='create_upload'),
+    path('api/uploads/<uuid:upload_id>/', api_views.upload_session, name='upload_session'),
     path('api/project/<int:project_id>/download-subtitle/', api_views.download_subtitle, name='download_subtitle'),
     path('api/project/<int:project_id>/download-srt/', api_views.download_srt, name='download_srt'),
     path('api/project/<int:project_id>/download-ass/', api_views.download_ass, name='download_ass'),
+    path('metrics/', api_views.metrics, name='metrics'),
 ]
\ No newline at end of file
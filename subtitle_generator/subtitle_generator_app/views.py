@@ -1,18 +1,21 @@
 import os
 import uuid
-import requests
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import HttpResponse, Http404
 from django.contrib import messages
 from django.db.models import ProtectedError
 from django.views.decorators.clickjacking import xframe_options_sameorigin
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.utils import timezone
 from .models import Project
 from .forms import ProjectForm
-from .ranged_file_response import ranged_file_response
+from .ranged_file_response import offloaded_file_response, ranged_file_response
+from . import instrumentation, stem_cache
+from .subtitle_cache import invalidate_project
 from .services import audio_separator, whisper_client
-from .tasks import process_audio_task
+from .tasks import import_audio_task, process_audio_task
 
 def project_list(request):
     """Страница со списком всех проектов"""
@@ -29,13 +32,12 @@ def project_delete(request, project_id):
             # Удаляем связанные файлы, если они существуют
             if project.audio:
                 project.audio.delete(save=False)
-            if project.vocal_audio:
-                project.vocal_audio.delete(save=False)
-            if project.instrumental_audio:
-                project.instrumental_audio.delete(save=False)
+            # Стемы могут использоваться другими проектами с тем же аудио
+            stem_cache.release(project)
                 
-            # Удаляем сам проект
+            # Удаляем сам проект и его отрендеренные субтитры из кэша
             project.delete()
+            invalidate_project(project_id)
             messages.success(request, f'Проект "{project_name}" успешно удален!')
         except ProtectedError:
             messages.error(request, f'Проект "{project_name}" не может быть удален, так как на него ссылаются другие объекты.')
@@ -66,64 +68,28 @@ def project_detail(request, project_id):
         if not project_name or not audio_url:
             messages.error(request, 'Параметры project_name и audio_url обязательны для создания проекта')
             return redirect('project_list')
-        
+
         try:
-            # Шаг 1: Создаем проект с конкретным ID
-            project = Project.objects.create(
-                id=project_id,
-                name=project_name,
-                status='draft'
-            )
-            
-            # Шаг 2: Скачиваем аудио по URL
-            response = requests.get(audio_url, timeout=60)
-            response.raise_for_status()  # Проверка на ошибки HTTP
-            
-            # Определяем расширение файла из URL или Content-Type
-            content_type = response.headers.get('content-type', '').lower()
-            extension = 'mp3'  # по умолчанию
-            
-            if 'audio/wav' in content_type or audio_url.lower().endswith('.wav'):
-                extension = 'wav'
-            elif 'audio/ogg' in content_type or audio_url.lower().endswith('.ogg'):
-                extension = 'ogg'
-            elif 'audio/mp4' in content_type or 'audio/m4a' in content_type or audio_url.lower().endswith('.m4a'):
-                extension = 'm4a'
-            elif 'audio/flac' in content_type or audio_url.lower().endswith('.flac'):
-                extension = 'flac'
-            
-            # Шаг 3: Сохраняем аудио файл в проект
-            audio_content = ContentFile(response.content)
-            # Генерируем чистое имя файла без uuid
-            clean_name = "".join(c for c in project_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            clean_name = clean_name.replace(' ', '_')
-            audio_filename = f"{clean_name}.{extension}"
-            project.audio.save(audio_filename, audio_content, save=False)
-            project.save()
-            
-            # Шаг 4: Запускаем автоматическую обработку в фоне
-            process_audio_task.delay(project.id)
-            
-            messages.success(
-                request,
-                f'Проект "{project_name}" создан! Обработка аудио началась автоматически.'
-            )
-            
-        except requests.RequestException as e:
-            # Ошибка при скачивании аудио
-            messages.error(request, f'Ошибка загрузки аудио: {str(e)}')
-            # Удаляем созданный проект
-            if project and project.id:
-                project.delete()
+            URLValidator(schemes=['http', 'https'])(audio_url)
+        except ValidationError:
+            messages.error(request, 'Параметр audio_url должен быть http(s) ссылкой')
             return redirect('project_list')
-            
-        except Exception as e:
-            # Любая другая ошибка
-            messages.error(request, f'Ошибка создания проекта: {str(e)}')
-            if project and project.id:
-                project.delete()
-            return redirect('project_list')
-    
+        
+        # Создаем проект с конкретным ID, аудио скачивается в фоне:
+        # страница сразу показывает статус импорта
+        project = Project.objects.create(
+            id=project_id,
+            name=project_name,
+            status='importing',
+            source_url=audio_url
+        )
+        import_audio_task.delay(project.id)
+
+        messages.success(
+            request,
+            f'Проект "{project_name}" создан! Аудио загружается, обработка начнется автоматически.'
+        )
+
     # Отображаем страницу проекта
     return render(request, 'subtitle_generator_app/project_detail.html', {'project': project})
 
@@ -143,8 +109,11 @@ def project_create(request):
                     clean_filename = "".join(c for c in project.name if c.isalnum() or c in (' ', '-', '_')).rstrip()
                     clean_filename = clean_filename.replace(' ', '_')
                     audio_filename = f"{clean_filename}.{file_extension}"
+                    upload_started = timezone.now()
                     project.audio.save(audio_filename, audio_file, save=False)
+                    project.update_audio_sha256()
                     project.save()
+                    instrumentation.record_stage(project.id, 'upload', upload_started, bytes_in=project.audio.size)
                     
                     # Запускаем обработку в фоне
                     process_audio_task.delay(project.id)
@@ -190,4 +159,8 @@ def serve_audio(request, project_id):
     elif file_path.lower().endswith('.m4a'):
         content_type = 'audio/mp4'
     
+    # В production файл отдает nginx/Apache, Django только проверяет доступ
+    if settings.MEDIA_OFFLOAD_MODE:
+        return offloaded_file_response(file_path, content_type)
+    
     return ranged_file_response(request, file_path, content_type)